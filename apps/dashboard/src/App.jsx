@@ -14,6 +14,30 @@ const API_KEY = import.meta.env.VITE_API_KEY;
 axios.defaults.baseURL = API_URL;
 axios.defaults.headers.common['X-API-Key'] = API_KEY;
 
+// Uploads an image and returns its public URL. Prefers a presigned direct-to-bucket PUT
+// (S3 storage) and falls back to streaming through the API when the provider can't presign.
+async function uploadImage(file) {
+  try {
+    const { data } = await axios.post('/upload/presign', {
+      filename: file.name,
+      content_type: file.type,
+    });
+    // Plain fetch: the bucket must not receive our X-API-Key header
+    const res = await fetch(data.upload_url, { method: 'PUT', headers: data.headers, body: file });
+    if (!res.ok) throw new Error(`Direct upload failed (${res.status})`);
+    return data.url;
+  } catch (err) {
+    if (err.response?.status !== 501) throw err;
+  }
+
+  const formData = new FormData();
+  formData.append('file', file);
+  const res = await axios.post('/upload', formData, {
+    headers: { 'Content-Type': 'multipart/form-data' }
+  });
+  return res.data.url;
+}
+
 // --- Brand Management Component ---
 function BrandManager({ onBack }) {
   const [url, setUrl] = useState("");
@@ -45,14 +69,9 @@ function BrandManager({ onBack }) {
     if (!file) return;
 
     setIsUploadingLogo(true);
-    const formData = new FormData();
-    formData.append('file', file);
 
     try {
-      const res = await axios.post('/upload', formData, {
-        headers: { 'Content-Type': 'multipart/form-data' }
-      });
-      setLogoUrl(res.data.url);
+      setLogoUrl(await uploadImage(file));
     } catch (err) {
       console.error("Logo upload failed", err);
       alert("Failed to upload logo");
@@ -387,6 +406,37 @@ function App() {
     }
   }, [posts, selectedCampaign]);
 
+  // Live status changes (provider callbacks) instead of polling published/failed posts
+  useEffect(() => {
+    if (!selectedCampaign || typeof EventSource === 'undefined') return;
+    let source = null;
+    let closed = false;
+    let retry = null;
+    // The API key stays in headers: streams open with a short-lived token, fetched again on every reconnect
+    const open = async () => {
+      try {
+        const params = new URLSearchParams({ campaign_id: selectedCampaign.id });
+        const res = await axios.post('/events/token');
+        if (res.data.token) params.set('token', res.data.token);
+        if (closed) return;
+        source = new EventSource(`${API_URL}/events/posts?${params}`);
+        source.addEventListener('post_status', () => fetchPosts(selectedCampaign.id, true));
+        source.onerror = () => {
+          // Transient drops reconnect by themselves; a rejected (expired) token closes the stream
+          if (source.readyState === EventSource.CLOSED && !closed) retry = setTimeout(open, 5000);
+        };
+      } catch (err) {
+        if (!closed) retry = setTimeout(open, 5000);
+      }
+    };
+    open();
+    return () => {
+      closed = true;
+      clearTimeout(retry);
+      if (source) source.close();
+    };
+  }, [selectedCampaign]);
+
   // --- Handlers ---
   const fetchCampaigns = async () => {
     try {
@@ -419,14 +469,9 @@ function App() {
     if (!file) return;
 
     setIsUploading(true);
-    const formData = new FormData();
-    formData.append('file', file);
 
     try {
-      const res = await axios.post('/upload', formData, {
-        headers: { 'Content-Type': 'multipart/form-data' }
-      });
-      setUploadedImageUrl(res.data.url);
+      setUploadedImageUrl(await uploadImage(file));
     } catch (err) {
       console.error("Upload failed", err);
       alert("Failed to upload image");
@@ -806,7 +851,8 @@ function App() {
                                 "px-2.5 py-0.5 rounded-full text-xs font-semibold uppercase tracking-wide",
                                 post.status === 'APPROVED' ? "bg-green-100 text-green-700" :
                                   post.status === 'PUBLISHED' ? "bg-blue-100 text-blue-700" :
-                                    "bg-yellow-100 text-yellow-700"
+                                    post.status === 'PUBLISH_FAILED' ? "bg-red-100 text-red-700" :
+                                      "bg-yellow-100 text-yellow-700"
                               )}>
                                 {post.status}
                               </span>
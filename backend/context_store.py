@@ -0,0 +1,194 @@
+import os
+import json
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+import asyncpg
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_CACHE_SIZE = int(os.getenv("CONTEXT_CACHE_SIZE", "512"))
+CONTEXT_CACHE_TTL = float(os.getenv("CONTEXT_CACHE_TTL", "300"))
+# Channel fed by the brands/campaigns triggers (see database/cloud_init.sql)
+INVALIDATION_CHANNEL = "context_invalidation"
+
+_BRANDS_KEY = "brands"
+
+
+class _LoadAbandoned(Exception):
+    """Set on a shared load whose owner was cancelled; waiters retry instead of seeing a cancellation."""
+
+
+@dataclass
+class CampaignContext:
+    campaign_id: int
+    master_prompt: str
+    brand_id: Optional[int]
+    brand_dna: Dict[str, Any] = field(default_factory=dict)
+
+
+def _parse_dna(raw) -> Dict[str, Any]:
+    if not raw:
+        return {}
+    return json.loads(raw) if isinstance(raw, str) else raw
+
+
+class ContextStore:
+    """
+    In-process TTL/LRU cache of parsed campaign + brand context and the brand list.
+    Entries are dropped on local writes and on NOTIFYs from the brands/campaigns triggers,
+    so every worker process sees changes made by the others; the TTL bounds staleness if
+    the listener is unavailable (e.g. behind pgbouncer transaction pooling).
+    """
+    def __init__(self, maxsize: int = CONTEXT_CACHE_SIZE, ttl: float = CONTEXT_CACHE_TTL):
+        self._cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._inflight: Dict[Any, asyncio.Future] = {}
+        # Bumped on every invalidation so a load racing with a write never caches stale data
+        self._version = 0
+        self._listener_conn: Optional[asyncpg.Connection] = None
+        self._listener_dsn: Optional[str] = None
+
+    async def _get_or_load(self, key, loader):
+        while True:
+            if key in self._cache:
+                return self._cache[key]
+
+            # Single-flight: concurrent misses for the same key share one query
+            pending = self._inflight.get(key)
+            if pending is None:
+                break
+            try:
+                return await asyncio.shield(pending)
+            except _LoadAbandoned:
+                # The loading task was cancelled (e.g. its generation was superseded); load it ourselves
+                continue
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        version = self._version
+        try:
+            value = await loader()
+            if version == self._version:
+                self._cache[key] = value
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            # Cancelling the shared future would cancel every waiter along with the owner
+            future.set_exception(_LoadAbandoned())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Avoid "exception was never retrieved" warnings when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def get_campaign_context(self, pool, campaign_id: int) -> Optional[CampaignContext]:
+        async def load():
+            async with pool.acquire() as conn:
+                row = await conn.fetchrow("""
+                    SELECT c.id, c.master_prompt, c.brand_id, b.brand_dna
+                    FROM campaigns c
+                    LEFT JOIN brands b ON c.brand_id = b.id
+                    WHERE c.id = $1
+                """, campaign_id)
+            if not row:
+                return None
+            return CampaignContext(
+                campaign_id=row['id'],
+                master_prompt=row['master_prompt'] or "",
+                brand_id=row['brand_id'],
+                brand_dna=_parse_dna(row['brand_dna'])
+            )
+        return await self._get_or_load(("campaign", campaign_id), load)
+
+    async def list_brands(self, pool) -> List[Dict[str, Any]]:
+        async def load():
+            async with pool.acquire() as conn:
+                rows = await conn.fetch("SELECT * FROM brands ORDER BY created_at DESC")
+            brands = []
+            for row in rows:
+                brand = dict(row)
+                if brand['brand_dna']:
+                    brand['brand_dna'] = _parse_dna(brand['brand_dna'])
+                brands.append(brand)
+            return brands
+        return await self._get_or_load(_BRANDS_KEY, load)
+
+    def invalidate_campaign(self, campaign_id: int):
+        self._version += 1
+        self._cache.pop(("campaign", campaign_id), None)
+
+    def invalidate_brand(self, brand_id: Optional[int] = None):
+        self._version += 1
+        self._cache.pop(_BRANDS_KEY, None)
+        for key, value in list(self._cache.items()):
+            if isinstance(value, CampaignContext) and (brand_id is None or value.brand_id == brand_id):
+                self._cache.pop(key, None)
+
+    def clear(self):
+        self._version += 1
+        self._cache.clear()
+
+    def _on_notify(self, conn, pid, channel, payload: str):
+        table, _, raw_id = payload.partition(":")
+        try:
+            row_id = int(raw_id)
+        except ValueError:
+            self.clear()
+            return
+        if table == "brands":
+            self.invalidate_brand(row_id)
+        elif table == "campaigns":
+            self.invalidate_campaign(row_id)
+
+    def _on_listener_lost(self, conn):
+        # Notifications may have been missed while disconnected, so drop everything and reconnect
+        logger.warning("Context invalidation listener disconnected; clearing context cache")
+        self._listener_conn = None
+        self.clear()
+        if self._listener_dsn:
+            asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _connect_listener(self) -> bool:
+        try:
+            conn = await asyncpg.connect(self._listener_dsn)
+            await conn.add_listener(INVALIDATION_CHANNEL, self._on_notify)
+            conn.add_termination_listener(self._on_listener_lost)
+            self._listener_conn = conn
+            logger.info("Listening for context invalidations on '%s'", INVALIDATION_CHANNEL)
+            return True
+        except Exception as e:
+            logger.warning("Context invalidation listener unavailable, relying on TTL (%ss): %s", self._cache.ttl, e)
+            return False
+
+    async def _reconnect(self, delay: float = 5.0):
+        while self._listener_dsn and self._listener_conn is None:
+            await asyncio.sleep(delay)
+            if self._listener_dsn and await self._connect_listener():
+                # Anything cached during the outage may have missed a notification
+                self.clear()
+                return
+
+    async def start_listener(self, dsn: str):
+        """Subscribes to invalidation NOTIFYs on a dedicated (non-pooled) connection."""
+        self._listener_dsn = dsn
+        if not await self._connect_listener():
+            asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def stop_listener(self):
+        self._listener_dsn = None
+        if self._listener_conn is not None:
+            conn, self._listener_conn = self._listener_conn, None
+            conn.remove_termination_listener(self._on_listener_lost)
+            try:
+                await conn.close()
+            except Exception as e:
+                logger.warning("Error closing context invalidation listener: %s", e)
+
+
+context_store = ContextStore()
@@ -0,0 +1,330 @@
+import os
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+from backend.metrics import GENERATION_QUEUE_DEPTH, GENERATION_QUEUE_WAIT_SECONDS, GENERATION_INFLIGHT, GENERATION_CANCELLED_TOTAL
+
+logger = logging.getLogger(__name__)
+
+# api: serve HTTP only, generation runs in worker processes
+# worker: consume the generation queue (HTTP is only used for health/metrics)
+# all: both in one process (default, and what the desktop app / docker-compose dev use)
+APP_ROLE = os.getenv("APP_ROLE", "all").lower()
+GENERATION_CONCURRENCY = int(os.getenv("GENERATION_CONCURRENCY", "4"))
+GENERATION_POLL_INTERVAL = float(os.getenv("GENERATION_POLL_INTERVAL", "1.0"))
+# A claim older than this is considered abandoned (crashed or killed process) and picked up again
+GENERATION_CLAIM_LEASE = int(os.getenv("GENERATION_CLAIM_LEASE", "900"))
+# On shutdown, in-flight generations get this long to finish before they are handed back to the queue
+GENERATION_DRAIN_TIMEOUT = float(os.getenv("GENERATION_DRAIN_TIMEOUT", "120"))
+# Slots per process that bulk work can never take, so a regenerate click starts right away during a bulk run
+GENERATION_INTERACTIVE_RESERVED = int(os.getenv("GENERATION_INTERACTIVE_RESERVED", "1"))
+# Bulk lane round-robins between campaigns (or brands) so one large run can't starve the others
+GENERATION_FAIR_SHARE_BY = os.getenv("GENERATION_FAIR_SHARE_BY", "campaign").lower()
+# A repeat request for a post whose generation started less than this long ago joins that run instead of restarting it
+GENERATION_COALESCE_WINDOW = float(os.getenv("GENERATION_COALESCE_WINDOW", "15"))
+
+# interactive: a user is waiting on this post (regenerate); bulk: posts created for a campaign run
+LANES = ("interactive", "bulk")
+_FAIR_SHARE_KEYS = {"campaign": "p.campaign_id", "brand": "c.brand_id"}
+
+_CLAIMABLE = """
+    generation_requested_at IS NOT NULL
+    AND (generation_claimed_at IS NULL OR generation_claimed_at < CURRENT_TIMESTAMP - make_interval(secs => $1))
+"""
+_JOB_COLUMNS = "id, specific_prompt, image_count, input_image_url, use_as_content, generation_bypass_cache, generation_lane, generation_version"
+# Time from request to claim, for the per-lane wait histogram
+_WAITED = "EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - generation_requested_at) AS waited"
+
+JobHandler = Callable[[Any, Optional[Any]], Awaitable[None]]
+
+
+async def request_generation(connection, post_id: int, bypass_cache: bool = False, lane: str = "interactive") -> Optional[str]:
+    """
+    Marks a post as needing (re)generation; bypass_cache skips the image result cache for that run,
+    lane is one of LANES. Returns None if the post doesn't exist, otherwise what happened:
+
+      'queued'      - a new run was requested
+      'coalesced'   - a run is already queued or has just started; the request joins it
+      'superseded'  - the running generation is outdated: it is cancelled and a new run queued
+
+    A new request bumps generation_version; runs only write their results while the version
+    they were claimed with is still current (last request wins).
+    """
+    async with connection.transaction():
+        row = await connection.fetchrow("""
+            SELECT
+                generation_requested_at IS NOT NULL
+                    AND (generation_claimed_at IS NULL OR generation_requested_at > generation_claimed_at) AS pending,
+                generation_claimed_at IS NOT NULL
+                    AND generation_claimed_at > CURRENT_TIMESTAMP - make_interval(secs => $2) AS just_started
+            FROM posts WHERE id = $1
+            FOR UPDATE
+        """, post_id, GENERATION_COALESCE_WINDOW)
+        if row is None:
+            return None
+
+        if row['pending'] or (row['just_started'] and not bypass_cache):
+            # Same work either way; only let the request raise its priority / ask for fresh images
+            await connection.execute("""
+                UPDATE posts SET
+                    generation_lane = CASE WHEN $2 = 'interactive' THEN $2 ELSE generation_lane END,
+                    generation_bypass_cache = generation_bypass_cache OR $3
+                WHERE id = $1
+            """, post_id, lane, bypass_cache)
+            return "coalesced"
+
+        running = await connection.fetchval("""
+            UPDATE posts SET
+                generation_requested_at = CURRENT_TIMESTAMP, generation_bypass_cache = $2, generation_lane = $3,
+                generation_version = generation_version + 1
+            WHERE id = $1
+            RETURNING generation_claimed_at IS NOT NULL
+        """, post_id, bypass_cache, lane)
+        return "superseded" if running else "queued"
+
+
+class GenerationQueue:
+    """
+    Post generation queue backed by the posts table: generation_requested_at marks pending work,
+    generation_claimed_at is a lease held by the process running it. Any process can claim work
+    (FOR UPDATE SKIP LOCKED), so API and worker roles can be scaled independently, and jobs of
+    a process that dies are retried once their lease expires instead of staying PENDING forever.
+
+    Work is split in two lanes: interactive jobs are claimed first and may use every slot; bulk
+    jobs are limited to concurrency - interactive_reserved slots and claimed round-robin across
+    campaigns (or brands), oldest request first within each.
+    """
+    def __init__(self, pool, handler: JobHandler, consume: bool = APP_ROLE != "api", concurrency: int = GENERATION_CONCURRENCY, interactive_reserved: int = GENERATION_INTERACTIVE_RESERVED):
+        self.pool = pool
+        self.handler = handler
+        self.consume = consume
+        self.concurrency = concurrency
+        # At least one slot stays available to bulk work
+        self.bulk_limit = max(1, concurrency - interactive_reserved)
+        self._inflight: Dict[int, asyncio.Task] = {}
+        self._lanes: Dict[int, str] = {}
+        # generation_version each in-flight run was claimed with; a newer one in the DB means it was superseded
+        self._versions: Dict[int, int] = {}
+        self._cancelled: Set[int] = set()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._draining = False
+
+    async def submit(self, post_id: int, trace_context: Optional[Any] = None):
+        """
+        Starts a freshly requested post right away in this process when it has capacity
+        (keeping the request's trace); otherwise the polling consumers pick it up.
+        """
+        if not self.consume or self._draining:
+            return
+        if len(self._inflight) >= self.concurrency:
+            self._wakeup.set()
+            return
+        async with self.pool.acquire() as conn:
+            # A bulk post only starts here if the bulk lane has room; otherwise it waits its fair turn
+            row = await conn.fetchrow(f"""
+                UPDATE posts SET generation_claimed_at = CURRENT_TIMESTAMP
+                WHERE id = (
+                    SELECT id FROM posts WHERE id = $2 AND {_CLAIMABLE}
+                      AND (generation_lane = 'interactive' OR $3)
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING {_JOB_COLUMNS}, {_WAITED}
+            """, GENERATION_CLAIM_LEASE, post_id, self._bulk_free() > 0)
+        if row:
+            self._spawn(row, trace_context)
+        else:
+            self._wakeup.set()
+
+    def _bulk_free(self) -> int:
+        bulk_running = sum(1 for lane in self._lanes.values() if lane == "bulk")
+        return min(self.concurrency - len(self._inflight), self.bulk_limit - bulk_running)
+
+    async def _claim_interactive(self, conn, limit: int):
+        return await conn.fetch(f"""
+            UPDATE posts SET generation_claimed_at = CURRENT_TIMESTAMP
+            WHERE id IN (
+                SELECT id FROM posts WHERE {_CLAIMABLE} AND generation_lane = 'interactive'
+                ORDER BY generation_requested_at
+                LIMIT $2
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING {_JOB_COLUMNS}, {_WAITED}
+        """, GENERATION_CLAIM_LEASE, limit)
+
+    async def _claim_bulk(self, conn, limit: int):
+        # Each campaign's (brand's) n-th oldest request gets turn n; lower turns go first.
+        # Ranking happens in its own CTE since FOR UPDATE can't be combined with window functions.
+        fair_key = _FAIR_SHARE_KEYS.get(GENERATION_FAIR_SHARE_BY, _FAIR_SHARE_KEYS["campaign"])
+        return await conn.fetch(f"""
+            WITH ranked AS (
+                SELECT p.id AS ranked_id, p.generation_requested_at AS requested_at,
+                       row_number() OVER (PARTITION BY {fair_key} ORDER BY p.generation_requested_at) AS turn
+                FROM posts p
+                LEFT JOIN campaigns c ON c.id = p.campaign_id
+                WHERE p.generation_lane = 'bulk' AND {_CLAIMABLE}
+            ), picked AS (
+                SELECT posts.id AS picked_id FROM posts
+                JOIN ranked ON ranked_id = posts.id
+                WHERE {_CLAIMABLE}
+                ORDER BY turn, requested_at
+                LIMIT $2
+                FOR UPDATE OF posts SKIP LOCKED
+            )
+            UPDATE posts SET generation_claimed_at = CURRENT_TIMESTAMP
+            FROM picked WHERE id = picked_id
+            RETURNING {_JOB_COLUMNS}, {_WAITED}
+        """, GENERATION_CLAIM_LEASE, limit)
+
+    async def _claim_batch(self):
+        rows = []
+        async with self.pool.acquire() as conn:
+            free = self.concurrency - len(self._inflight)
+            if free > 0:
+                rows.extend(await self._claim_interactive(conn, free))
+            bulk_free = min(free - len(rows), self._bulk_free())
+            if bulk_free > 0:
+                rows.extend(await self._claim_bulk(conn, bulk_free))
+            await self._observe_depth(conn)
+            await self._cancel_stale(conn)
+        return rows
+
+    async def _cancel_stale(self, conn):
+        """Cancels in-flight runs whose post was deleted or re-requested (possibly from another process)."""
+        if not self._versions:
+            return
+        rows = await conn.fetch("""
+            SELECT id, generation_version FROM posts WHERE id = ANY($1::int[])
+        """, list(self._versions))
+        current = {row['id']: row['generation_version'] for row in rows}
+        for post_id, version in list(self._versions.items()):
+            if post_id not in current:
+                self.cancel(post_id, "deleted")
+            elif current[post_id] != version:
+                self.cancel(post_id, "superseded")
+
+    def cancel(self, post_id: int, reason: str = "superseded") -> bool:
+        """
+        Cooperatively cancels this process's run for a post (model calls and uploads stop at their next
+        await). The job is completed rather than handed back, so only a newer request runs it again.
+        """
+        task = self._inflight.get(post_id)
+        if task is None or task.done() or post_id in self._cancelled:
+            return False
+        logger.info("Cancelling generation of post %s (%s)", post_id, reason)
+        GENERATION_CANCELLED_TOTAL.labels(reason=reason).inc()
+        self._cancelled.add(post_id)
+        task.cancel()
+        return True
+
+    async def _observe_depth(self, conn):
+        counts = dict.fromkeys(LANES, 0)
+        for row in await conn.fetch("""
+            SELECT generation_lane, count(*) AS queued FROM posts
+            WHERE generation_requested_at IS NOT NULL AND generation_claimed_at IS NULL
+            GROUP BY generation_lane
+        """):
+            counts[row['generation_lane']] = row['queued']
+        for lane, queued in counts.items():
+            GENERATION_QUEUE_DEPTH.labels(lane=lane).set(queued)
+
+    def _spawn(self, row, trace_context: Optional[Any] = None):
+        post_id = row['id']
+        lane = row['generation_lane']
+        GENERATION_QUEUE_WAIT_SECONDS.labels(lane=lane).observe(max(0.0, float(row['waited'] or 0)))
+        GENERATION_INFLIGHT.labels(lane=lane).inc()
+        task = asyncio.get_running_loop().create_task(self._run(row, trace_context))
+        self._inflight[post_id] = task
+        self._lanes[post_id] = lane
+        self._versions[post_id] = row['generation_version']
+
+        def _done(_):
+            self._inflight.pop(post_id, None)
+            self._lanes.pop(post_id, None)
+            self._versions.pop(post_id, None)
+            self._cancelled.discard(post_id)
+            GENERATION_INFLIGHT.labels(lane=lane).dec()
+            self._wakeup.set()
+        task.add_done_callback(_done)
+
+    async def _run(self, row, trace_context: Optional[Any]):
+        post_id = row['id']
+        try:
+            await self.handler(row, trace_context)
+        except asyncio.CancelledError:
+            if post_id in self._cancelled:
+                # Deleted or superseded: the newer request (if any) stays queued and runs next
+                await asyncio.shield(self._complete(post_id))
+                return
+            # Interrupted by shutdown: hand the job back so another process resumes it now, not after the lease
+            await asyncio.shield(self._release(post_id))
+            raise
+        except Exception as e:
+            # The handler records FAILED itself; this only guards the queue bookkeeping
+            logger.error("Generation job for post %s crashed: %s", post_id, e)
+        await self._complete(post_id)
+
+    async def _complete(self, post_id: int):
+        try:
+            async with self.pool.acquire() as conn:
+                # A request made while this run was in progress stays queued for another pass
+                await conn.execute("""
+                    UPDATE posts SET
+                        generation_requested_at = CASE WHEN generation_requested_at > generation_claimed_at
+                                                       THEN generation_requested_at END,
+                        generation_bypass_cache = generation_bypass_cache AND generation_requested_at > generation_claimed_at,
+                        generation_claimed_at = NULL
+                    WHERE id = $1
+                """, post_id)
+        except Exception as e:
+            logger.warning("Could not complete generation job for post %s (lease will expire): %s", post_id, e)
+
+    async def _release(self, post_id: int):
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute("UPDATE posts SET generation_claimed_at = NULL WHERE id = $1", post_id)
+        except Exception as e:
+            logger.warning("Could not release generation job for post %s (lease will expire): %s", post_id, e)
+
+    async def run_forever(self):
+        while True:
+            try:
+                for row in await self._claim_batch():
+                    self._spawn(row)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Generation queue poll failed: %s", e)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=GENERATION_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self.consume and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run_forever())
+            logger.info("Generation queue consumer started (concurrency=%s, bulk limit=%s, fair share by %s)",
+                        self.concurrency, self.bulk_limit, GENERATION_FAIR_SHARE_BY)
+
+    async def drain(self, timeout: float = GENERATION_DRAIN_TIMEOUT):
+        """Stops claiming work, waits for in-flight jobs, and hands back whatever is still running at the deadline."""
+        self._draining = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        pending = list(self._inflight.values())
+        if not pending:
+            return
+        logger.info("Draining %s in-flight generation jobs (timeout %ss)", len(pending), timeout)
+        _, still_running = await asyncio.wait(pending, timeout=timeout)
+        for task in still_running:
+            task.cancel()
+        if still_running:
+            logger.warning("Re-queued %s generation jobs that did not finish before shutdown", len(still_running))
+            await asyncio.gather(*still_running, return_exceptions=True)
@@ -0,0 +1,127 @@
+import os
+import re
+import sys
+import json
+import atexit
+import queue
+import random
+import logging
+import logging.handlers
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
+from backend.tracing import current_trace_id
+
+# Correlation IDs attached to every record emitted in the current request/job context
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+post_id_var: ContextVar[Optional[int]] = ContextVar("post_id", default=None)
+campaign_id_var: ContextVar[Optional[int]] = ContextVar("campaign_id", default=None)
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()  # text | json
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Fraction of high-frequency success logs (marked with extra={"sampled": True}) that are kept
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+
+# Standard LogRecord attributes, used to find user-supplied `extra` fields
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "sampled"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def bind_log_context(post_id: Optional[int] = None, campaign_id: Optional[int] = None):
+    """Attaches post/campaign IDs to all log records emitted from the current task."""
+    if post_id is not None:
+        post_id_var.set(post_id)
+    if campaign_id is not None:
+        campaign_id_var.set(campaign_id)
+
+
+class ContextFilter(logging.Filter):
+    """Copies correlation IDs from contextvars onto the record. Runs on the emitting task, before the queue hop."""
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        record.post_id = post_id_var.get()
+        record.campaign_id = campaign_id_var.get()
+        if not hasattr(record, "trace_id"):
+            record.trace_id = current_trace_id()
+        return True
+
+
+class QuerySecretFilter(logging.Filter):
+    """Masks credentials passed in query strings (event stream tokens) in access log lines."""
+    _PATTERN = re.compile(r"\b(token|api_key)=[^&\s\"]*")
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if isinstance(record.args, tuple):
+            record.args = tuple(self._PATTERN.sub(r"\1=[redacted]", arg) if isinstance(arg, str) else arg for arg in record.args)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Drops a share of INFO/DEBUG records flagged as high-frequency; warnings and errors are never sampled."""
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate >= 1.0 or record.levelno > logging.INFO or not getattr(record, "sampled", False):
+            return True
+        return random.random() < self.rate
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and value is not None:
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler.prepare() formats the message on the calling thread. Skip that so message
+    interpolation, JSON rendering and I/O all happen on the listener thread.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def configure_logging():
+    """
+    Installs a non-blocking logging pipeline: callers enqueue records, and a background
+    listener thread formats and writes them, so log I/O never runs on the event loop.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        stream_handler.setFormatter(JSONFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = _DeferredQueueHandler(log_queue)
+    # Sample first so dropped records never pay for context lookup
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+    queue_handler.addFilter(ContextFilter())
+
+    # On the logger rather than our handler, so it also applies when uvicorn installs its own access handler
+    logging.getLogger("uvicorn.access").addFilter(QuerySecretFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
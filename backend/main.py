@@ -1,49 +1,98 @@
 import os
 import json
+import asyncio
 import logging
-import time
 from typing import List, Optional
-from datetime import datetime
+from datetime import date, datetime
 from fastapi import FastAPI, HTTPException, BackgroundTasks, UploadFile, File, Request, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, HttpUrl
-import asyncpg
 from execution import scraper, generator
-from backend.storage import get_storage_provider
+from execution.media import open_media
+from execution.instrumentation import instrumentation
+from backend.storage import get_storage_provider, get_cold_storage_provider
+from backend.pool import create_pool, pool_config, DB_PGBOUNCER_TRANSACTION_MODE
+from backend.context_store import context_store
+from backend.migrations import run_startup_migrations
+from backend.storage_gc import StorageGarbageCollector, enqueue_assets, asset_urls
+from backend.static_files import MediaFiles, FrontendIndex
+from backend.generation_jobs import GenerationQueue, request_generation, APP_ROLE
+from backend.publishing import PublishInProgress, PublishReconciler, PublishTarget, publish_fan_out, publish_once, schedule_bulk
+from backend.social_adapter import PublishOutcomeUnknown, get_social_adapter
+from backend.webhooks import (
+    SIGNATURE_HEADER, InvalidSignature, WebhookProcessor, parse_callback, post_status_broadcaster,
+    STREAM_TOKEN_TTL, issue_stream_token, store_event, verify_signature, verify_stream_token, webhook_secret
+)
+from backend.usage import USAGE_SUMMARY_REFRESH_INTERVAL, GROUP_COLUMNS, post_usage, usage_operation, usage_recorder, usage_summary
+from backend import tracing
+from backend.logging_config import configure_logging, bind_log_context, request_id_var
+from backend.metrics import (
+    observe_query, render_metrics, mark_process_dead, STORAGE_UPLOAD_SECONDS, RETRIES_TOTAL, WEBHOOK_EVENTS_TOTAL,
+    MODEL_CALL_SECONDS, IMAGE_ENCODE_SECONDS, PLACEHOLDER_IMAGES_TOTAL, SCRAPER_FETCH_SECONDS,
+    IMAGE_CACHE_REQUESTS_TOTAL, IMAGE_CACHE_EVICTIONS_TOTAL, IMAGE_CACHE_BYTES
+)
 import shutil
 import uuid
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging (LOG_FORMAT=json for structured output; writes happen off the event loop)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Content Automation Engine")
+tracing.setup_tracing(app)
 
-# Storage Provider
-storage = get_storage_provider()
-logger.info(f"Using Storage Provider: {type(storage).__name__}")
+# The execution package reports through hooks (no-ops on their own); route them into our metrics, spans and usage ledger
+instrumentation.install(
+    usage_recorder=usage_recorder,
+    span=tracing.span,
+    usage_operation=usage_operation,
+    model_call_seconds=MODEL_CALL_SECONDS,
+    image_encode_seconds=IMAGE_ENCODE_SECONDS,
+    placeholder_images_total=PLACEHOLDER_IMAGES_TOTAL,
+    scraper_fetch_seconds=SCRAPER_FETCH_SECONDS,
+    image_cache_requests_total=IMAGE_CACHE_REQUESTS_TOTAL,
+    image_cache_evictions_total=IMAGE_CACHE_EVICTIONS_TOTAL,
+    image_cache_bytes=IMAGE_CACHE_BYTES,
+)
+
+# Storage Provider (built in the startup hook; SDK clients are slow to import)
+storage = None
+cold_storage = None
 
 # Security Configuration
 API_SECRET_KEY = os.getenv("API_SECRET_KEY")
 if not API_SECRET_KEY:
     logger.warning("API_SECRET_KEY not set! Security relies on network isolation.")
 
+# Allow unauthenticated Prometheus scrapes of /metrics (keep off unless the port is private)
+METRICS_PUBLIC = os.getenv("METRICS_PUBLIC", "false").lower() == "true"
+
+def save_generated_image(data, filename: str, content_type: str) -> str:
+    """Storage callback shared by uploads and the generator (timed per provider)."""
+    with tracing.span("storage.upload", **{"storage.provider": type(storage).__name__, "storage.filename": filename}), \
+            STORAGE_UPLOAD_SECONDS.labels(provider=type(storage).__name__).time():
+        return storage.upload(data, filename, content_type)
+
 # Middleware for API Key Authentication
 @app.middleware("http")
 async def api_key_middleware(request: Request, call_next):
     # Skip auth for static files, docs, and trivial endpoints if needed
-    if request.url.path.startswith("/images") or request.url.path.startswith("/uploads") or request.url.path == "/docs" or request.url.path == "/openapi.json":
+    if request.url.path.startswith("/images") or request.url.path.startswith("/uploads") or request.url.path == "/docs" or request.url.path == "/openapi.json" or (METRICS_PUBLIC and request.url.path == "/metrics"):
         response = await call_next(request)
         return response
 
     if request.method == "OPTIONS":
         return await call_next(request)
+    # Provider callbacks authenticate with their signature instead
+    if request.url.path.startswith("/webhooks/"):
+        return await call_next(request)
 
     api_key = request.headers.get("X-API-Key")
     if API_SECRET_KEY:
-        if api_key != API_SECRET_KEY:
+        # EventSource can't set headers: streams open with a short-lived token from POST /events/token instead
+        stream_token = request.query_params.get("token") if api_key is None and request.url.path.startswith("/events/") else None
+        if api_key != API_SECRET_KEY and not (stream_token and verify_stream_token(API_SECRET_KEY, stream_token)):
              logger.warning("Auth Failed: Invalid API Key")
              return JSONResponse(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -55,6 +104,18 @@ async def api_key_middleware(request: Request, call_next):
     response = await call_next(request)
     return response
 
+# Correlation ID for every request; registered after auth so it wraps it and auth failures are tagged too
+@app.middleware("http")
+async def request_context_middleware(request: Request, call_next):
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
 # CORS Configuration
 allowed_origins_env = os.getenv("ALLOWED_ORIGINS", "")
 if allowed_origins_env:
@@ -75,11 +136,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files for generated images and uploads
-os.makedirs("generated_images", exist_ok=True)
-os.makedirs("uploads", exist_ok=True)
-app.mount("/images", StaticFiles(directory="generated_images"), name="images")
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# Mount static files for generated images and uploads (directories are created at startup).
+# Same directories the local storage provider writes to; the desktop app points them next to the executable.
+GENERATED_IMAGES_DIR = os.getenv("LOCAL_STORAGE_DIR", "generated_images")
+UPLOADS_DIR = os.getenv("LOCAL_UPLOADS_DIR", "uploads")
+app.mount("/images", MediaFiles(directory=GENERATED_IMAGES_DIR, mount="images", check_dir=False), name="images")
+app.mount("/uploads", MediaFiles(directory=UPLOADS_DIR, mount="uploads", check_dir=False), name="uploads")
 
 # Database URL (Strict - no default password)
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -87,6 +149,9 @@ if not DATABASE_URL:
     logger.error("DATABASE_URL is not set! Application will fail.")
     raise RuntimeError("DATABASE_URL must be set in environment")
 
+# Posts deleted per transaction when removing a campaign
+DELETE_BATCH_SIZE = int(os.getenv("DELETE_BATCH_SIZE", "500"))
+
 # --- Pydantic Models ---
 class CampaignCreate(BaseModel):
     name: str
@@ -122,61 +187,113 @@ class PostPatch(BaseModel):
 # --- Startup/Shutdown ---
 @app.on_event("startup")
 async def startup():
+    global storage, cold_storage
+    os.makedirs(GENERATED_IMAGES_DIR, exist_ok=True)
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    frontend.build()
+
+    storage = get_storage_provider()
+    cold_storage = get_cold_storage_provider()
+    logger.info("Using Storage Provider: %s", type(storage).__name__)
+    # Model client (google-genai / PIL are imported here rather than when the module loads)
+    generator.get_provider()
+
     if not DATABASE_URL:
         logger.error("DATABASE_URL not set")
         return
     # Wait for DB to be ready in real world, but for now just connect
-    # Optimized pool settings
-    app.state.pool = await asyncpg.create_pool(DATABASE_URL, min_size=5, max_size=20)
-    logger.info("Database connection pool created with min_size=5, max_size=20")
+    # Every connection reports statement timings to the db_query_seconds histogram
+    async def init_connection(conn):
+        conn.add_query_logger(observe_query)
+
+    app.state.pool = await create_pool(DATABASE_URL, init=init_connection)
+    logger.info("Database connection pool created: %s", pool_config())
     
     # Migrations
     async with app.state.pool.acquire() as connection:
-        try:
-            await connection.execute("""
-                ALTER TABLE posts ADD COLUMN IF NOT EXISTS input_image_url TEXT;
-            """)
-            await connection.execute("""
-                ALTER TABLE posts ADD COLUMN IF NOT EXISTS use_as_content BOOLEAN DEFAULT FALSE;
-            """)
-        except Exception as e:
-            logger.warning(f"Migration error: {e}")
+        await run_startup_migrations(connection)
+
+    # LISTEN needs a session-level connection; pgbouncer transaction pooling can't provide one
+    listen_url = os.getenv("DATABASE_LISTEN_URL") or (None if DB_PGBOUNCER_TRANSACTION_MODE else DATABASE_URL)
+    if listen_url:
+        await context_store.start_listener(listen_url)
+        await post_status_broadcaster.start(listen_url)
+    else:
+        logger.warning("No DATABASE_LISTEN_URL for pgbouncer mode; context cache relies on TTL only, no live post status events")
+
+    # Every role makes model calls (brand analysis runs in the API); the rollup is rebuilt where maintenance runs
+    usage_recorder.start(app.state.pool, refresh_interval=USAGE_SUMMARY_REFRESH_INTERVAL if APP_ROLE != "api" else 0)
+
+    app.state.generation_queue = GenerationQueue(app.state.pool, run_generation_job)
+    app.state.generation_queue.start()
+
+    # Background maintenance runs where the generation work runs
+    app.state.storage_gc = StorageGarbageCollector(app.state.pool, storage, cold_storage)
+    app.state.publish_reconciler = PublishReconciler(app.state.pool, get_social_adapter)
+    app.state.webhook_processor = WebhookProcessor(app.state.pool)
+    if APP_ROLE != "api":
+        app.state.storage_gc.start()
+        app.state.publish_reconciler.start()
+        app.state.webhook_processor.start()
+    logger.info("Started in '%s' role", APP_ROLE)
 
 @app.on_event("shutdown")
 async def shutdown():
+    # Let in-flight generations finish (or re-queue them) while the pool is still open
+    if hasattr(app.state, 'generation_queue'):
+        await app.state.generation_queue.drain()
+    await context_store.stop_listener()
+    await post_status_broadcaster.stop()
+    if hasattr(app.state, 'storage_gc'):
+        await app.state.storage_gc.stop()
+    if hasattr(app.state, 'publish_reconciler'):
+        await app.state.publish_reconciler.stop()
+    if hasattr(app.state, 'webhook_processor'):
+        await app.state.webhook_processor.stop()
     if hasattr(app.state, 'pool'):
+        # After the drain, so usage of the last generations is written too
+        await usage_recorder.stop()
         await app.state.pool.close()
+    mark_process_dead()
 
 # --- Endpoints ---
 @app.get("/")
 async def root():
     return {"message": "Content Automation Engine is running"}
 
+@app.get("/metrics")
+async def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/health/pool")
+async def pool_health():
+    if not hasattr(app.state, 'pool'):
+        raise HTTPException(status_code=503, detail="Database pool not initialized")
+    return app.state.pool.health()
+
+@app.post("/storage/gc")
+async def trigger_storage_sweep(background_tasks: BackgroundTasks):
+    """Runs the full storage sweep (orphan removal + cold tiering) now instead of waiting for STORAGE_SWEEP_INTERVAL."""
+    if not hasattr(app.state, 'storage_gc'):
+        raise HTTPException(status_code=503, detail="Storage GC not initialized")
+    background_tasks.add_task(app.state.storage_gc.sweep)
+    return {"message": "Storage sweep started"}
+
 # Campaign Endpoints
 @app.post("/campaigns")
 async def create_campaign(campaign: CampaignCreate):
-    start_time = time.time()
     try:
-        pool_acquire_start = time.time()
+        # Pool acquire and query timings are recorded by the /metrics histograms
         async with app.state.pool.acquire() as connection:
-            pool_acquire_end = time.time()
-            logger.info(f"DB Connection acquired in {pool_acquire_end - pool_acquire_start:.4f}s")
-            
-            query_start = time.time()
             campaign_id = await connection.fetchval("""
                 INSERT INTO campaigns (name, master_prompt, brand_id)
                 VALUES ($1, $2, $3)
                 RETURNING id
             """, campaign.name, campaign.master_prompt, campaign.brand_id)
-            query_end = time.time()
-            logger.info(f"Query executed in {query_end - query_start:.4f}s")
-            
-            total_time = time.time() - start_time
-            logger.info(f"Total create_campaign time: {total_time:.4f}s")
-            
             return {"id": campaign_id, "name": campaign.name}
     except Exception as e:
-        logger.error(f"Error creating campaign: {e}")
+        logger.error("Error creating campaign: %s", e)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 @app.get("/campaigns")
@@ -191,7 +308,7 @@ async def get_campaigns():
             """)
             return [dict(row) for row in rows]
     except Exception as e:
-        logger.error(f"Error fetching campaigns: {e}")
+        logger.error("Error fetching campaigns: %s", e)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 # --- Brand Endpoints ---
@@ -201,18 +318,19 @@ async def generate_brand_dna(input: BrandGenerate):
         content = input.brand_context or ""
         
         if input.url:
-            logger.info(f"Fetching content from {input.url}")
+            logger.info("Fetching content from %s", input.url)
             website_content = await scraper.fetch_website_content(input.url)
             content += f"\n\n--- WEBSITE CONTENT ({input.url}) ---\n{website_content[:20000]}" # Truncate to avoid huge context
             
         if not content and not input.logo_url:
              raise HTTPException(status_code=400, detail="Provide at least 'brand_context', 'url', or 'logo_url'")
 
-        logger.info(f"Generating DNA (Multimodal: Text len={len(content)}, Logo={bool(input.logo_url)})")
-        brand_dna = await generator.analyze_brand(content, input.logo_url)
+        logger.info("Generating DNA (Multimodal: Text len=%s, Logo=%s)", len(content), bool(input.logo_url))
+        logo = await open_input_media(input.logo_url) if input.logo_url else None
+        brand_dna = await generator.analyze_brand(content, input.logo_url, visual_media=logo)
         return brand_dna
     except Exception as e:
-        logger.error(f"Error generating DNA: {e}")
+        logger.error("Error generating DNA: %s", e)
         raise HTTPException(status_code=500, detail="Failed to generate Brand DNA")
 
 @app.post("/brands")
@@ -224,49 +342,64 @@ async def create_brand(brand: BrandCreate):
                 VALUES ($1, $2, $3, $4, $5)
                 RETURNING id
             """, brand.name, brand.website_url, brand.logo_url, brand.identity_description, json.dumps(brand.brand_dna))
+            context_store.invalidate_brand(brand_id)
             return {"id": brand_id, "name": brand.name}
     except Exception as e:
-        logger.error(f"Error creating brand: {e}")
+        logger.error("Error creating brand: %s", e)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 @app.get("/brands")
 async def get_brands():
     try:
-        async with app.state.pool.acquire() as connection:
-            rows = await connection.fetch("SELECT * FROM brands ORDER BY created_at DESC")
-            brands = []
-            for row in rows:
-                brand = dict(row)
-                if brand['brand_dna']:
-                    brand['brand_dna'] = json.loads(brand['brand_dna'])
-                brands.append(brand)
-            return brands
+        return await context_store.list_brands(app.state.pool)
     except Exception as e:
-        logger.error(f"Error fetching brands: {e}")
+        logger.error("Error fetching brands: %s", e)
         raise HTTPException(status_code=500)
 
 @app.delete("/campaigns/{campaign_id}")
 async def delete_campaign(campaign_id: int):
     try:
         async with app.state.pool.acquire() as connection:
-            # 1. Delete posts associated with campaign
-            await connection.execute("""
-                DELETE FROM posts WHERE campaign_id = $1
-            """, campaign_id)
+            exists = await connection.fetchval("SELECT 1 FROM campaigns WHERE id = $1", campaign_id)
+            if not exists:
+                raise HTTPException(status_code=404, detail="Campaign not found")
+
+            # 1. Delete posts in short batches so a large campaign never holds row locks for long.
+            # Their assets are queued for storage GC in the same transaction as each batch.
+            while True:
+                async with connection.transaction():
+                    rows = await connection.fetch("""
+                        DELETE FROM posts WHERE id IN (
+                            SELECT id FROM posts WHERE campaign_id = $1 LIMIT $2 FOR UPDATE SKIP LOCKED
+                        )
+                        RETURNING id, image_urls, input_image_url
+                    """, campaign_id, DELETE_BATCH_SIZE)
+                    await enqueue_assets(connection, asset_urls(rows))
+                for row in rows:
+                    app.state.generation_queue.cancel(row['id'], "deleted")
+                if len(rows) < DELETE_BATCH_SIZE:
+                    break
             
-            # 2. Delete campaign
-            result = await connection.execute("""
-                DELETE FROM campaigns WHERE id = $1
-            """, campaign_id)
+            # 2. Delete campaign; ON DELETE CASCADE removes any posts skipped or added meanwhile
+            async with connection.transaction():
+                rows = await connection.fetch("""
+                    SELECT image_urls, input_image_url FROM posts WHERE campaign_id = $1 FOR UPDATE
+                """, campaign_id)
+                await enqueue_assets(connection, asset_urls(rows))
+                result = await connection.execute("""
+                    DELETE FROM campaigns WHERE id = $1
+                """, campaign_id)
             
             if result == "DELETE 0":
                 raise HTTPException(status_code=404, detail="Campaign not found")
-                
+
+            context_store.invalidate_campaign(campaign_id)
+            await generator.invalidate_campaign_context(campaign_id)
             return {"message": "Campaign and its posts deleted"}
     except HTTPException as he:
         raise he
     except Exception as e:
-        logger.error(f"Error deleting campaign: {e}")
+        logger.error("Error deleting campaign: %s", e)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 @app.get("/campaigns/{campaign_id}/posts")
@@ -281,105 +414,158 @@ async def get_campaign_posts(campaign_id: int):
             """, campaign_id)
             return [dict(row) for row in rows]
     except Exception as e:
-        logger.error(f"Error fetching campaign posts: {e}")
+        logger.error("Error fetching campaign posts: %s", e)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
+ALLOWED_UPLOAD_TYPES = ["image/jpeg", "image/png", "image/webp", "image/gif"]
+ALLOWED_UPLOAD_EXTENSIONS = ["jpg", "jpeg", "png", "webp", "gif"]
+
+def _upload_filename(filename: str, content_type: str) -> str:
+    # 1. Content-Type Validation
+    if content_type not in ALLOWED_UPLOAD_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid file type. Only images are allowed.")
+
+    # 2. Extension Validation (Double check)
+    file_ext = filename.split(".")[-1].lower()
+    if file_ext not in ALLOWED_UPLOAD_EXTENSIONS:
+         raise HTTPException(status_code=400, detail="Invalid file extension.")
+
+    return f"{uuid.uuid4()}.{file_ext}"
+
+class PresignRequest(BaseModel):
+    filename: str
+    content_type: str
+
+@app.post("/upload/presign")
+async def presign_upload(request: PresignRequest):
+    """
+    Direct-to-bucket upload: returns a presigned PUT URL so the file bytes never pass
+    through the API. 501 means the storage provider can't do this; use POST /upload instead.
+    """
+    filename = _upload_filename(request.filename, request.content_type)
+    try:
+        presigned = await asyncio.to_thread(storage.presigned_upload, filename, request.content_type)
+    except Exception as e:
+        logger.error("Error presigning upload: %s", e)
+        raise HTTPException(status_code=500, detail="Upload failed")
+    if presigned is None:
+        raise HTTPException(status_code=501, detail="Direct uploads are not supported by this storage provider")
+    return {**presigned, "path": filename}
+
 @app.post("/upload")
 async def upload_file(file: UploadFile = File(...)):
     try:
-        # 1. Content-Type Validation
-        if file.content_type not in ["image/jpeg", "image/png", "image/webp", "image/gif"]:
-            raise HTTPException(status_code=400, detail="Invalid file type. Only images are allowed.")
-        
-        # 2. Extension Validation (Double check)
-        file_ext = file.filename.split(".")[-1].lower()
-        if file_ext not in ["jpg", "jpeg", "png", "webp", "gif"]:
-             raise HTTPException(status_code=400, detail="Invalid file extension.")
-
-        filename = f"{uuid.uuid4()}.{file_ext}"
+        filename = _upload_filename(file.filename, file.content_type)
         
-        # Upload using Storage Provider
-        # We need to read the file first
-        url = storage.upload(file.file, filename, file.content_type)
+        # Upload using Storage Provider, streaming the spooled file off the event loop
+        url = await asyncio.to_thread(save_generated_image, file.file, filename, file.content_type)
             
         return {"url": url, "path": filename} # path is less relevant now in cloud, but keeping key
     except HTTPException as he:
         raise he
     except Exception as e:
-        logger.error(f"Error uploading file: {e}")
+        logger.error("Error uploading file: %s", e)
         raise HTTPException(status_code=500, detail="Upload failed")
 
 @app.post("/campaigns/{campaign_id}/posts")
-async def create_post_in_campaign(campaign_id: int, post: PostCreate, background_tasks: BackgroundTasks):
+async def create_post_in_campaign(campaign_id: int, post: PostCreate):
     try:
         async with app.state.pool.acquire() as connection:
-            # Create post record
+            # Create post record, queued for generation
             post_id = await connection.fetchval("""
-                INSERT INTO posts (campaign_id, specific_prompt, image_count, status, input_image_url, use_as_content, type)
-                VALUES ($1, $2, $3, 'PENDING', $4, $5, $6)
+                INSERT INTO posts (campaign_id, specific_prompt, image_count, status, input_image_url, use_as_content, type, generation_requested_at)
+                VALUES ($1, $2, $3, 'PENDING', $4, $5, $6, CURRENT_TIMESTAMP)
                 RETURNING id
             """, campaign_id, post.specific_prompt, post.image_count, post.input_image_url, post.use_as_content, post.type)
             
-            # Start background generation task
+        # Start generation here if this process consumes the queue, otherwise a worker picks it up
+        await app.state.generation_queue.submit(post_id, trace_context=tracing.current_context())
             
-            # Define saver callback for generator
-            def save_generated_image(data: bytes, filename: str, content_type: str) -> str:
-                return storage.upload(data, filename, content_type)
-
-            background_tasks.add_task(process_post_generation, post_id, post.specific_prompt, post.image_count, post.input_image_url, post.use_as_content, save_generated_image) 
-            
-            return {"id": post_id, "status": "PENDING"}
+        return {"id": post_id, "status": "PENDING"}
             
     except Exception as e:
-        logger.error(f"Error creating post: {e}")
+        logger.error("Error creating post: %s", e)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
-async def process_post_generation(post_id: int, prompt: str, image_count: int, input_image_url: str = None, use_as_content: bool = False, image_saver=None):
+async def open_input_media(url: str):
+    """Input image for the models, read straight from storage when it's one of our uploads. None if unreadable."""
+    try:
+        return await open_media(url, storage)
+    except Exception as e:
+        logger.error("Failed to load input image %s: %s", url, e)
+        return None
+
+async def run_generation_job(row, trace_context=None):
+    """GenerationQueue handler: the job row carries everything the pipeline needs."""
+    await process_post_generation(
+        row['id'],
+        row['specific_prompt'],
+        row['image_count'],
+        row['input_image_url'],
+        row['use_as_content'],
+        save_generated_image,
+        trace_context=trace_context,
+        use_image_cache=not row['generation_bypass_cache'],
+        generation_version=row['generation_version']
+    )
+
+async def process_post_generation(post_id: int, prompt: str, image_count: int, input_image_url: str = None, use_as_content: bool = False, image_saver=None, trace_context=None, use_image_cache: bool = True, generation_version: Optional[int] = None):
+    # Background job continues the trace of the HTTP request that enqueued it
+    with tracing.span("job.generate_post", context=trace_context, **{"post.id": post_id, "post.image_count": image_count}):
+        await _run_post_generation(post_id, prompt, image_count, input_image_url, use_as_content, image_saver, use_image_cache, generation_version)
+
+async def _run_post_generation(post_id: int, prompt: str, image_count: int, input_image_url: str = None, use_as_content: bool = False, image_saver=None, use_image_cache: bool = True, generation_version: Optional[int] = None):
+    """generation_version: the post's version when this run was claimed; results are only written while it is current."""
+    bind_log_context(post_id=post_id)
     try:
-        logger.info(f"Processing post {post_id}...")
+        logger.info("Processing post %s...", post_id, extra={"sampled": True})
         
         # 2. Fetch Context (Brand DNA & Master Prompt)
         brand_dna = {} 
         master_prompt = ""
+        campaign_id = None
+        post_type = "POST"
+        scheduled_at = None
         
         try:
-             async with app.state.pool.acquire() as conn:
-                # Optimized query to get everything in one go
+            async with app.state.pool.acquire() as conn:
                 row = await conn.fetchrow("""
-                    SELECT c.master_prompt, b.brand_dna, p.status, p.image_urls, p.type, p.scheduled_at
-                    FROM posts p 
-                    JOIN campaigns c ON p.campaign_id = c.id 
-                    LEFT JOIN brands b ON c.brand_id = b.id
-                    WHERE p.id = $1
+                    SELECT campaign_id, type, scheduled_at
+                    FROM posts WHERE id = $1
                 """, post_id)
                 
-                if row:
-                    # Guard: If post is already APPROVED and has images, skip re-generation to avoid overwriting
-                    if row['status'] == 'APPROVED' and row['image_urls'] and json.loads(row['image_urls']):
-                        logger.info(f"Post {post_id} already has approved content. Skipping generation.")
-                        return
-
-                    master_prompt = row['master_prompt']
-                    if row['brand_dna']:
-                        brand_dna = json.loads(row['brand_dna'])
-                    
-                    post_type = row['type']
-                    scheduled_at = row['scheduled_at']
+            # Every run comes from request_generation, so approved content is regenerated on purpose;
+            # the generation_version check below keeps a superseded run from overwriting a newer one
+            if row:
+                campaign_id = row['campaign_id']
+                bind_log_context(campaign_id=campaign_id)
+                post_type = row['type']
+                scheduled_at = row['scheduled_at']
+
+                # Campaign + brand context is shared by every post of the campaign: cached and parsed once
+                context = await context_store.get_campaign_context(app.state.pool, campaign_id)
+                if context:
+                    master_prompt = context.master_prompt
+                    brand_dna = context.brand_dna
 
         except Exception as db_e:
-            logger.error(f"Failed to fetch context: {db_e}")
+            logger.error("Failed to fetch context: %s", db_e)
 
         # 3. Generate Content
-        full_prompt_details = f"Master Strategy: {master_prompt or ''}\nSpecific Context: {prompt}"
-
+        input_media = await open_input_media(input_image_url) if input_image_url else None
+        # Brand DNA + master strategy form a per-campaign prefix that the generator caches provider-side
         content = await generator.generate_post(
             brand_dna, 
-            full_prompt_details, 
+            f"Specific Context: {prompt}", 
             image_count=0 if use_as_content else image_count, 
             input_image_url=input_image_url,
             image_saver=image_saver,
             post_type=post_type,
-            scheduled_at=scheduled_at
+            scheduled_at=scheduled_at,
+            master_prompt=master_prompt,
+            campaign_id=campaign_id,
+            use_image_cache=use_image_cache,
+            input_media=input_media
         )
         
         caption = content.get("caption", "")
@@ -391,53 +577,67 @@ async def process_post_generation(post_id: int, prompt: str, image_count: int, i
         
         # 3. Update DB
         async with app.state.pool.acquire() as conn:
-            await conn.execute("""
-                UPDATE posts 
-                SET caption = $1, image_urls = $2, status = 'APPROVED'
-                WHERE id = $3
-            """, caption, json.dumps(image_urls), post_id)
+            async with conn.transaction():
+                # Images from a previous generation of this post become garbage once replaced
+                previous = await conn.fetchrow("""
+                    SELECT image_urls, NULL AS input_image_url, generation_version FROM posts WHERE id = $1 FOR UPDATE
+                """, post_id)
+                if previous is None or (generation_version is not None and previous['generation_version'] != generation_version):
+                    # Post deleted or regenerated meanwhile: the newer request wins, this run's images are garbage
+                    await enqueue_assets(conn, [u for u in image_urls if u != input_image_url])
+                    logger.info("Discarded stale generation result for post %s", post_id)
+                    return
+                await conn.execute("""
+                    UPDATE posts 
+                    SET caption = $1, image_urls = $2, status = 'APPROVED'
+                    WHERE id = $3
+                """, caption, json.dumps(image_urls), post_id)
+                await enqueue_assets(conn, [u for u in asset_urls([previous]) if u not in image_urls])
         
-        logger.info(f"Generated content for post {post_id}")
+        logger.info("Generated content for post %s", post_id, extra={"sampled": True})
             
     except Exception as e:
-        logger.error(f"Failed to process post {post_id}: {e}")
+        logger.error("Failed to process post %s: %s", post_id, e)
         # Update DB to failed
         try:
              async with app.state.pool.acquire() as connection:
-                await connection.execute("UPDATE posts SET status = 'FAILED' WHERE id = $1", post_id)
+                await connection.execute("""
+                    UPDATE posts SET status = 'FAILED' WHERE id = $1 AND ($2::int IS NULL OR generation_version = $2)
+                """, post_id, generation_version)
         except:
             pass
 
 @app.post("/posts/{post_id}/generate")
-async def trigger_post_generation(post_id: int, background_tasks: BackgroundTasks):
-    # Fetch details needed for generation since we only have ID
+async def trigger_post_generation(post_id: int, bypass_cache: bool = True):
+    """
+    Regenerates a post. A regenerate asks for new images, so the image result cache is skipped;
+    bypass_cache=false reuses earlier results for identical prompts (first generations always may).
+    """
     try:
         async with app.state.pool.acquire() as conn:
-            row = await conn.fetchrow("""
-                SELECT specific_prompt, image_count, input_image_url, use_as_content
-                FROM posts WHERE id = $1
-            """, post_id)
-            
-            if not row:
+            status = await conn.fetchval("SELECT status FROM posts WHERE id = $1", post_id)
+            if status is None:
                 raise HTTPException(status_code=404, detail="Post not found")
-            
-            # Define saver callback
-            def save_generated_image(data: bytes, filename: str, content_type: str) -> str:
-                return storage.upload(data, filename, content_type)
-
-            background_tasks.add_task(
-                process_post_generation, 
-                post_id, 
-                row['specific_prompt'], 
-                row['image_count'], 
-                row['input_image_url'], 
-                row['use_as_content'], 
-                save_generated_image
-            )
-            
-            return {"message": "Generation started", "id": post_id}
+
+            if status == 'FAILED':
+                RETRIES_TOTAL.labels(operation="generation").inc()
+
+            # A user is waiting on this one: it goes ahead of queued bulk work
+            outcome = await request_generation(conn, post_id, bypass_cache=bypass_cache, lane="interactive")
+            if outcome is None:
+                raise HTTPException(status_code=404, detail="Post not found")
+
+        if outcome == "coalesced":
+            return {"message": "Generation already in progress", "id": post_id, "request": outcome}
+        if outcome == "superseded":
+            # Stop the outdated run right away if it's ours; other processes notice on their next poll
+            app.state.generation_queue.cancel(post_id, "superseded")
+        await app.state.generation_queue.submit(post_id, trace_context=tracing.current_context())
+        return {"message": "Generation started", "id": post_id, "request": outcome}
+    except HTTPException:
+        raise
     except Exception as e:
-         logger.error(f"Error triggering generation: {e}")
+         logger.error("Error triggering generation: %s", e)
          raise HTTPException(status_code=500, detail="Internal Server Error")
 
 @app.put("/posts/{post_id}/status")
@@ -451,21 +651,27 @@ async def update_post_status(post_id: int, update: PostUpdate):
                 raise HTTPException(status_code=404, detail="Post not found")
             return {"message": "Status updated"}
     except Exception as e:
-        logger.error(f"Error updating status: {e}")
+        logger.error("Error updating status: %s", e)
         raise HTTPException(status_code=500)
 
 @app.delete("/posts/{post_id}")
 async def delete_post(post_id: int):
     try:
         async with app.state.pool.acquire() as connection:
-            result = await connection.execute("""
-                DELETE FROM posts WHERE id = $1
-            """, post_id)
-            if result == "DELETE 0":
-                raise HTTPException(status_code=404, detail="Post not found")
+            async with connection.transaction():
+                row = await connection.fetchrow("""
+                    DELETE FROM posts WHERE id = $1
+                    RETURNING image_urls, input_image_url
+                """, post_id)
+                if not row:
+                    raise HTTPException(status_code=404, detail="Post not found")
+                await enqueue_assets(connection, asset_urls([row]))
+            app.state.generation_queue.cancel(post_id, "deleted")
             return {"message": "Post deleted"}
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error deleting post: {e}")
+        logger.error("Error deleting post: %s", e)
         raise HTTPException(status_code=500)
 
 class InstagramConfig(BaseModel):
@@ -486,7 +692,7 @@ async def configure_instagram(config: InstagramConfig):
             """, config.api_key)
             return {"message": "Instagram (Outstand) configuration saved"}
     except Exception as e:
-        logger.error(f"Error saving Instagram config: {e}")
+        logger.error("Error saving Instagram config: %s", e)
         raise HTTPException(status_code=500, detail="Failed to save configuration")
 
 @app.get("/integrations/instagram")
@@ -502,67 +708,290 @@ async def get_instagram_config():
                 return {"configured": True, "api_key_preview": masked, "updated_at": row["updated_at"]}
             return {"configured": False}
     except Exception as e:
-        logger.error(f"Error fetching Instagram config: {e}")
+        logger.error("Error fetching Instagram config: %s", e)
         raise HTTPException(status_code=500, detail="Failed to fetch configuration")
 
 @app.post("/posts/{post_id}/publish/instagram")
-async def publish_post_to_instagram(post_id: int):
+async def publish_post_to_instagram(post_id: int, force: bool = False):
+    """
+    Idempotent: retries and double clicks return the original result instead of publishing again.
+    force=true re-sends a publish whose outcome is unknown (only after checking the platform by hand).
+    """
     try:
+        # 1. Load post + integration config, then release the connection before the (slow) adapter call
         async with app.state.pool.acquire() as connection:
-            # 1. Get Post
             post = await connection.fetchrow("""
-                SELECT caption, image_urls, scheduled_at, type FROM posts WHERE id = $1
+                SELECT p.caption, p.image_urls, p.scheduled_at, p.type, i.access_token
+                FROM posts p
+                LEFT JOIN integrations i ON i.platform = 'instagram'
+                WHERE p.id = $1
             """, post_id)
             
-            if not post:
-                raise HTTPException(status_code=404, detail="Post not found")
-                
-            image_urls = json.loads(post['image_urls'])
-            if not image_urls:
-                raise HTTPException(status_code=400, detail="Post has no images")
-                
-            # 2. Get Integration Config
-            config_row = await connection.fetchrow("""
-                SELECT access_token FROM integrations WHERE platform = 'instagram'
-            """)
-            
-            # Pass to adapter as a dict
-            platform_config = {}
-            if config_row:
-                platform_config["api_key"] = config_row["access_token"]
-            
-            # 3. Publish
-            from backend.social_adapter import get_social_adapter
-            adapter = get_social_adapter()
-            
-            # For now, handle single image. 
-            image_url = image_urls[0]
+        if not post:
+            raise HTTPException(status_code=404, detail="Post not found")
             
-            try:
-                publish_id = await adapter.publish(
-                    image_url, 
-                    post['caption'], 
-                    platform_config, 
-                    post_type=post['type'],
-                    scheduled_at=post['scheduled_at']
-                )
-            except Exception as e:
-                logger.error(f"Adapter Publish Error: {e}")
-                raise HTTPException(status_code=500, detail=f"Publishing failed: {str(e)}")
+        image_urls = json.loads(post['image_urls'])
+        if not image_urls:
+            raise HTTPException(status_code=400, detail="Post has no images")
             
-            # 4. Update Post Status
-            await connection.execute("""
-                UPDATE posts SET status = 'PUBLISHED', updated_at = CURRENT_TIMESTAMP WHERE id = $1
-            """, post_id)
-            
-            return {"message": "Published successfully", "publish_id": publish_id}
+        # 2. Pass integration config to adapter as a dict
+        platform_config = {}
+        if post['access_token']:
+            platform_config["api_key"] = post['access_token']
+        
+        # 3. Publish through the attempt ledger (no pooled connection held during the adapter call)
+        adapter = get_social_adapter("instagram", storage)
+        
+        # For now, handle single image. 
+        image_url = image_urls[0]
+        
+        try:
+            result = await publish_once(
+                app.state.pool,
+                adapter,
+                post_id,
+                "instagram",
+                image_url,
+                post['caption'],
+                platform_config,
+                post_type=post['type'],
+                scheduled_at=post['scheduled_at'],
+                force=force
+            )
+        except PublishInProgress as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except PublishOutcomeUnknown as e:
+            logger.warning("Publish outcome unknown for post %s: %s", post_id, e)
+            raise HTTPException(status_code=502, detail=f"Publish outcome unknown, safe to retry: {str(e)}")
+        except ValueError:
+            raise
+        except Exception as e:
+            logger.error("Adapter Publish Error: %s", e)
+            raise HTTPException(status_code=500, detail=f"Publishing failed: {str(e)}")
+        
+        if result.deduplicated:
+            return {"message": "Already published", "publish_id": result.external_id, "attempt": result.attempt}
+        return {"message": "Published successfully", "publish_id": result.external_id, "attempt": result.attempt}
             
+    except HTTPException:
+        raise
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
-        logger.error(f"Error publishing post: {e}")
+        logger.error("Error publishing post: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+class PublishRequest(BaseModel):
+    platforms: List[str]
+    force: bool = False
+
+@app.post("/posts/{post_id}/publish")
+async def publish_post(post_id: int, request: PublishRequest):
+    """
+    Publishes a post to several platforms at once. Targets run concurrently, each with its own
+    timeout and idempotent attempt record, and the response reports every platform separately:
+    one slow or failing network doesn't fail (or delay) the others.
+    """
+    platforms = list(dict.fromkeys(p.strip().lower() for p in request.platforms if p.strip()))
+    if not platforms:
+        raise HTTPException(status_code=400, detail="No platforms given")
+    try:
+        # Post and every target's integration in one round trip; no connection held while publishing
+        async with app.state.pool.acquire() as connection:
+            post = await connection.fetchrow("""
+                SELECT caption, image_urls, scheduled_at, type FROM posts WHERE id = $1
+            """, post_id)
+            integrations = await connection.fetch("""
+                SELECT platform, access_token FROM integrations WHERE platform = ANY($1::text[])
+            """, platforms)
+
+        if not post:
+            raise HTTPException(status_code=404, detail="Post not found")
+        image_urls = json.loads(post['image_urls'])
+        if not image_urls:
+            raise HTTPException(status_code=400, detail="Post has no images")
+
+        tokens = {row['platform']: row['access_token'] for row in integrations}
+        targets = [
+            PublishTarget(platform, get_social_adapter(platform, storage), {"api_key": tokens[platform]} if tokens.get(platform) else {})
+            for platform in platforms
+        ]
+        results = await publish_fan_out(
+            app.state.pool,
+            post_id,
+            targets,
+            image_urls[0],
+            post['caption'],
+            post_type=post['type'],
+            scheduled_at=post['scheduled_at'],
+            force=request.force
+        )
+        return {
+            "post_id": post_id,
+            "published": sum(1 for r in results if r['state'] == 'SUCCEEDED'),
+            "results": results
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error publishing post %s: %s", post_id, e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+class ScheduleRequest(BaseModel):
+    platform: str = "instagram"
+    post_ids: Optional[List[int]] = None
+
+@app.post("/campaigns/{campaign_id}/schedule")
+async def schedule_campaign(campaign_id: int, request: ScheduleRequest):
+    """
+    Pushes every approved post of the campaign with a future scheduled_at (or the given subset) to the
+    provider in one bulk operation. Posts already scheduled are reported, not sent twice.
+    """
+    platform = request.platform.strip().lower()
+    try:
+        async with app.state.pool.acquire() as connection:
+            rows = await connection.fetch("""
+                SELECT p.id, p.caption, p.image_urls, p.scheduled_at, p.type
+                FROM posts p
+                WHERE p.campaign_id = $1 AND p.status = 'APPROVED'
+                  AND p.scheduled_at > CURRENT_TIMESTAMP
+                  AND ($2::int[] IS NULL OR p.id = ANY($2::int[]))
+                ORDER BY p.scheduled_at
+            """, campaign_id, request.post_ids)
+            integration = await connection.fetchrow("""
+                SELECT access_token FROM integrations WHERE platform = $1
+            """, platform)
+
+        posts = []
+        for row in rows:
+            image_urls = json.loads(row['image_urls']) if row['image_urls'] else []
+            if image_urls:
+                posts.append({**dict(row), "image_url": image_urls[0]})
+        if not posts:
+            return {"campaign_id": campaign_id, "scheduled": 0, "results": []}
+
+        platform_config = {"api_key": integration['access_token']} if integration and integration['access_token'] else {}
+        results = await schedule_bulk(app.state.pool, get_social_adapter(platform, storage), platform, posts, platform_config)
+        scheduled = sum(1 for r in results if r['state'] == 'SUCCEEDED')
+        logger.info("Scheduled %s of %s posts of campaign %s on %s", scheduled, len(posts), campaign_id, platform)
+        return {"campaign_id": campaign_id, "scheduled": scheduled, "results": results}
+    except Exception as e:
+        logger.error("Error scheduling campaign %s: %s", campaign_id, e)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/posts/{post_id}/publish")
+async def get_publish_status(post_id: int):
+    """Latest attempt per platform, for polling the outcome of a fan-out publish."""
+    try:
+        async with app.state.pool.acquire() as connection:
+            rows = await connection.fetch("""
+                SELECT platform, state, external_id, attempt, error, updated_at
+                FROM publish_attempts WHERE post_id = $1
+                ORDER BY platform
+            """, post_id)
+        return [dict(row) for row in rows]
+    except Exception as e:
+        logger.error("Error fetching publish status: %s", e)
+        raise HTTPException(status_code=500)
+
+@app.get("/posts/{post_id}/usage")
+async def get_post_usage(post_id: int):
+    """Tokens, images and estimated cost spent on a post, including regenerations."""
+    try:
+        async with app.state.pool.acquire() as connection:
+            return await post_usage(connection, post_id)
+    except Exception as e:
+        logger.error("Error fetching post usage: %s", e)
+        raise HTTPException(status_code=500)
+
+@app.get("/usage")
+async def get_usage(group_by: str = "day", campaign_id: Optional[int] = None, brand_id: Optional[int] = None, since: Optional[date] = None, until: Optional[date] = None, refresh: bool = False):
+    """
+    Model usage and estimated cost per day, campaign or brand, from the daily rollup (rebuilt every
+    USAGE_SUMMARY_REFRESH_INTERVAL seconds; refresh=true rebuilds it first). 'key' is null for usage
+    outside a campaign/brand, such as brand analysis.
+    """
+    if group_by not in GROUP_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(GROUP_COLUMNS)}")
+    try:
+        if refresh:
+            await usage_recorder.flush()
+            await usage_recorder.refresh_summary(app.state.pool)
+        async with app.state.pool.acquire() as connection:
+            rows = await usage_summary(connection, group_by, campaign_id, brand_id, since, until)
+        return {"group_by": group_by, "rows": rows}
+    except Exception as e:
+        logger.error("Error fetching usage summary: %s", e)
+        raise HTTPException(status_code=500)
+
+@app.post("/webhooks/{provider}")
+async def receive_provider_webhook(provider: str, request: Request):
+    """
+    Provider status callbacks (published / failed) for jobs we submitted. Verifies the signature,
+    stores the event once (redeliveries are acknowledged but not applied twice) and returns
+    immediately; WebhookProcessor applies queued events to posts in batches and notifies dashboards.
+    """
+    provider = provider.lower()
+    secret = webhook_secret(provider)
+    if not secret:
+        logger.warning("Rejected %s webhook: no WEBHOOK_SECRET configured", provider)
+        raise HTTPException(status_code=503, detail="Webhooks not configured")
+
+    body = await request.body()
+    try:
+        verify_signature(secret, body, request.headers.get(SIGNATURE_HEADER))
+    except InvalidSignature as e:
+        WEBHOOK_EVENTS_TOTAL.labels(provider=provider, outcome="invalid_signature").inc()
+        raise HTTPException(status_code=401, detail=str(e))
+    try:
+        callback = parse_callback(body)
+    except ValueError as e:
+        WEBHOOK_EVENTS_TOTAL.labels(provider=provider, outcome="invalid_payload").inc()
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        async with app.state.pool.acquire() as connection:
+            inserted = await store_event(connection, provider, callback, body)
+    except Exception as e:
+        # A 5xx makes the provider retry later
+        logger.error("Error storing %s webhook: %s", provider, e)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+    WEBHOOK_EVENTS_TOTAL.labels(provider=provider, outcome="accepted" if inserted else "duplicate").inc()
+    if inserted:
+        app.state.webhook_processor.wake()
+    return {"received": True, "duplicate": not inserted}
+
+@app.post("/events/token")
+async def create_stream_token():
+    """Short-lived token for opening /events/ streams, so the API key never appears in a URL."""
+    if not API_SECRET_KEY:
+        return {"token": None, "expires_in": None}
+    return {"token": issue_stream_token(API_SECRET_KEY), "expires_in": STREAM_TOKEN_TTL}
+
+@app.get("/events/posts")
+async def post_status_events(request: Request, campaign_id: Optional[int] = None):
+    """Server-sent events with post status changes (optionally for one campaign), for live dashboards."""
+    queue = post_status_broadcaster.subscribe()
+
+    async def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    payload = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                    continue
+                if campaign_id is not None and json.loads(payload).get("campaign_id") != campaign_id:
+                    continue
+                yield f"event: post_status\ndata: {payload}\n\n"
+        finally:
+            post_status_broadcaster.unsubscribe(queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.patch("/posts/{post_id}")
 async def patch_post(post_id: int, update: PostPatch):
     try:
@@ -576,31 +1005,29 @@ async def patch_post(post_id: int, update: PostPatch):
             
             return {"message": "Post updated"}
     except Exception as e:
-        logger.error(f"Error patching post: {e}")
+        logger.error("Error patching post: %s", e)
         raise HTTPException(status_code=500)
 
 # --- Frontend Serving (Desktop Mode) ---
-from fastapi.responses import FileResponse
-import os
-
-# Create dist directory if it doesn't exist to prevent crash during development
-os.makedirs("apps/dashboard/dist", exist_ok=True)
-os.makedirs("apps/dashboard/dist/assets", exist_ok=True)
-app.mount("/assets", StaticFiles(directory="apps/dashboard/dist/assets"), name="assets")
+# Indexed once at startup; restart after rebuilding the dashboard
+frontend = FrontendIndex("apps/dashboard/dist")
 
 @app.get("/{full_path:path}")
-async def serve_frontend(full_path: str):
+async def serve_frontend(full_path: str, request: Request):
     # Ignore API routes, images, uploads, etc.
     if full_path.startswith("images/") or full_path.startswith("uploads/"):
         raise HTTPException(status_code=404, detail="Not found")
     
     # Try to serve a specific file if it exists in dist
-    dist_file = os.path.join("apps/dashboard/dist", full_path)
-    if os.path.isfile(dist_file):
-        return FileResponse(dist_file)
+    asset = frontend.get(full_path)
+    if asset is not None:
+        return frontend.response(request, asset)
+    # A missing hashed bundle is a stale client, not a client-side route
+    if full_path.startswith("assets/"):
+        raise HTTPException(status_code=404, detail="Not found")
         
     # React Router catch-all
-    index_file = "apps/dashboard/dist/index.html"
-    if os.path.isfile(index_file):
-        return FileResponse(index_file)
+    index = frontend.get("index.html")
+    if index is not None:
+        return frontend.response(request, index)
     return {"message": "Content Automation Engine is running (Frontend not built)"}
@@ -0,0 +1,107 @@
+import os
+import re
+from functools import lru_cache
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+
+# Set by backend.serve when it runs several processes: metrics are aggregated across them on each scrape
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Buckets tuned for the pipeline: DB work is sub-millisecond to ~1s, model calls take seconds to minutes
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 180.0, 300.0)
+
+DB_POOL_ACQUIRE_SECONDS = Histogram(
+    "db_pool_acquire_seconds", "Time spent waiting for a pooled DB connection", buckets=FAST_BUCKETS
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_seconds", "SQL statement execution time", ["statement"], buckets=FAST_BUCKETS
+)
+SCRAPER_FETCH_SECONDS = Histogram(
+    "scraper_fetch_seconds", "Website fetch time for brand analysis", buckets=SLOW_BUCKETS
+)
+MODEL_CALL_SECONDS = Histogram(
+    "model_call_seconds", "Model provider call latency", ["operation"], buckets=SLOW_BUCKETS
+)
+IMAGE_ENCODE_SECONDS = Histogram(
+    "image_encode_seconds", "Time to encode a generated image before upload", buckets=FAST_BUCKETS
+)
+STORAGE_UPLOAD_SECONDS = Histogram(
+    "storage_upload_seconds", "Storage provider upload time", ["provider"], buckets=SLOW_BUCKETS
+)
+ADAPTER_PUBLISH_SECONDS = Histogram(
+    "adapter_publish_seconds", "Social adapter publish time", ["adapter"], buckets=SLOW_BUCKETS
+)
+PLACEHOLDER_IMAGES_TOTAL = Counter(
+    "placeholder_images_total", "Placeholder images served because image generation failed"
+)
+RETRIES_TOTAL = Counter(
+    "retries_total", "Retried operations", ["operation"]
+)
+STORAGE_GC_DELETED_TOTAL = Counter(
+    "storage_gc_deleted_total", "Storage objects removed by the garbage collector", ["reason"]
+)
+WEBHOOK_EVENTS_TOTAL = Counter(
+    "webhook_events_total", "Provider status callbacks received", ["provider", "outcome"]
+)
+IMAGE_CACHE_REQUESTS_TOTAL = Counter(
+    "image_cache_requests_total", "Image result cache lookups (hit / miss / bypass)", ["result"]
+)
+IMAGE_CACHE_EVICTIONS_TOTAL = Counter(
+    "image_cache_evictions_total", "Images evicted from the result cache to stay within its size budget"
+)
+IMAGE_CACHE_BYTES = Gauge(
+    "image_cache_bytes", "Encoded bytes held by the image result cache", multiprocess_mode="livesum"
+)
+GENERATION_QUEUE_DEPTH = Gauge(
+    "generation_queue_depth", "Posts waiting to be claimed for generation", ["lane"], multiprocess_mode="max"
+)
+GENERATION_QUEUE_WAIT_SECONDS = Histogram(
+    "generation_queue_wait_seconds", "Time from generation request to claim", ["lane"], buckets=SLOW_BUCKETS
+)
+GENERATION_INFLIGHT = Gauge(
+    "generation_inflight", "Generation jobs running", ["lane"], multiprocess_mode="livesum"
+)
+GENERATION_CANCELLED_TOTAL = Counter(
+    "generation_cancelled_total", "In-flight generations cancelled before finishing", ["reason"]
+)
+MODEL_TOKENS_TOTAL = Counter(
+    "model_tokens_total", "Model tokens consumed (input excludes cached)", ["operation", "kind"]
+)
+MODEL_COST_USD_TOTAL = Counter(
+    "model_cost_usd_total", "Estimated model spend at MODEL_PRICING rates", ["operation"]
+)
+USAGE_RECORDS_DROPPED_TOTAL = Counter(
+    "usage_records_dropped_total", "Usage records discarded because the buffer overflowed"
+)
+
+_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE)\s+([a-z_][a-z0-9_]*)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=512)
+def statement_label(query: str) -> str:
+    """Low-cardinality label for a SQL statement, e.g. 'SELECT posts' or 'INSERT campaigns'."""
+    tokens = query.split(None, 1)
+    if not tokens:
+        return "UNKNOWN"
+    verb = tokens[0].upper()
+    match = _TABLE.search(query)
+    return f"{verb} {match.group(1).lower()}" if match else verb
+
+
+def observe_query(record):
+    """asyncpg query logger callback (see Connection.add_query_logger)."""
+    DB_QUERY_SECONDS.labels(statement=statement_label(record.query)).observe(record.elapsed)
+
+
+def render_metrics():
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead():
+    """Drops this process's live gauges from the shared metrics directory. Call on shutdown."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,180 @@
+import logging
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Idempotent schema changes applied on every startup, in order.
+# Keep database/cloud_init.sql in sync for fresh installs.
+MIGRATIONS: List[Tuple[str, str]] = [
+    ("posts.input_image_url", """
+        ALTER TABLE posts ADD COLUMN IF NOT EXISTS input_image_url TEXT;
+    """),
+    ("posts.use_as_content", """
+        ALTER TABLE posts ADD COLUMN IF NOT EXISTS use_as_content BOOLEAN DEFAULT FALSE;
+    """),
+    # Brand/campaign writes notify every worker so cached context is dropped
+    ("context_invalidation_triggers", """
+        CREATE OR REPLACE FUNCTION notify_context_invalidation() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('context_invalidation', TG_TABLE_NAME || ':' || COALESCE(NEW.id, OLD.id));
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS brands_context_invalidation ON brands;
+        CREATE TRIGGER brands_context_invalidation AFTER INSERT OR UPDATE OR DELETE ON brands
+            FOR EACH ROW EXECUTE FUNCTION notify_context_invalidation();
+
+        DROP TRIGGER IF EXISTS campaigns_context_invalidation ON campaigns;
+        CREATE TRIGGER campaigns_context_invalidation AFTER UPDATE OR DELETE ON campaigns
+            FOR EACH ROW EXECUTE FUNCTION notify_context_invalidation();
+    """),
+    # Older databases (database/init.sql) created posts.campaign_id without a cascade
+    ("posts.campaign_id cascade", """
+        DO $$
+        BEGIN
+            IF EXISTS (
+                SELECT 1 FROM pg_constraint
+                WHERE conname = 'posts_campaign_id_fkey' AND confdeltype <> 'c'
+            ) THEN
+                ALTER TABLE posts DROP CONSTRAINT posts_campaign_id_fkey;
+                ALTER TABLE posts ADD CONSTRAINT posts_campaign_id_fkey
+                    FOREIGN KEY (campaign_id) REFERENCES campaigns(id) ON DELETE CASCADE;
+            END IF;
+        END $$;
+    """),
+    # Outbox of storage objects that may have become unreferenced (drained by backend.storage_gc)
+    ("storage_gc_queue", """
+        CREATE TABLE IF NOT EXISTS storage_gc_queue (
+            id BIGSERIAL PRIMARY KEY,
+            url TEXT NOT NULL,
+            enqueued_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            claimed_at TIMESTAMP WITH TIME ZONE
+        );
+        CREATE INDEX IF NOT EXISTS idx_posts_image_urls ON posts USING GIN (image_urls);
+        CREATE INDEX IF NOT EXISTS idx_posts_input_image_url ON posts(input_image_url);
+    """),
+    # Generation queue consumed by backend.generation_jobs; posts already PENDING are queued once
+    ("posts.generation_queue", """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'posts' AND column_name = 'generation_requested_at'
+            ) THEN
+                ALTER TABLE posts ADD COLUMN generation_requested_at TIMESTAMP WITH TIME ZONE;
+                UPDATE posts SET generation_requested_at = created_at WHERE status = 'PENDING';
+            END IF;
+        END $$;
+        ALTER TABLE posts ADD COLUMN IF NOT EXISTS generation_claimed_at TIMESTAMP WITH TIME ZONE;
+        CREATE INDEX IF NOT EXISTS idx_posts_generation_queue ON posts(generation_requested_at) WHERE generation_requested_at IS NOT NULL;
+    """),
+    # Per-request opt-out of the image result cache (execution.image_cache)
+    ("posts.generation_bypass_cache", """
+        ALTER TABLE posts ADD COLUMN IF NOT EXISTS generation_bypass_cache BOOLEAN NOT NULL DEFAULT FALSE;
+    """),
+    # Scheduling lane of a queued generation (backend.generation_jobs.LANES)
+    ("posts.generation_lane", """
+        ALTER TABLE posts ADD COLUMN IF NOT EXISTS generation_lane TEXT NOT NULL DEFAULT 'bulk';
+        CREATE INDEX IF NOT EXISTS idx_posts_generation_lane ON posts(generation_lane, generation_requested_at) WHERE generation_requested_at IS NOT NULL;
+    """),
+    # Bumped on every generation request; runs only write results while their version is current
+    ("posts.generation_version", """
+        ALTER TABLE posts ADD COLUMN IF NOT EXISTS generation_version INTEGER NOT NULL DEFAULT 0;
+    """),
+    # Publish ledger used by backend.publishing
+    ("publish_attempts", """
+        CREATE TABLE IF NOT EXISTS publish_attempts (
+            id BIGSERIAL PRIMARY KEY,
+            post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+            platform TEXT NOT NULL,
+            dedup_key TEXT NOT NULL UNIQUE,
+            state TEXT NOT NULL DEFAULT 'PENDING', -- PENDING, IN_FLIGHT, SUCCEEDED, FAILED, UNKNOWN
+            attempt INTEGER NOT NULL DEFAULT 0,
+            external_id TEXT,
+            error TEXT,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_publish_attempts_post_id ON publish_attempts(post_id);
+        CREATE INDEX IF NOT EXISTS idx_publish_attempts_unresolved ON publish_attempts(updated_at) WHERE state IN ('IN_FLIGHT', 'UNKNOWN');
+    """),
+    # Provider status callbacks (backend.webhooks): deduplicated on arrival, applied in batches
+    ("provider_webhook_events", """
+        ALTER TABLE publish_attempts ADD COLUMN IF NOT EXISTS provider_status TEXT;
+        ALTER TABLE publish_attempts ADD COLUMN IF NOT EXISTS provider_status_at TIMESTAMP WITH TIME ZONE;
+        CREATE INDEX IF NOT EXISTS idx_publish_attempts_external_id ON publish_attempts(external_id);
+        CREATE TABLE IF NOT EXISTS provider_webhook_events (
+            id BIGSERIAL PRIMARY KEY,
+            provider TEXT NOT NULL,
+            event_id TEXT NOT NULL,
+            external_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            payload JSONB,
+            received_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            processed_at TIMESTAMP WITH TIME ZONE,
+            UNIQUE (provider, event_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_provider_webhook_events_pending ON provider_webhook_events(id) WHERE processed_at IS NULL;
+    """),
+    # Append-only model usage ledger (backend.usage) and its daily rollup; no FKs so costs outlive deleted posts.
+    # 0 stands for "no brand/campaign" in the rollup, since REFRESH ... CONCURRENTLY needs a NULL-free unique key.
+    ("model_usage", """
+        CREATE TABLE IF NOT EXISTS model_usage (
+            id BIGSERIAL PRIMARY KEY,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            operation TEXT NOT NULL, -- brand_analysis, caption, image
+            model TEXT NOT NULL,
+            post_id INTEGER,
+            campaign_id INTEGER,
+            brand_id INTEGER,
+            input_tokens INTEGER NOT NULL DEFAULT 0,
+            cached_tokens INTEGER NOT NULL DEFAULT 0,
+            output_tokens INTEGER NOT NULL DEFAULT 0,
+            images INTEGER NOT NULL DEFAULT 0,
+            cache_hit BOOLEAN NOT NULL DEFAULT FALSE,
+            cost_usd NUMERIC(12, 6) NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_model_usage_post_id ON model_usage(post_id) WHERE post_id IS NOT NULL;
+        CREATE MATERIALIZED VIEW IF NOT EXISTS model_usage_daily AS
+        SELECT (created_at AT TIME ZONE 'UTC')::date AS day,
+               COALESCE(brand_id, 0) AS brand_id,
+               COALESCE(campaign_id, 0) AS campaign_id,
+               operation,
+               model,
+               COUNT(*) AS calls,
+               COUNT(*) FILTER (WHERE cache_hit) AS cache_hits,
+               SUM(input_tokens)::bigint AS input_tokens,
+               SUM(cached_tokens)::bigint AS cached_tokens,
+               SUM(output_tokens)::bigint AS output_tokens,
+               SUM(images)::bigint AS images,
+               SUM(cost_usd) AS cost_usd,
+               MAX(created_at) AS last_call_at
+        FROM model_usage
+        GROUP BY 1, 2, 3, 4, 5;
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_model_usage_daily_key ON model_usage_daily(day, brand_id, campaign_id, operation, model);
+    """),
+    # Reconciler backoff for publish attempts the provider can't resolve (backend.publishing._defer_reconcile)
+    ("publish_attempts.reconcile_after", """
+        ALTER TABLE publish_attempts ADD COLUMN IF NOT EXISTS reconcile_checks INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE publish_attempts ADD COLUMN IF NOT EXISTS reconcile_after TIMESTAMP WITH TIME ZONE;
+    """),
+    # Publish failures get their own status instead of reusing the generation FAILED
+    ("post_status.PUBLISH_FAILED", """
+        ALTER TYPE post_status ADD VALUE IF NOT EXISTS 'PUBLISH_FAILED';
+    """),
+    # Callbacks that arrive before their attempt stored the job id are retried, then dead-lettered (backend.webhooks)
+    ("provider_webhook_events.retry_after", """
+        ALTER TABLE provider_webhook_events ADD COLUMN IF NOT EXISTS retry_after TIMESTAMP WITH TIME ZONE;
+        ALTER TABLE provider_webhook_events ADD COLUMN IF NOT EXISTS dead_lettered_at TIMESTAMP WITH TIME ZONE;
+    """),
+]
+
+
+async def run_startup_migrations(connection):
+    for name, sql in MIGRATIONS:
+        try:
+            await connection.execute(sql)
+        except Exception as e:
+            logger.warning("Migration error (%s): %s", name, e)
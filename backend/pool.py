@@ -0,0 +1,131 @@
+import os
+import time
+import asyncpg
+from collections import deque
+from typing import Any, Dict, Optional
+from backend.metrics import DB_POOL_ACQUIRE_SECONDS
+
+# Pool sizing / behaviour (env-tunable; defaults match the previous hard-coded pool)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "5"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "30"))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "60"))
+DB_POOL_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", "300"))
+# Set when DATABASE_URL points at pgbouncer in transaction mode (e.g. Supabase port 6543):
+# prepared statements can't survive across transactions there, so asyncpg's statement cache is disabled.
+DB_PGBOUNCER_TRANSACTION_MODE = os.getenv("DB_PGBOUNCER_TRANSACTION_MODE", "false").lower() == "true"
+
+
+class PoolWaitStats:
+    """Rolling statistics of how long handlers wait to acquire a pooled connection."""
+    def __init__(self, window: int = 2048):
+        self.acquired = 0
+        self.waiting = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.recent = deque(maxlen=window)
+
+    def record(self, wait: float):
+        self.acquired += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.recent.append(wait)
+
+    def snapshot(self) -> Dict[str, Any]:
+        recent = sorted(self.recent)
+
+        def pct(p: float) -> float:
+            if not recent:
+                return 0.0
+            return recent[min(len(recent) - 1, int(p * len(recent)))]
+
+        return {
+            "acquired": self.acquired,
+            "waiting": self.waiting,
+            "wait_avg_ms": round(self.total_wait / self.acquired * 1000, 3) if self.acquired else 0.0,
+            "wait_p50_ms": round(pct(0.50) * 1000, 3),
+            "wait_p95_ms": round(pct(0.95) * 1000, 3),
+            "wait_p99_ms": round(pct(0.99) * 1000, 3),
+            "wait_max_ms": round(self.max_wait * 1000, 3),
+        }
+
+
+class _TimedAcquire:
+    def __init__(self, owner: "InstrumentedPool", timeout: Optional[float]):
+        self._owner = owner
+        self._timeout = timeout
+        self._conn = None
+
+    async def __aenter__(self):
+        stats = self._owner.stats
+        start = time.perf_counter()
+        stats.waiting += 1
+        try:
+            self._conn = await self._owner.pool.acquire(timeout=self._timeout)
+        finally:
+            stats.waiting -= 1
+        wait = time.perf_counter() - start
+        stats.record(wait)
+        DB_POOL_ACQUIRE_SECONDS.observe(wait)
+        return self._conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._owner.pool.release(self._conn)
+
+
+class InstrumentedPool:
+    """
+    Thin wrapper around an asyncpg pool that measures acquire wait time.
+    Exposes the same `acquire()` / `close()` surface so handlers keep using `async with pool.acquire()`.
+    """
+    def __init__(self, pool):
+        self.pool = pool
+        self.stats = PoolWaitStats()
+
+    def acquire(self, timeout: Optional[float] = DB_POOL_ACQUIRE_TIMEOUT) -> _TimedAcquire:
+        return _TimedAcquire(self, timeout)
+
+    async def close(self):
+        await self.pool.close()
+
+    def health(self) -> Dict[str, Any]:
+        size = self.pool.get_size()
+        idle = self.pool.get_idle_size()
+        return {
+            "size": size,
+            "in_use": size - idle,
+            "idle": idle,
+            "min_size": self.pool.get_min_size(),
+            "max_size": self.pool.get_max_size(),
+            "pgbouncer_transaction_mode": DB_PGBOUNCER_TRANSACTION_MODE,
+            **self.stats.snapshot(),
+        }
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+
+def pool_config() -> Dict[str, Any]:
+    return {
+        "min_size": DB_POOL_MIN_SIZE,
+        "max_size": DB_POOL_MAX_SIZE,
+        "acquire_timeout": DB_POOL_ACQUIRE_TIMEOUT,
+        "command_timeout": DB_COMMAND_TIMEOUT,
+        "pgbouncer_transaction_mode": DB_PGBOUNCER_TRANSACTION_MODE,
+    }
+
+
+async def create_pool(dsn: str, init=None) -> InstrumentedPool:
+    kwargs: Dict[str, Any] = {}
+    if DB_PGBOUNCER_TRANSACTION_MODE:
+        kwargs["statement_cache_size"] = 0
+    pool = await asyncpg.create_pool(
+        dsn,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        command_timeout=DB_COMMAND_TIMEOUT,
+        max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+        init=init,
+        **kwargs
+    )
+    return InstrumentedPool(pool)
@@ -0,0 +1,446 @@
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+import httpx
+from backend import tracing
+from backend.metrics import ADAPTER_PUBLISH_SECONDS
+from backend.social_adapter import BULK_SCHEDULE_CONCURRENCY, PublishOutcomeUnknown, ScheduleItem, SocialAdapter
+from execution.media import MediaHandle, open_media
+
+logger = logging.getLogger(__name__)
+
+# An IN_FLIGHT attempt older than this belongs to a process that died mid-publish; it is reconciled, not retried blindly
+PUBLISH_ATTEMPT_LEASE = int(os.getenv("PUBLISH_ATTEMPT_LEASE", "300"))
+PUBLISH_RECONCILE_INTERVAL = float(os.getenv("PUBLISH_RECONCILE_INTERVAL", "60"))
+PUBLISH_RECONCILE_BATCH = int(os.getenv("PUBLISH_RECONCILE_BATCH", "100"))
+# Attempts the provider can't resolve yet (or has no status API for) are rechecked with exponential backoff up to this
+PUBLISH_RECONCILE_MAX_BACKOFF = float(os.getenv("PUBLISH_RECONCILE_MAX_BACKOFF", "21600"))
+# Per-platform budget in a fan-out publish; a slow network times out on its own without holding up the others
+PUBLISH_TARGET_TIMEOUT = float(os.getenv("PUBLISH_TARGET_TIMEOUT", "90"))
+
+_ATTEMPT_COLUMNS = "id, post_id, platform, dedup_key, state, external_id, attempt, updated_at"
+
+
+class PublishInProgress(Exception):
+    """Another request is publishing the same post right now."""
+
+
+@dataclass
+class PublishResult:
+    state: str
+    external_id: Optional[str]
+    attempt: int
+    # True when an earlier attempt had already published the post and nothing was sent
+    deduplicated: bool = False
+
+
+@dataclass
+class PublishTarget:
+    platform: str
+    adapter: SocialAdapter
+    platform_config: Dict[str, Any] = field(default_factory=dict)
+    timeout: float = PUBLISH_TARGET_TIMEOUT
+
+
+def dedup_key(post_id: int, platform: str) -> str:
+    """One logical publish per post and platform."""
+    return f"{platform}:post:{post_id}"
+
+
+def provider_key(row) -> str:
+    """Idempotency-Key sent to the provider: per attempt, so a retry after a definite failure isn't replayed as that failure."""
+    return f"{row['dedup_key']}#{row['attempt']}"
+
+
+async def _mark_succeeded(conn, attempt_id: int, attempt: int, post_id: int, external_id: Optional[str]) -> bool:
+    async with conn.transaction():
+        result = await conn.execute("""
+            UPDATE publish_attempts
+            SET state = 'SUCCEEDED', external_id = $3, error = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE id = $1 AND attempt = $2 AND state <> 'SUCCEEDED'
+        """, attempt_id, attempt, external_id)
+        if result == "UPDATE 0":
+            return False
+        await conn.execute("""
+            UPDATE posts SET status = 'PUBLISHED', updated_at = CURRENT_TIMESTAMP WHERE id = $1
+        """, post_id)
+        return True
+
+
+async def _set_state(conn, attempt_id: int, attempt: int, state: str, error: Optional[str] = None):
+    await conn.execute("""
+        UPDATE publish_attempts SET state = $3, error = $4, updated_at = CURRENT_TIMESTAMP
+        WHERE id = $1 AND attempt = $2 AND state <> 'SUCCEEDED'
+    """, attempt_id, attempt, state, error)
+
+
+async def _defer_reconcile(conn, attempt_id: int, attempt: int):
+    """Pushes the next status lookup back (interval * 2^checks, capped) so unresolvable rows don't starve the batch."""
+    await conn.execute("""
+        UPDATE publish_attempts SET
+            reconcile_checks = reconcile_checks + 1,
+            reconcile_after = CURRENT_TIMESTAMP + make_interval(secs => LEAST($3 * power(2, reconcile_checks), $4))
+        WHERE id = $1 AND attempt = $2
+    """, attempt_id, attempt, PUBLISH_RECONCILE_INTERVAL, PUBLISH_RECONCILE_MAX_BACKOFF)
+
+
+async def _record_outcome(pool, attempt_id: int, attempt: int, state: str, error: Optional[str] = None):
+    async with pool.acquire() as conn:
+        await _set_state(conn, attempt_id, attempt, state, error)
+
+
+async def reconcile_attempt(pool, adapter: SocialAdapter, row, platform_config: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Resolves an UNKNOWN (or abandoned IN_FLIGHT) attempt through the provider's status API.
+    Returns the resulting state; UNKNOWN if the provider can't tell (yet).
+    """
+    try:
+        status = await adapter.get_publish_status(provider_key(row), row['external_id'], platform_config)
+    except Exception as e:
+        logger.warning("Publish status lookup failed for %s: %s", row['dedup_key'], e)
+        status = None
+
+    async with pool.acquire() as conn:
+        if status is None or status.state == "pending":
+            if row['state'] == 'IN_FLIGHT':
+                await _set_state(conn, row['id'], row['attempt'], 'UNKNOWN', "Abandoned in flight; awaiting reconciliation")
+            # None also covers adapters without a status API: a provider webhook (or a forced retry) resolves those
+            await _defer_reconcile(conn, row['id'], row['attempt'])
+            return "UNKNOWN"
+        if status.state == "published":
+            await _mark_succeeded(conn, row['id'], row['attempt'], row['post_id'], status.external_id)
+            logger.info("Reconciled %s as published (%s)", row['dedup_key'], status.external_id)
+            return "SUCCEEDED"
+        # The provider never received it: safe to publish again
+        await _set_state(conn, row['id'], row['attempt'], 'FAILED', "Not found at provider during reconciliation")
+        return "FAILED"
+
+
+async def _claim_attempt(pool, post_id: int, platform: str, force: bool):
+    """
+    Takes the attempt row lock and decides what to do: returns (row, action) where action is
+    'done' (already published), 'reconcile' (outcome unknown) or 'publish' (row now IN_FLIGHT).
+    """
+    key = dedup_key(post_id, platform)
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("""
+                INSERT INTO publish_attempts (post_id, platform, dedup_key, state, attempt)
+                VALUES ($1, $2, $3, 'PENDING', 0)
+                ON CONFLICT (dedup_key) DO NOTHING
+            """, post_id, platform, key)
+            row = await conn.fetchrow(f"""
+                SELECT {_ATTEMPT_COLUMNS},
+                       updated_at < CURRENT_TIMESTAMP - make_interval(secs => $2) AS lease_expired
+                FROM publish_attempts WHERE dedup_key = $1
+                FOR UPDATE
+            """, key, PUBLISH_ATTEMPT_LEASE)
+
+            if row['state'] == 'SUCCEEDED':
+                return row, "done"
+            if row['state'] == 'IN_FLIGHT' and not row['lease_expired']:
+                raise PublishInProgress(f"Post {post_id} is already being published to {platform}")
+            if row['state'] in ('UNKNOWN', 'IN_FLIGHT') and not force:
+                return row, "reconcile"
+
+            claimed = await conn.fetchrow(f"""
+                UPDATE publish_attempts
+                SET state = 'IN_FLIGHT', attempt = attempt + 1, error = NULL, updated_at = CURRENT_TIMESTAMP,
+                    reconcile_checks = 0, reconcile_after = NULL
+                WHERE id = $1
+                RETURNING {_ATTEMPT_COLUMNS}
+            """, row['id'])
+            return claimed, "publish"
+
+
+async def publish_once(pool, adapter: SocialAdapter, post_id: int, platform: str, image_url: str, caption: str, platform_config: Dict[str, Any], post_type: str = "POST", scheduled_at: Optional[Any] = None, force: bool = False, media: Optional[MediaHandle] = None) -> PublishResult:
+    """
+    Publishes a post at most once per platform, however often it is called.
+    State lives in publish_attempts (PENDING -> IN_FLIGHT -> SUCCEEDED | FAILED | UNKNOWN), changed
+    under the row lock; the adapter call itself runs without holding a connection.
+    Unknown outcomes are resolved through the provider's status API before anything is re-sent;
+    `force` re-sends anyway (for providers without a status API, after checking manually).
+
+    Raises PublishInProgress, PublishOutcomeUnknown, or the adapter's ValueError on a definite rejection.
+    """
+    row, action = await _claim_attempt(pool, post_id, platform, force)
+    if action == "reconcile":
+        state = await reconcile_attempt(pool, adapter, row, platform_config)
+        if state == "UNKNOWN":
+            raise PublishOutcomeUnknown(f"Outcome of the last publish of post {post_id} to {platform} is unknown; it will be reconciled")
+        # SUCCEEDED -> 'done'; FAILED -> claim again and publish
+        row, action = await _claim_attempt(pool, post_id, platform, force)
+        if action == "reconcile":
+            raise PublishOutcomeUnknown(f"Outcome of the last publish of post {post_id} to {platform} is unknown; it will be reconciled")
+
+    if action == "done":
+        return PublishResult("SUCCEEDED", row['external_id'], row['attempt'], deduplicated=True)
+
+    platform_config = {**platform_config, "platform": platform}
+    try:
+        with tracing.span("adapter.publish", **{"adapter": type(adapter).__name__, "post.id": post_id, "platform": platform, "publish.attempt": row['attempt']}), \
+                ADAPTER_PUBLISH_SECONDS.labels(adapter=type(adapter).__name__).time():
+            external_id = await adapter.publish(
+                image_url,
+                caption,
+                platform_config,
+                post_type=post_type,
+                scheduled_at=scheduled_at,
+                idempotency_key=provider_key(row),
+                media=media
+            )
+    except ValueError as e:
+        await _record_outcome(pool, row['id'], row['attempt'], 'FAILED', str(e))
+        raise
+    except asyncio.CancelledError:
+        # The request may already be on its way to the provider
+        await asyncio.shield(_record_outcome(pool, row['id'], row['attempt'], 'UNKNOWN', "Cancelled mid-publish"))
+        raise
+    except Exception as e:
+        # Timeouts, dropped connections, 5xx, unexpected errors: the post may be live. A 4xx is a definite rejection.
+        rejected = isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500
+        await _record_outcome(pool, row['id'], row['attempt'], 'FAILED' if rejected else 'UNKNOWN', str(e))
+        if rejected:
+            raise ValueError(f"Publishing rejected: {str(e)}") from e
+        raise PublishOutcomeUnknown(str(e)) from e
+
+    async with pool.acquire() as conn:
+        await _mark_succeeded(conn, row['id'], row['attempt'], post_id, external_id)
+    return PublishResult("SUCCEEDED", external_id, row['attempt'])
+
+
+async def _publish_target(pool, target: PublishTarget, post_id: int, image_url: str, caption: str, post_type: str, scheduled_at: Optional[Any], force: bool, media: Optional[MediaHandle]) -> Dict[str, Any]:
+    """One leg of a fan-out: never raises, reports its own outcome."""
+    started = time.perf_counter()
+    outcome: Dict[str, Any] = {"platform": target.platform}
+    try:
+        # publish_once records UNKNOWN when the timeout cancels it mid-request
+        result = await asyncio.wait_for(
+            publish_once(pool, target.adapter, post_id, target.platform, image_url, caption, target.platform_config,
+                         post_type=post_type, scheduled_at=scheduled_at, force=force, media=media),
+            timeout=target.timeout
+        )
+        outcome.update(state=result.state, publish_id=result.external_id, attempt=result.attempt, deduplicated=result.deduplicated)
+    except PublishInProgress as e:
+        outcome.update(state="IN_FLIGHT", error=str(e))
+    except asyncio.TimeoutError:
+        outcome.update(state="UNKNOWN", error=f"Timed out after {target.timeout}s; it will be reconciled")
+    except PublishOutcomeUnknown as e:
+        outcome.update(state="UNKNOWN", error=str(e))
+    except ValueError as e:
+        outcome.update(state="FAILED", error=str(e))
+    except Exception as e:
+        logger.error("Publishing post %s to %s failed: %s", post_id, target.platform, e)
+        outcome.update(state="FAILED", error=str(e))
+    outcome["seconds"] = round(time.perf_counter() - started, 3)
+    return outcome
+
+
+async def publish_fan_out(pool, post_id: int, targets: List[PublishTarget], image_url: str, caption: str, post_type: str = "POST", scheduled_at: Optional[Any] = None, force: bool = False) -> List[Dict[str, Any]]:
+    """
+    Publishes one post to several platforms concurrently, so the whole call takes as long as the
+    slowest target rather than the sum. Each target goes through publish_once (its own
+    publish_attempts row, dedup and reconciliation) under its own timeout; a failure or timeout on
+    one platform doesn't affect the others. The image is read/downloaded once and shared by every
+    adapter that uploads bytes itself.
+
+    Returns one status dict per target, in the order given.
+    """
+    media = None
+    uploaders = [target.adapter for target in targets if target.adapter.uploads_media]
+    if uploaders:
+        try:
+            # Original bytes (no model downscaling), read from our storage when the image is ours
+            media = await open_media(image_url, uploaders[0].storage, max_dimension=0)
+        except Exception as e:
+            # Each adapter falls back to loading the image itself
+            logger.warning("Could not preload media for post %s: %s", post_id, e)
+
+    with tracing.span("publish.fan_out", **{"post.id": post_id, "publish.targets": len(targets)}):
+        return list(await asyncio.gather(*[
+            _publish_target(pool, target, post_id, image_url, caption, post_type, scheduled_at, force, media)
+            for target in targets
+        ]))
+
+
+async def _claim_attempts(pool, post_ids: List[int], platform: str) -> Dict[int, Any]:
+    """
+    Batch form of _claim_attempt for bulk scheduling: returns {post_id: (row, action)}. Only PENDING
+    and FAILED attempts are claimed ('publish'); anything in flight or unknown is left to its owner
+    or the reconciler ('skip'), and succeeded ones are reported as 'done'.
+    """
+    keys = [dedup_key(post_id, platform) for post_id in post_ids]
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("""
+                INSERT INTO publish_attempts (post_id, platform, dedup_key, state, attempt)
+                SELECT t.post_id, $3, t.dedup_key, 'PENDING', 0
+                FROM unnest($1::int[], $2::text[]) AS t(post_id, dedup_key)
+                ON CONFLICT (dedup_key) DO NOTHING
+            """, post_ids, keys, platform)
+            claimed = await conn.fetch(f"""
+                UPDATE publish_attempts
+                SET state = 'IN_FLIGHT', attempt = attempt + 1, error = NULL, updated_at = CURRENT_TIMESTAMP,
+                    reconcile_checks = 0, reconcile_after = NULL
+                WHERE dedup_key = ANY($1::text[]) AND state IN ('PENDING', 'FAILED')
+                RETURNING {_ATTEMPT_COLUMNS}
+            """, keys)
+            others = await conn.fetch(f"""
+                SELECT {_ATTEMPT_COLUMNS} FROM publish_attempts
+                WHERE dedup_key = ANY($1::text[]) AND NOT (id = ANY($2::int[]))
+            """, keys, [row['id'] for row in claimed])
+
+    actions = {row['post_id']: (row, "publish") for row in claimed}
+    for row in others:
+        actions[row['post_id']] = (row, "done" if row['state'] == 'SUCCEEDED' else "skip")
+    return actions
+
+
+async def _record_outcomes(pool, outcomes: List[tuple]):
+    """
+    Writes (attempt_row, state, external_id, error) for a whole batch: one UPDATE for the attempts
+    and one for the posts that went through, in a single transaction.
+    """
+    if not outcomes:
+        return
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("""
+                UPDATE publish_attempts a
+                SET state = t.state, external_id = COALESCE(t.external_id, a.external_id), error = t.error,
+                    updated_at = CURRENT_TIMESTAMP
+                FROM unnest($1::int[], $2::int[], $3::text[], $4::text[], $5::text[]) AS t(id, attempt, state, external_id, error)
+                WHERE a.id = t.id AND a.attempt = t.attempt AND a.state <> 'SUCCEEDED'
+            """,
+                [row['id'] for row, *_ in outcomes],
+                [row['attempt'] for row, *_ in outcomes],
+                [state for _, state, _, _ in outcomes],
+                [external_id for _, _, external_id, _ in outcomes],
+                [error for _, _, _, error in outcomes])
+            succeeded = [row['post_id'] for row, state, _, _ in outcomes if state == 'SUCCEEDED']
+            if succeeded:
+                await conn.execute("""
+                    UPDATE posts SET status = 'PUBLISHED', updated_at = CURRENT_TIMESTAMP WHERE id = ANY($1::int[])
+                """, succeeded)
+
+
+async def schedule_bulk(pool, adapter: SocialAdapter, platform: str, posts: List[Any], platform_config: Dict[str, Any], concurrency: int = BULK_SCHEDULE_CONCURRENCY) -> List[Dict[str, Any]]:
+    """
+    Pushes a calendar of scheduled posts (rows with id, image_url, caption, scheduled_at, type) to the
+    provider through adapter.schedule_many: claims every attempt in one transaction, lets the adapter
+    batch or pipeline the requests, and stores all job IDs / errors with one batched write.
+    Same ledger and dedup keys as publish_once, so posts already published are not sent again.
+    """
+    actions = await _claim_attempts(pool, [post['id'] for post in posts], platform)
+    platform_config = {**platform_config, "platform": platform}
+
+    results: Dict[int, Dict[str, Any]] = {}
+    items = []
+    for post in posts:
+        row, action = actions[post['id']]
+        if action == "done":
+            results[post['id']] = {"post_id": post['id'], "state": "SUCCEEDED", "publish_id": row['external_id'], "deduplicated": True}
+        elif action == "skip":
+            results[post['id']] = {"post_id": post['id'], "state": row['state'], "error": "Publish already in progress or awaiting reconciliation"}
+        else:
+            items.append(ScheduleItem(post['id'], post['image_url'], post['caption'], post['scheduled_at'],
+                                      post_type=post['type'], idempotency_key=provider_key(row)))
+
+    if items:
+        claimed = {item.key: actions[item.key][0] for item in items}
+        try:
+            with tracing.span("adapter.schedule_many", **{"adapter": type(adapter).__name__, "platform": platform, "schedule.items": len(items)}), \
+                    ADAPTER_PUBLISH_SECONDS.labels(adapter=type(adapter).__name__).time():
+                outcomes = await adapter.schedule_many(items, platform_config, concurrency=concurrency)
+        except asyncio.CancelledError:
+            await asyncio.shield(_record_outcomes(pool, [(row, 'UNKNOWN', None, "Cancelled mid-schedule") for row in claimed.values()]))
+            raise
+        except Exception as e:
+            # The whole batch failed before (or while) reaching the provider
+            state = 'FAILED' if isinstance(e, ValueError) else 'UNKNOWN'
+            for post_id in claimed:
+                results[post_id] = {"post_id": post_id, "state": state, "error": str(e)}
+            await _record_outcomes(pool, [(row, state, None, str(e)) for row in claimed.values()])
+        else:
+            writes = []
+            for post_id, row in claimed.items():
+                outcome = outcomes.get(post_id)
+                if outcome is not None and outcome.error is None:
+                    writes.append((row, 'SUCCEEDED', outcome.external_id, None))
+                    results[post_id] = {"post_id": post_id, "state": "SUCCEEDED", "publish_id": outcome.external_id}
+                    continue
+                error = outcome.error if outcome is not None else PublishOutcomeUnknown("No result from adapter")
+                # Definite rejections can be retried; anything else may have gone through and is reconciled
+                state = 'FAILED' if isinstance(error, ValueError) else 'UNKNOWN'
+                writes.append((row, state, None, str(error)))
+                results[post_id] = {"post_id": post_id, "state": state, "error": str(error)}
+            await _record_outcomes(pool, writes)
+
+    return [results[post['id']] for post in posts]
+
+
+class PublishReconciler:
+    """Background task resolving UNKNOWN and abandoned IN_FLIGHT attempts through the provider's status API."""
+    def __init__(self, pool, adapter_factory: Callable[[str], SocialAdapter], interval: float = PUBLISH_RECONCILE_INTERVAL, batch_size: int = PUBLISH_RECONCILE_BATCH):
+        self.pool = pool
+        self.adapter_factory = adapter_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    async def reconcile_once(self) -> int:
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT a.id, a.post_id, a.platform, a.dedup_key, a.state, a.external_id, a.attempt, a.updated_at,
+                       i.access_token
+                FROM publish_attempts a
+                LEFT JOIN integrations i ON i.platform = a.platform
+                WHERE (a.state = 'UNKNOWN'
+                       OR (a.state = 'IN_FLIGHT' AND a.updated_at < CURRENT_TIMESTAMP - make_interval(secs => $1)))
+                  AND (a.reconcile_after IS NULL OR a.reconcile_after <= CURRENT_TIMESTAMP)
+                ORDER BY COALESCE(a.reconcile_after, a.updated_at)
+                LIMIT $2
+            """, PUBLISH_ATTEMPT_LEASE, self.batch_size)
+        if not rows:
+            return 0
+
+        adapters: Dict[str, SocialAdapter] = {}
+        resolved = 0
+        for row in rows:
+            if row['platform'] not in adapters:
+                adapters[row['platform']] = self.adapter_factory(row['platform'])
+            adapter = adapters[row['platform']]
+            platform_config = {"platform": row['platform']}
+            if row['access_token']:
+                platform_config["api_key"] = row['access_token']
+            if await reconcile_attempt(self.pool, adapter, row, platform_config) != "UNKNOWN":
+                resolved += 1
+        if resolved:
+            logger.info("Reconciled %s of %s publish attempts", resolved, len(rows))
+        return resolved
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.reconcile_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Publish reconciliation failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
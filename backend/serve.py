@@ -0,0 +1,72 @@
+"""
+Production entry point: multi-process uvicorn with uvloop/httptools when installed.
+
+    python -m backend.serve --role api --workers 4            # HTTP API, no generation
+    python -m backend.serve --role worker --workers 2 --port 8001   # generation queue consumers
+    python -m backend.serve                                    # both roles in every process
+
+Each process runs its own pool (DB_POOL_MAX_SIZE per process) plus two LISTEN connections, so
+--workers defaults to 2 rather than the CPU count: size it against the database's connection
+limit. With several processes, Prometheus metrics are aggregated across them through
+PROMETHEUS_MULTIPROC_DIR (a fresh temp dir unless set), so any process can answer /metrics. On SIGTERM uvicorn stops
+accepting connections and waits up to --graceful-timeout for in-flight requests (publishes
+included); the shutdown hook then drains running generations for up to
+GENERATION_DRAIN_TIMEOUT and re-queues any that are still running. Set the orchestrator's
+kill grace period above the sum of both.
+"""
+import os
+import glob
+import argparse
+import tempfile
+import importlib.util
+import uvicorn
+
+ROLES = ("all", "api", "worker")
+
+
+def _available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def _prepare_multiprocess_metrics():
+    """Points every worker's prometheus_client at one shared directory; it must start out empty."""
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not directory:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prometheus-")
+        return
+    os.makedirs(directory, exist_ok=True)
+    for stale in glob.glob(os.path.join(directory, "*.db")):
+        os.remove(stale)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Content Automation Engine")
+    parser.add_argument("--role", choices=ROLES, default=os.getenv("APP_ROLE", "all"))
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "2")))
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "60")))
+    args = parser.parse_args()
+
+    # Worker processes inherit the environment; backend.generation_jobs reads the role from it
+    os.environ["APP_ROLE"] = args.role
+    if args.workers > 1:
+        _prepare_multiprocess_metrics()
+
+    uvicorn.run(
+        "backend.main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop="uvloop" if _available("uvloop") else "asyncio",
+        http="httptools" if _available("httptools") else "h11",
+        timeout_graceful_shutdown=args.graceful_timeout,
+        proxy_headers=True,
+        forwarded_allow_ips=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+        # backend.logging_config installs the (queued, optionally JSON) handlers in every process
+        log_config=None,
+    )
+
+
+if __name__ == "__main__":
+    main()
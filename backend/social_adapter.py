@@ -1,18 +1,94 @@
-simport httpx
+import httpx
+import json
 import logging
 import os
+import uuid
+import random
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Optional, Dict, Any, BinaryIO
-from pathlib import Path
+from dataclasses import dataclass
+from typing import Awaitable, Callable, ClassVar, Optional, Dict, Any, List, Set
+from execution.media import MediaHandle, open_media
+from backend.webhooks import SIGNATURE_HEADER, sign_payload, webhook_secret
 
 logger = logging.getLogger(__name__)
 
+# Requests in flight at once when a provider has no bulk endpoint and schedule_many pipelines single publishes
+BULK_SCHEDULE_CONCURRENCY = int(os.getenv("BULK_SCHEDULE_CONCURRENCY", "8"))
+
+class PublishOutcomeUnknown(Exception):
+    """The request may have reached the provider (timeout, dropped connection, 5xx): it must be reconciled, not blindly retried."""
+
+@dataclass
+class PublishStatus:
+    state: str  # published | pending | not_found
+    external_id: Optional[str] = None
+
+@dataclass
+class ScheduleItem:
+    key: Any  # caller's identifier (post ID), echoed back in the result
+    image_url: str
+    caption: str
+    scheduled_at: Any
+    post_type: str = "POST"
+    idempotency_key: Optional[str] = None
+
+@dataclass
+class ScheduleOutcome:
+    external_id: Optional[str] = None
+    error: Optional[Exception] = None
+
+async def pipeline_schedule(items: List[ScheduleItem], concurrency: int, submit: Callable[[ScheduleItem, Optional[MediaHandle]], Awaitable[str]], preload_media: bool, client: Optional[httpx.AsyncClient] = None, storage: Optional[Any] = None) -> Dict[Any, ScheduleOutcome]:
+    """
+    Runs `submit` for every item with at most `concurrency` in flight. Each distinct image is loaded
+    once (when `preload_media`) and shared by the items using it; one item failing doesn't stop the rest.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    media_loads: Dict[str, asyncio.Future] = {}
+
+    async def run(item: ScheduleItem):
+        async with semaphore:
+            try:
+                media = None
+                if preload_media:
+                    if item.image_url not in media_loads:
+                        media_loads[item.image_url] = asyncio.ensure_future(open_media(item.image_url, storage, max_dimension=0, client=client))
+                    media = await media_loads[item.image_url]
+                return item.key, ScheduleOutcome(external_id=await submit(item, media))
+            except Exception as e:
+                return item.key, ScheduleOutcome(error=e)
+
+    return dict(await asyncio.gather(*(run(item) for item in items)))
+
 class SocialAdapter(ABC):
+    # True if publish() uploads the image bytes itself (then fan-out loads them once and passes `media`)
+    uploads_media: bool = False
+    # Storage provider our own image URLs are read from directly (set by get_social_adapter); None fetches over HTTP
+    storage: Optional[Any] = None
+
     @abstractmethod
-    async def publish(self, image_url: str, caption: str, platform_config: Dict[str, Any], post_type: str = "POST", scheduled_at: Optional[Any] = None, timezone: Optional[str] = None) -> str:
-        """Publishes content and returns a post ID/URL"""
+    async def publish(self, image_url: str, caption: str, platform_config: Dict[str, Any], post_type: str = "POST", scheduled_at: Optional[Any] = None, timezone: Optional[str] = None, idempotency_key: Optional[str] = None, media: Optional[MediaHandle] = None) -> str:
+        """
+        Publishes content and returns a post ID/URL. The target network is platform_config["platform"] (default instagram).
+        Raises ValueError when the provider definitively rejected the request, PublishOutcomeUnknown when it may have gone through.
+        """
         raise NotImplementedError("Subclasses must implement publish")
 
+    async def schedule_many(self, items: List[ScheduleItem], platform_config: Dict[str, Any], concurrency: int = BULK_SCHEDULE_CONCURRENCY) -> Dict[Any, ScheduleOutcome]:
+        """
+        Schedules a batch of posts and returns {item.key: ScheduleOutcome}; errors are per item and use
+        the same types as publish(). This default pipelines publish() calls; providers with a bulk
+        endpoint override it to submit many jobs at once.
+        """
+        async def submit(item: ScheduleItem, media: Optional[MediaHandle]) -> str:
+            return await self.publish(item.image_url, item.caption, platform_config, post_type=item.post_type,
+                                      scheduled_at=item.scheduled_at, idempotency_key=item.idempotency_key, media=media)
+        return await pipeline_schedule(items, concurrency, submit, self.uploads_media, storage=self.storage)
+
+    async def get_publish_status(self, idempotency_key: str, external_id: Optional[str] = None, platform_config: Optional[Dict[str, Any]] = None) -> Optional[PublishStatus]:
+        """Looks up the outcome of an earlier publish. None means the provider has no status API."""
+        return None
+
 class OutstandAdapter(SocialAdapter):
     """
     Adapter for Outstand.io.
@@ -21,115 +97,211 @@ class OutstandAdapter(SocialAdapter):
         self.api_url = os.getenv("OUTSTAND_API_URL", "https://api.outstand.so/v1/publish") 
         self.api_key = os.getenv("OUTSTAND_API_KEY")
 
-    async def publish(self, image_url: str, caption: str, platform_config: Dict[str, Any], post_type: str = "POST", scheduled_at: Optional[Any] = None, timezone: Optional[str] = None) -> str:
+    async def publish(self, image_url: str, caption: str, platform_config: Dict[str, Any], post_type: str = "POST", scheduled_at: Optional[Any] = None, timezone: Optional[str] = None, idempotency_key: Optional[str] = None, media: Optional[MediaHandle] = None) -> str:
         api_key = platform_config.get("api_key") or self.api_key
         if not api_key:
             raise ValueError("Outstand API Key not configured.")
 
+        # Outstand fetches the image from the URL itself
         payload = {
             "apiKey": api_key,
-            "platform": "instagram", 
+            "platform": platform_config.get("platform", "instagram"), 
             "imageUrl": image_url,
             "caption": caption,
         }
 
+        headers = {"Idempotency-Key": idempotency_key} if idempotency_key else {}
         try:
             async with httpx.AsyncClient(timeout=120.0) as client:
-                resp = await client.post(self.api_url, json=payload)
+                resp = await client.post(self.api_url, json=payload, headers=headers)
+                if resp.status_code >= 500:
+                    raise PublishOutcomeUnknown(f"Outstand API returned {resp.status_code}")
                 resp.raise_for_status()
                 data = resp.json()
                 return data.get("id") or data.get("postId") or "published-via-outstand"
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            logger.error("Outstand API Error (outcome unknown): %s", e)
+            raise PublishOutcomeUnknown(f"Outstand API unreachable: {str(e)}")
+        except PublishOutcomeUnknown:
+            raise
         except Exception as e:
-            logger.error(f"Outstand API Error: {e}")
+            logger.error("Outstand API Error: %s", e)
             raise ValueError(f"Outstand API Failed: {str(e)}")
 
 class UploadPostAdapter(SocialAdapter):
     """
     Adapter for upload-post.com.
     """
+    uploads_media = True
+
     def __init__(self):
         self.api_url = "https://api.upload-post.com/api/upload_photos"
         self.api_key = os.getenv("UPLOAD_POST_API_KEY")
         self.user_id = os.getenv("UPLOAD_POST_USER_ID", "default_user")
 
-    async def publish(self, image_url: str, caption: str, platform_config: Dict[str, Any], post_type: str = "POST", scheduled_at: Optional[Any] = None, timezone: Optional[str] = None) -> str:
+    async def publish(self, image_url: str, caption: str, platform_config: Dict[str, Any], post_type: str = "POST", scheduled_at: Optional[Any] = None, timezone: Optional[str] = None, idempotency_key: Optional[str] = None, media: Optional[MediaHandle] = None) -> str:
         api_key = platform_config.get("api_key") or self.api_key
         if not api_key:
             raise ValueError("UploadPost API Key not configured. Set UPLOADPOST_API_KEY env var.")
 
-        # Determine if image_url is local or remote
-        public_url = os.getenv("PUBLIC_URL", "http://localhost:8000")
-        
         async with httpx.AsyncClient(timeout=120.0) as client:
-            files = []
-            if image_url.startswith(public_url):
-                # Local file
-                filename = image_url.split("/")[-1]
-                local_path = Path("uploads") / filename
-                if not local_path.exists():
-                    local_path = Path("generated_images") / filename
-                
-                if local_path.exists():
-                    files = [("photos[]", (filename, open(local_path, "rb"), "image/jpeg"))]
-                else:
-                    resp = await client.get(image_url)
-                    resp.raise_for_status()
-                    files = [("photos[]", (filename, resp.content, "image/jpeg"))]
-            elif image_url.startswith("http"):
-                # Remote file
-                resp = await client.get(image_url)
-                resp.raise_for_status()
-                filename = image_url.split("/")[-1] or "image.jpg"
-                files = [("photos[]", (filename, resp.content, "image/jpeg"))]
+            # Local file or download, unless the caller already loaded it (shared across fan-out targets)
+            if media is None:
+                media = await open_media(image_url, self.storage, max_dimension=0, client=client)
+            return await self._submit(client, api_key, media, caption, platform_config, post_type, scheduled_at, timezone, idempotency_key)
+
+    async def schedule_many(self, items: List[ScheduleItem], platform_config: Dict[str, Any], concurrency: int = BULK_SCHEDULE_CONCURRENCY) -> Dict[Any, ScheduleOutcome]:
+        # upload-post.com takes one job per request (several photos in a request make a carousel), so
+        # the calendar is pipelined over one keep-alive connection pool instead of a client per post
+        api_key = platform_config.get("api_key") or self.api_key
+        if not api_key:
+            raise ValueError("UploadPost API Key not configured. Set UPLOADPOST_API_KEY env var.")
+
+        limits = httpx.Limits(max_connections=max(1, concurrency), max_keepalive_connections=max(1, concurrency))
+        async with httpx.AsyncClient(timeout=120.0, limits=limits) as client:
+            async def submit(item: ScheduleItem, media: Optional[MediaHandle]) -> str:
+                return await self._submit(client, api_key, media, item.caption, platform_config, item.post_type,
+                                          item.scheduled_at, None, item.idempotency_key)
+            return await pipeline_schedule(items, concurrency, submit, True, client, self.storage)
+
+    async def _submit(self, client: httpx.AsyncClient, api_key: str, media: MediaHandle, caption: str, platform_config: Dict[str, Any], post_type: str, scheduled_at: Optional[Any], timezone: Optional[str], idempotency_key: Optional[str]) -> str:
+        files = [("photos[]", (media.filename, media.data, media.mime_type))]
+
+        data = {
+            "user": self.user_id,
+            "platform[]": platform_config.get("platform", "instagram"),
+            "title": caption,
+            "type": post_type.lower() # upload-post.com expects 'post', 'reel', 'story'
+        }
+
+        if scheduled_at:
+            # Format to ISO-8601
+            if hasattr(scheduled_at, 'isoformat'):
+                data["scheduled_date"] = scheduled_at.isoformat()
             else:
-                raise ValueError(f"Invalid image URL: {image_url}")
-
-            data = {
-                "user": self.user_id,
-                "platform[]": "instagram",
-                "title": caption,
-                "type": post_type.lower() # upload-post.com expects 'post', 'reel', 'story'
-            }
-
-            if scheduled_at:
-                # Format to ISO-8601
-                if hasattr(scheduled_at, 'isoformat'):
-                    data["scheduled_date"] = scheduled_at.isoformat()
-                else:
-                    data["scheduled_date"] = str(scheduled_at)
-                
-                if timezone:
-                    data["timezone"] = timezone
-                elif os.getenv("DEFAULT_TIMEZONE"):
-                    data["timezone"] = os.getenv("DEFAULT_TIMEZONE")
-
-            headers = {
-                "Authorization": f"Apikey {api_key}"
-            }
+                data["scheduled_date"] = str(scheduled_at)
+            
+            if timezone:
+                data["timezone"] = timezone
+            elif os.getenv("DEFAULT_TIMEZONE"):
+                data["timezone"] = os.getenv("DEFAULT_TIMEZONE")
 
-            try:
-                resp = await client.post(self.api_url, data=data, files=files, headers=headers)
-                # 200: Instant publish, 201: Created, 202: Scheduled
-                if resp.status_code not in [200, 201, 202]:
-                    logger.error(f"UploadPost API Error: {resp.status_code} - {resp.text}")
-                
-                resp.raise_for_status()
-                result = resp.json()
-                
-                if result.get("success"):
-                    # Return job_id for scheduled posts, or request_id for instant ones
-                    return result.get("job_id") or result.get("request_id") or "published-via-uploadpost"
-                else:
-                    error_msg = result.get("message") or result.get("error") or "Unknown error"
-                    raise ValueError(f"UploadPost Error: {error_msg}")
-            finally:
-                # Close file if opened
-                for _, file_info in files:
-                    if isinstance(file_info[1], (BinaryIO, type(open(__file__)))) and hasattr(file_info[1], 'close'):
-                        file_info[1].close()
-
-def get_social_adapter() -> SocialAdapter:
-    adapter_type = os.getenv("SOCIAL_ADAPTER", "upload_post").lower()
+        headers = {
+            "Authorization": f"Apikey {api_key}"
+        }
+        if idempotency_key:
+            headers["Idempotency-Key"] = idempotency_key
+
+        try:
+            resp = await client.post(self.api_url, data=data, files=files, headers=headers)
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            raise PublishOutcomeUnknown(f"UploadPost API unreachable: {str(e)}")
+        # 200: Instant publish, 201: Created, 202: Scheduled
+        if resp.status_code not in [200, 201, 202]:
+            logger.error("UploadPost API Error: %s - %s", resp.status_code, resp.text)
+        if resp.status_code >= 500:
+            raise PublishOutcomeUnknown(f"UploadPost API returned {resp.status_code}")
+        if resp.status_code >= 400:
+            raise ValueError(f"UploadPost Error: HTTP {resp.status_code}")
+        # Past this point the provider has accepted the request: a body we can't read is not a definite
+        # failure (retrying would publish twice), so it is left to the reconciler / status webhook
+        try:
+            result = resp.json()
+            if not isinstance(result, dict):
+                raise ValueError(f"unexpected body type {type(result).__name__}")
+        except Exception as e:
+            logger.error("UploadPost API returned %s with an unreadable body: %s", resp.status_code, e)
+            raise PublishOutcomeUnknown(f"UploadPost API returned {resp.status_code} with an unreadable body: {e}")
+
+        if result.get("success"):
+            # Return job_id for scheduled posts, or request_id for instant ones
+            return result.get("job_id") or result.get("request_id") or "published-via-uploadpost"
+        else:
+            error_msg = result.get("message") or result.get("error") or "Unknown error"
+            raise ValueError(f"UploadPost Error: {error_msg}")
+
+class StubSocialAdapter(SocialAdapter):
+    """
+    Offline adapter for benchmarks and local testing. Sleeps for a configurable latency
+    and fails with a configurable probability instead of calling a real provider.
+    """
+    # Simulated provider-side record of accepted publishes (idempotency key -> external ID), shared by all instances
+    _published: ClassVar[Dict[str, str]] = {}
+    # Pending status callbacks (kept referenced so they aren't garbage collected mid-flight)
+    _callbacks: ClassVar[Set[asyncio.Task]] = set()
+
+    def __init__(self):
+        self.latency_ms = float(os.getenv("STUB_PUBLISH_LATENCY_MS", "300"))
+        self.error_rate = float(os.getenv("STUB_PUBLISH_ERROR_RATE", "0"))
+        # Share of publishes that succeed remotely but time out before we hear back
+        self.unknown_rate = float(os.getenv("STUB_PUBLISH_UNKNOWN_RATE", "0"))
+        # Status callbacks like a real provider's webhook, e.g. STUB_WEBHOOK_URL=http://localhost:8000/webhooks/stub
+        self.webhook_url = os.getenv("STUB_WEBHOOK_URL")
+        self.webhook_delay_ms = float(os.getenv("STUB_WEBHOOK_DELAY_MS", "2000"))
+        self.webhook_failure_rate = float(os.getenv("STUB_WEBHOOK_FAILURE_RATE", "0"))
+        # Share of callbacks delivered twice (providers retry), to exercise receiver idempotency
+        self.webhook_redelivery_rate = float(os.getenv("STUB_WEBHOOK_REDELIVERY_RATE", "0"))
+
+    async def publish(self, image_url: str, caption: str, platform_config: Dict[str, Any], post_type: str = "POST", scheduled_at: Optional[Any] = None, timezone: Optional[str] = None, idempotency_key: Optional[str] = None, media: Optional[MediaHandle] = None) -> str:
+        await asyncio.sleep(random.lognormvariate(0, 0.3) * self.latency_ms / 1000.0)
+        if self.error_rate and random.random() < self.error_rate:
+            raise ValueError("Stub publish failure")
+        # Like a real provider honouring Idempotency-Key: a replay returns the original post
+        external_id = self._published.get(idempotency_key) if idempotency_key else None
+        if external_id is None:
+            external_id = f"stub-{uuid.uuid4()}"
+            if idempotency_key:
+                self._published[idempotency_key] = external_id
+            if self.webhook_url:
+                task = asyncio.get_running_loop().create_task(self._fire_callback(external_id, scheduled_at))
+                self._callbacks.add(task)
+                task.add_done_callback(self._callbacks.discard)
+        if self.unknown_rate and random.random() < self.unknown_rate:
+            raise PublishOutcomeUnknown("Stub publish timed out after the provider accepted it")
+        return external_id
+
+    async def _fire_callback(self, external_id: str, scheduled_at: Optional[Any]):
+        """Reports the job's final status to STUB_WEBHOOK_URL, signed like a real provider would."""
+        await asyncio.sleep(self.webhook_delay_ms / 1000.0)
+        failed = self.webhook_failure_rate and random.random() < self.webhook_failure_rate
+        body = json.dumps({
+            "event_id": str(uuid.uuid4()),
+            "job_id": external_id,
+            "status": "failed" if failed else "published",
+            "error": "Stub provider rejected the post" if failed else None,
+            "scheduled_date": scheduled_at.isoformat() if hasattr(scheduled_at, "isoformat") else scheduled_at,
+        }).encode()
+        secret = webhook_secret("stub")
+        deliveries = 2 if self.webhook_redelivery_rate and random.random() < self.webhook_redelivery_rate else 1
+        try:
+            async with httpx.AsyncClient(timeout=10.0) as client:
+                for _ in range(deliveries):
+                    headers = {"Content-Type": "application/json"}
+                    if secret:
+                        headers[SIGNATURE_HEADER] = sign_payload(secret, body)
+                    resp = await client.post(self.webhook_url, content=body, headers=headers)
+                    if resp.status_code >= 400:
+                        logger.warning("Stub webhook for %s rejected: %s", external_id, resp.status_code)
+        except Exception as e:
+            logger.warning("Stub webhook for %s failed: %s", external_id, e)
+
+    async def get_publish_status(self, idempotency_key: str, external_id: Optional[str] = None, platform_config: Optional[Dict[str, Any]] = None) -> Optional[PublishStatus]:
+        await asyncio.sleep(self.latency_ms / 4000.0)
+        found = self._published.get(idempotency_key)
+        return PublishStatus("published", found) if found else PublishStatus("not_found")
+
+def get_social_adapter(platform: Optional[str] = None, storage: Optional[Any] = None) -> SocialAdapter:
+    """
+    Adapter for a platform: SOCIAL_ADAPTER_<PLATFORM> (e.g. SOCIAL_ADAPTER_LINKEDIN=outstand), else SOCIAL_ADAPTER.
+    `storage` lets adapters that upload bytes read our own images without an HTTP round trip.
+    """
+    adapter_type = (platform and os.getenv(f"SOCIAL_ADAPTER_{platform.upper()}")) or os.getenv("SOCIAL_ADAPTER", "upload_post")
+    adapter_type = adapter_type.lower()
     if adapter_type == "outstand":
-        return OutstandAdapter()
-    return UploadPostAdapter()
+        adapter = OutstandAdapter()
+    elif adapter_type == "stub":
+        adapter = StubSocialAdapter()
+    else:
+        adapter = UploadPostAdapter()
+    adapter.storage = storage
+    return adapter
@@ -0,0 +1,142 @@
+import os
+import re
+import hashlib
+import logging
+import mimetypes
+from dataclasses import dataclass, field
+from email.utils import formatdate
+from typing import Dict, Optional
+from urllib.parse import quote
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles
+
+logger = logging.getLogger(__name__)
+
+# Generated images and uploads get random (uuid) names and are never rewritten in place
+MEDIA_CACHE_CONTROL = os.getenv("MEDIA_CACHE_CONTROL", "public, max-age=31536000, immutable")
+# Hand the file transfer to a reverse proxy instead of streaming it from Python:
+#   nginx  -> X-Accel-Redirect: {STATIC_ACCEL_PREFIX}/<mount>/<path> (map it with an `internal` location)
+#   sendfile -> X-Sendfile: <absolute path> (Apache mod_xsendfile, lighttpd)
+STATIC_OFFLOAD = os.getenv("STATIC_OFFLOAD", "").lower()
+STATIC_ACCEL_PREFIX = os.getenv("STATIC_ACCEL_PREFIX", "/_protected").rstrip("/")
+
+# Vite emits content-hashed names such as assets/index-B3x9_kQz.js
+_HASHED_NAME = re.compile(r"[-.][A-Za-z0-9_-]{8,}\.[A-Za-z0-9]+$")
+# Precompressed siblings, in server preference order
+_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def _offload_response(accel_path: str, file_path: str, headers: Dict[str, str]) -> Optional[Response]:
+    if STATIC_OFFLOAD == "nginx":
+        return Response(headers={**headers, "X-Accel-Redirect": quote(accel_path)})
+    if STATIC_OFFLOAD == "sendfile":
+        return Response(headers={**headers, "X-Sendfile": os.path.abspath(file_path)})
+    return None
+
+
+def _accepted_encodings(request: Request) -> set:
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        token, _, params = part.strip().partition(";")
+        if token and params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(token.lower())
+    return accepted
+
+
+class MediaFiles(StaticFiles):
+    """
+    StaticFiles for /images and /uploads: adds long-lived immutable caching on top of
+    Starlette's ETag/Last-Modified/Range handling, and optionally offloads the transfer
+    to the reverse proxy.
+    """
+    def __init__(self, *, directory: str, mount: str, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.mount = mount.strip("/")
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        response.headers["Cache-Control"] = MEDIA_CACHE_CONTROL
+        if isinstance(response, FileResponse) and STATIC_OFFLOAD:
+            rel_path = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+            headers = {k: v for k, v in response.headers.items() if k.lower() != "content-length"}
+            offloaded = _offload_response(f"{STATIC_ACCEL_PREFIX}/{self.mount}/{rel_path}", full_path, headers)
+            if offloaded is not None:
+                return offloaded
+        return response
+
+
+@dataclass
+class StaticAsset:
+    path: str
+    media_type: str
+    etag: str
+    last_modified: str
+    cache_control: str
+    # Content-Encoding -> path of the precompressed sibling
+    variants: Dict[str, str] = field(default_factory=dict)
+
+
+class FrontendIndex:
+    """
+    In-memory index of the dashboard build (apps/dashboard/dist), built once at startup so
+    the catch-all route never touches the filesystem to decide what to serve. ETags are
+    content hashes; precompressed .br/.gz siblings (see scripts/precompress_dist.py) are
+    served when the client accepts them. Rebuild the index (restart) after a new build.
+    """
+    def __init__(self, root: str):
+        self.root = root
+        self.assets: Dict[str, StaticAsset] = {}
+
+    def build(self):
+        assets = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            names = set(filenames)
+            for name in filenames:
+                if any(name.endswith(suffix) and name[:-len(suffix)] in names for _, suffix in _ENCODINGS):
+                    continue
+                path = os.path.join(dirpath, name)
+                rel_path = os.path.relpath(path, self.root).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    digest = hashlib.sha256(f.read()).hexdigest()[:32]
+                immutable = rel_path.startswith("assets/") and _HASHED_NAME.search(name) is not None
+                assets[rel_path] = StaticAsset(
+                    path=path,
+                    media_type=mimetypes.guess_type(name)[0] or "application/octet-stream",
+                    etag=digest,
+                    last_modified=formatdate(os.stat(path).st_mtime, usegmt=True),
+                    cache_control="public, max-age=31536000, immutable" if immutable else "no-cache",
+                    variants={enc: path + suffix for enc, suffix in _ENCODINGS if name + suffix in names},
+                )
+        self.assets = assets
+        logger.info("Indexed %s frontend files from %s", len(assets), self.root)
+
+    def get(self, rel_path: str) -> Optional[StaticAsset]:
+        return self.assets.get(rel_path)
+
+    def response(self, request: Request, asset: StaticAsset) -> Response:
+        encoding = None
+        accepted = _accepted_encodings(request)
+        for enc, _ in _ENCODINGS:
+            if enc in asset.variants and enc in accepted:
+                encoding = enc
+                break
+
+        etag = f'"{asset.etag}-{encoding}"' if encoding else f'"{asset.etag}"'
+        headers = {"ETag": etag, "Last-Modified": asset.last_modified, "Cache-Control": asset.cache_control}
+        if asset.variants:
+            headers["Vary"] = "Accept-Encoding"
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+            return Response(status_code=304, headers=headers)
+
+        path = asset.variants[encoding] if encoding else asset.path
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        rel_path = os.path.relpath(path, self.root).replace(os.sep, "/")
+        offloaded = _offload_response(f"{STATIC_ACCEL_PREFIX}/dist/{rel_path}", path, {**headers, "Content-Type": asset.media_type})
+        if offloaded is not None:
+            return offloaded
+        # FileResponse handles Range requests; our ETag/Last-Modified take precedence over its defaults
+        return FileResponse(path, media_type=asset.media_type, headers=headers)
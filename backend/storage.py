@@ -1,27 +1,73 @@
+import io
 import os
 import uuid
 import shutil
+import urllib.parse
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Union, BinaryIO
+from typing import Any, Union, BinaryIO, Dict, Iterator, List, Optional
 import logging
 
 logger = logging.getLogger(__name__)
 
+@dataclass
+class StoredObject:
+    key: str
+    modified_at: Optional[datetime]
+
 class StorageProvider(ABC):
     @abstractmethod
     def upload(self, file_data: Union[bytes, BinaryIO], filename: str, content_type: str) -> str:
         """Uploads file and returns public URL"""
         pass
 
+    @abstractmethod
+    def object_key(self, url: str) -> Optional[str]:
+        """Maps a public URL back to this provider's object key, or None if the URL isn't ours"""
+        pass
+
+    def might_own(self, url: str) -> bool:
+        """True if the URL has the shape of one of ours, even when object_key can't map it"""
+        return self.object_key(url) is not None
+
+    @abstractmethod
+    def delete_many(self, keys: List[str]) -> int:
+        """Deletes objects by key in one bulk call and returns how many were removed"""
+        pass
+
+    @abstractmethod
+    def list_objects(self, page_size: int = 1000) -> Iterator[List[StoredObject]]:
+        """Streams the provider's objects one page at a time"""
+        pass
+
+    @abstractmethod
+    def read(self, key: str) -> bytes:
+        """Returns an object's content"""
+        pass
+
+    def copy(self, source_key: str, dest_key: str, content_type: str) -> str:
+        """Copies an object within the provider and returns the new public URL"""
+        return self.upload(self.read(source_key), dest_key, content_type)
+
+    def presigned_upload(self, filename: str, content_type: str) -> Optional[Dict[str, Any]]:
+        """Returns a URL the client can PUT the file to directly, or None if uploads must go through the API"""
+        return None
+
 class LocalStorageProvider(StorageProvider):
-    def __init__(self, base_url: str = None):
+    def __init__(self, base_url: str = None, upload_dir: Optional[Path] = None, url_prefix: str = "uploads"):
         self.base_url = base_url or os.getenv("PUBLIC_URL", "http://localhost:8000")
-        self.upload_dir = Path(os.getenv("LOCAL_UPLOADS_DIR", "uploads"))
+        self.upload_dir = Path(upload_dir or os.getenv("LOCAL_UPLOADS_DIR", "uploads"))
         self.upload_dir.mkdir(parents=True, exist_ok=True)
-        # Also ensure generated_images exists as we might map it differently or treat all as uploads
-        self.gen_dir = Path(os.getenv("LOCAL_STORAGE_DIR", "generated_images"))
-        self.gen_dir.mkdir(parents=True, exist_ok=True)
+        self.url_prefix = url_prefix
+        # URL prefix -> directory, as mounted in backend/main.py
+        self.dirs: Dict[str, Path] = {url_prefix: self.upload_dir}
+        if url_prefix == "uploads":
+            # Also ensure generated_images exists as we might map it differently or treat all as uploads
+            self.gen_dir = Path(os.getenv("LOCAL_STORAGE_DIR", "generated_images"))
+            self.gen_dir.mkdir(parents=True, exist_ok=True)
+            self.dirs["images"] = self.gen_dir
 
     def upload(self, file_data: Union[bytes, BinaryIO], filename: str, content_type: str) -> str:
         # Determine target directory based on context or just put everything in uploads?
@@ -46,13 +92,72 @@ class LocalStorageProvider(StorageProvider):
             with open(file_path, "wb") as buffer:
                 shutil.copyfileobj(file_data, buffer)
                 
-        return f"{self.base_url}/uploads/{filename}"
+        return f"{self.base_url}/{self.url_prefix}/{filename}"
+
+    def _path(self, key: str) -> Optional[Path]:
+        # Keys mirror the URL path: '<prefix>/<file>', e.g. 'uploads/x.png' or 'images/x.png' (legacy generations)
+        prefix, _, name = key.rpartition("/")
+        directory = self.dirs.get(prefix)
+        if directory is None or not name or Path(name).name != name:
+            return None
+        return directory / name
+
+    def _url_path(self, url: str) -> str:
+        path = urllib.parse.urlsplit(url).path
+        base_path = urllib.parse.urlsplit(self.base_url).path.rstrip("/")
+        if base_path and path.startswith(f"{base_path}/"):
+            path = path[len(base_path):]
+        return path.lstrip("/")
+
+    def object_key(self, url: str) -> Optional[str]:
+        # Matched by path whatever the host: files stored before a PUBLIC_URL change (domain, port) are still ours
+        key = self._url_path(url)
+        return key if self._path(key) is not None else None
+
+    def might_own(self, url: str) -> bool:
+        top = self._url_path(url).split("/", 1)[0]
+        return any(prefix.split("/", 1)[0] == top for prefix in self.dirs)
+
+    def delete_many(self, keys: List[str]) -> int:
+        removed = 0
+        for key in keys:
+            path = self._path(key)
+            if path is None:
+                continue
+            try:
+                path.unlink()
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def list_objects(self, page_size: int = 1000) -> Iterator[List[StoredObject]]:
+        page = []
+        for prefix, directory in self.dirs.items():
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    # Sub-directories (e.g. the cold tier under uploads/) belong to other providers
+                    if not entry.is_file():
+                        continue
+                    page.append(StoredObject(f"{prefix}/{entry.name}", datetime.fromtimestamp(entry.stat().st_mtime, tz=timezone.utc)))
+                    if len(page) >= page_size:
+                        yield page
+                        page = []
+        if page:
+            yield page
+
+    def read(self, key: str) -> bytes:
+        path = self._path(key)
+        if path is None:
+            raise ValueError(f"Invalid storage key: {key}")
+        return path.read_bytes()
 
 class SupabaseStorageProvider(StorageProvider):
     def __init__(self, url: str, key: str, bucket: str = "content-assets"):
         from supabase import create_client, Client
         self.supabase: Client = create_client(url, key)
         self.bucket = bucket
+        self.public_prefix = f"{url.rstrip('/')}/storage/v1/object/public/{bucket}/"
 
     def upload(self, file_data: Union[bytes, BinaryIO], filename: str, content_type: str) -> str:
         try:
@@ -78,11 +183,158 @@ class SupabaseStorageProvider(StorageProvider):
             return public_url_response
             
         except Exception as e:
-            logger.error(f"Supabase Upload Failed: {e}")
+            logger.error("Supabase Upload Failed: %s", e)
             raise e
 
+    def object_key(self, url: str) -> Optional[str]:
+        if url.startswith(self.public_prefix):
+            return url[len(self.public_prefix):].split("?", 1)[0] or None
+        return None
+
+    def delete_many(self, keys: List[str]) -> int:
+        if not keys:
+            return 0
+        removed = self.supabase.storage.from_(self.bucket).remove(keys)
+        return len(removed) if isinstance(removed, list) else len(keys)
+
+    def list_objects(self, page_size: int = 1000) -> Iterator[List[StoredObject]]:
+        # Objects are stored flat at the bucket root; folders come back with id=None and are skipped
+        offset = 0
+        while True:
+            items = self.supabase.storage.from_(self.bucket).list("", {
+                "limit": page_size,
+                "offset": offset,
+                "sortBy": {"column": "name", "order": "asc"},
+            })
+            if not items:
+                return
+            page = []
+            for item in items:
+                if not item.get("id"):
+                    continue
+                stamp = item.get("updated_at") or item.get("created_at")
+                modified_at = datetime.fromisoformat(stamp.replace("Z", "+00:00")) if stamp else None
+                page.append(StoredObject(item["name"], modified_at))
+            yield page
+            if len(items) < page_size:
+                return
+            offset += page_size
+
+    def read(self, key: str) -> bytes:
+        return self.supabase.storage.from_(self.bucket).download(key)
+
+class S3StorageProvider(StorageProvider):
+    """
+    AWS S3 or any S3-compatible store (MinIO, R2, ...). Large uploads are split into
+    multipart parts by boto3's transfer manager, copies happen server-side, and clients
+    can upload straight to the bucket with a presigned PUT.
+    """
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None, region: Optional[str] = None, public_url: Optional[str] = None):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config
+
+        self.bucket = bucket
+        # Path-style addressing works for MinIO and custom domains; credentials come from the standard AWS_* env vars
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            config=Config(signature_version="s3v4", s3={"addressing_style": "path"}),
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=int(os.getenv("S3_MULTIPART_THRESHOLD", str(8 * 1024 * 1024))),
+            multipart_chunksize=int(os.getenv("S3_MULTIPART_CHUNKSIZE", str(8 * 1024 * 1024))),
+            max_concurrency=int(os.getenv("S3_MAX_CONCURRENCY", "4")),
+        )
+        self.presign_expires = int(os.getenv("S3_PRESIGN_EXPIRES", "900"))
+        if public_url:
+            base = public_url.rstrip("/")
+        elif endpoint_url:
+            base = f"{endpoint_url.rstrip('/')}/{bucket}"
+        else:
+            base = f"https://{bucket}.s3.{region or 'us-east-1'}.amazonaws.com"
+        self.public_prefix = f"{base}/"
+
+    def upload(self, file_data: Union[bytes, BinaryIO], filename: str, content_type: str) -> str:
+        fileobj = io.BytesIO(file_data) if isinstance(file_data, bytes) else file_data
+        try:
+            # Streams from the file object; anything above the threshold goes up as parallel multipart parts
+            self.client.upload_fileobj(
+                fileobj, self.bucket, filename,
+                ExtraArgs={"ContentType": content_type},
+                Config=self.transfer_config,
+            )
+        except Exception as e:
+            logger.error("S3 Upload Failed: %s", e)
+            raise e
+        return f"{self.public_prefix}{filename}"
+
+    def object_key(self, url: str) -> Optional[str]:
+        if url.startswith(self.public_prefix):
+            return url[len(self.public_prefix):].split("?", 1)[0] or None
+        return None
+
+    def delete_many(self, keys: List[str]) -> int:
+        removed = 0
+        # DeleteObjects accepts at most 1000 keys per request
+        for i in range(0, len(keys), 1000):
+            response = self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": key} for key in keys[i:i + 1000]], "Quiet": False},
+            )
+            removed += len(response.get("Deleted", []))
+            for error in response.get("Errors", []):
+                logger.warning("S3 delete failed for %s: %s", error.get("Key"), error.get("Message"))
+        return removed
+
+    def list_objects(self, page_size: int = 1000) -> Iterator[List[StoredObject]]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for response in paginator.paginate(Bucket=self.bucket, PaginationConfig={"PageSize": page_size}):
+            contents = response.get("Contents", [])
+            if contents:
+                yield [StoredObject(obj["Key"], obj["LastModified"]) for obj in contents]
+
+    def read(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+
+    def copy(self, source_key: str, dest_key: str, content_type: str) -> str:
+        # Server-side: bytes never leave the bucket (multipart UploadPartCopy for large objects)
+        self.client.copy(
+            {"Bucket": self.bucket, "Key": source_key}, self.bucket, dest_key,
+            ExtraArgs={"ContentType": content_type, "MetadataDirective": "REPLACE"},
+            Config=self.transfer_config,
+        )
+        return f"{self.public_prefix}{dest_key}"
+
+    def presigned_upload(self, filename: str, content_type: str) -> Optional[Dict[str, Any]]:
+        upload_url = self.client.generate_presigned_url(
+            "put_object",
+            Params={"Bucket": self.bucket, "Key": filename, "ContentType": content_type},
+            ExpiresIn=self.presign_expires,
+        )
+        # Content-Type is part of the signature, so the client must send exactly this header
+        return {
+            "upload_url": upload_url,
+            "url": f"{self.public_prefix}{filename}",
+            "headers": {"Content-Type": content_type},
+            "expires_in": self.presign_expires,
+        }
+
 def get_storage_provider() -> StorageProvider:
     provider_type = os.getenv("STORAGE_PROVIDER", "local").lower()
+
+    if provider_type == "s3":
+        bucket = os.getenv("S3_BUCKET")
+        if not bucket:
+            logger.warning("S3_BUCKET missing! Falling back to Local Storage.")
+            return LocalStorageProvider()
+        return S3StorageProvider(
+            bucket,
+            endpoint_url=os.getenv("S3_ENDPOINT_URL"),
+            region=os.getenv("S3_REGION"),
+            public_url=os.getenv("S3_PUBLIC_URL"),
+        )
     
     if provider_type == "supabase":
         url = os.getenv("SUPABASE_URL")
@@ -96,3 +348,39 @@ def get_storage_provider() -> StorageProvider:
         return SupabaseStorageProvider(url, key, bucket)
     
     return LocalStorageProvider()
+
+def get_cold_storage_provider() -> Optional[StorageProvider]:
+    """
+    Optional cheaper tier for images of old published posts (COLD_STORAGE_PROVIDER).
+    Local: files move to uploads/cold/ (mount or symlink it to cheap disk); still served under /uploads.
+    Supabase: a separate bucket (SUPABASE_COLD_BUCKET).
+    S3: a separate bucket (S3_COLD_BUCKET), e.g. with a lifecycle rule to an infrequent-access class.
+    """
+    provider_type = os.getenv("COLD_STORAGE_PROVIDER", "").lower()
+
+    if provider_type == "supabase":
+        url = os.getenv("SUPABASE_URL")
+        key = os.getenv("SUPABASE_KEY")
+        bucket = os.getenv("SUPABASE_COLD_BUCKET")
+        if not url or not key or not bucket:
+            logger.warning("Cold tier needs SUPABASE_URL, SUPABASE_KEY and SUPABASE_COLD_BUCKET; tiering disabled.")
+            return None
+        return SupabaseStorageProvider(url, key, bucket)
+
+    if provider_type == "s3":
+        bucket = os.getenv("S3_COLD_BUCKET")
+        if not bucket:
+            logger.warning("Cold tier needs S3_COLD_BUCKET; tiering disabled.")
+            return None
+        return S3StorageProvider(
+            bucket,
+            endpoint_url=os.getenv("S3_ENDPOINT_URL"),
+            region=os.getenv("S3_REGION"),
+            public_url=os.getenv("S3_COLD_PUBLIC_URL"),
+        )
+
+    if provider_type == "local":
+        upload_dir = Path(os.getenv("LOCAL_UPLOADS_DIR", "uploads")) / "cold"
+        return LocalStorageProvider(upload_dir=upload_dir, url_prefix="uploads/cold")
+
+    return None
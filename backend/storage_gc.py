@@ -0,0 +1,315 @@
+import os
+import json
+import asyncio
+import logging
+import mimetypes
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional, Set
+from backend.metrics import STORAGE_GC_DELETED_TOTAL
+
+logger = logging.getLogger(__name__)
+
+STORAGE_GC_ENABLED = os.getenv("STORAGE_GC_ENABLED", "true").lower() == "true"
+STORAGE_GC_INTERVAL = float(os.getenv("STORAGE_GC_INTERVAL", "300"))
+STORAGE_GC_BATCH_SIZE = int(os.getenv("STORAGE_GC_BATCH_SIZE", "500"))
+# Objects per bulk delete call (Supabase remove() / local unlink loop)
+STORAGE_GC_DELETE_CHUNK = int(os.getenv("STORAGE_GC_DELETE_CHUNK", "100"))
+# Claimed queue rows that were never acknowledged (crash, failed delete) are retried after this many seconds
+STORAGE_GC_CLAIM_LEASE = int(os.getenv("STORAGE_GC_CLAIM_LEASE", "600"))
+# Full listing-vs-references sweep (catches orphans the queue never saw); 0 disables the periodic run
+STORAGE_SWEEP_INTERVAL = float(os.getenv("STORAGE_SWEEP_INTERVAL", "86400"))
+STORAGE_SWEEP_PAGE_SIZE = int(os.getenv("STORAGE_SWEEP_PAGE_SIZE", "1000"))
+# Objects younger than this are never swept: they may belong to a generation that hasn't saved its post yet
+STORAGE_GC_GRACE_HOURS = float(os.getenv("STORAGE_GC_GRACE_HOURS", "24"))
+# Move images of posts published more than N days ago to the cold tier (needs COLD_STORAGE_PROVIDER); 0 disables
+STORAGE_COLD_TIER_DAYS = int(os.getenv("STORAGE_COLD_TIER_DAYS", "0"))
+
+# Every URL the database still points at
+REFERENCED_URLS_QUERY = """
+    SELECT jsonb_array_elements_text(image_urls) AS url FROM posts WHERE jsonb_typeof(image_urls) = 'array'
+    UNION ALL
+    SELECT input_image_url FROM posts WHERE input_image_url IS NOT NULL
+    UNION ALL
+    SELECT logo_url FROM brands WHERE logo_url IS NOT NULL
+"""
+
+
+class UnmappedReferences(Exception):
+    def __init__(self, urls: List[str]):
+        super().__init__(f"{len(urls)} referenced URLs can't be mapped to a storage key")
+        self.urls = urls
+
+
+def _parse_urls(image_urls) -> List[str]:
+    if isinstance(image_urls, str):
+        image_urls = json.loads(image_urls)
+    return image_urls or []
+
+
+def asset_urls(rows: Iterable) -> List[str]:
+    """Collects the storage URLs referenced by post rows (image_urls + input_image_url), de-duplicated."""
+    urls = []
+    for row in rows:
+        urls.extend(_parse_urls(row['image_urls']))
+        if row['input_image_url']:
+            urls.append(row['input_image_url'])
+    return list(dict.fromkeys(u for u in urls if u))
+
+
+async def enqueue_assets(connection, urls: List[str]):
+    """Queues possibly-orphaned objects for collection. Call inside the transaction that drops the references."""
+    if urls:
+        await connection.execute("""
+            INSERT INTO storage_gc_queue (url) SELECT unnest($1::text[])
+        """, urls)
+
+
+async def filter_unreferenced(connection, urls: List[str]) -> List[str]:
+    """Returns the subset of urls no longer referenced by any post or brand."""
+    if not urls:
+        return []
+    rows = await connection.fetch("""
+        SELECT u.url FROM unnest($1::text[]) AS u(url)
+        WHERE NOT EXISTS (SELECT 1 FROM posts p WHERE p.input_image_url = u.url OR p.image_urls ? u.url)
+          AND NOT EXISTS (SELECT 1 FROM brands b WHERE b.logo_url = u.url)
+    """, urls)
+    return [row['url'] for row in rows]
+
+
+def chunked(items: List, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class StorageGarbageCollector:
+    """
+    Background task draining storage_gc_queue: claims a batch, drops URLs that are still
+    referenced or not owned by the storage provider, and bulk-deletes the rest in chunks.
+    The DB connection is released while storage calls run.
+
+    Every `sweep_interval` it also runs a full sweep: storage listings are diffed against
+    the URLs referenced in the database to remove orphans the queue missed, and images of
+    old published posts are moved to the cold tier when one is configured.
+    """
+    def __init__(self, pool, storage, cold_storage=None, interval: float = STORAGE_GC_INTERVAL, batch_size: int = STORAGE_GC_BATCH_SIZE, chunk_size: int = STORAGE_GC_DELETE_CHUNK, sweep_interval: float = STORAGE_SWEEP_INTERVAL):
+        self.pool = pool
+        self.storage = storage
+        self.cold_storage = cold_storage
+        self.interval = interval
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.sweep_interval = sweep_interval
+        self._task: Optional[asyncio.Task] = None
+        self._sweep_lock = asyncio.Lock()
+
+    def _providers(self):
+        return [p for p in (self.storage, self.cold_storage) if p is not None]
+
+    async def _delete_keys(self, storage, keys: List[str], reason: str) -> int:
+        deleted = 0
+        for chunk in chunked(keys, self.chunk_size):
+            try:
+                deleted += await asyncio.to_thread(storage.delete_many, chunk)
+            except Exception as e:
+                logger.warning("Storage GC delete failed for %s objects: %s", len(chunk), e)
+        STORAGE_GC_DELETED_TOTAL.labels(reason=reason).inc(deleted)
+        return deleted
+
+    async def collect_once(self) -> int:
+        """Processes one batch of the queue and returns the number of queue entries claimed."""
+        async with self.pool.acquire() as conn:
+            claimed = await conn.fetch("""
+                UPDATE storage_gc_queue SET claimed_at = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT id FROM storage_gc_queue
+                    WHERE claimed_at IS NULL OR claimed_at < CURRENT_TIMESTAMP - make_interval(secs => $2)
+                    ORDER BY id
+                    LIMIT $1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, url
+            """, self.batch_size, STORAGE_GC_CLAIM_LEASE)
+            if not claimed:
+                return 0
+            orphaned = set(await filter_unreferenced(conn, list({row['url'] for row in claimed})))
+
+        keys = {}
+        for url in orphaned:
+            key = self.storage.object_key(url)
+            if key:
+                keys[key] = url
+
+        deleted = 0
+        failed_urls = set()
+        for chunk in chunked(list(keys.keys()), self.chunk_size):
+            try:
+                deleted += await asyncio.to_thread(self.storage.delete_many, chunk)
+            except Exception as e:
+                logger.warning("Storage GC delete failed for %s objects: %s", len(chunk), e)
+                failed_urls.update(keys[key] for key in chunk)
+
+        # Acknowledge everything except failed deletes, which are retried once their lease expires
+        done_ids = [row['id'] for row in claimed if row['url'] not in failed_urls]
+        async with self.pool.acquire() as conn:
+            await conn.execute("DELETE FROM storage_gc_queue WHERE id = ANY($1::bigint[])", done_ids)
+
+        STORAGE_GC_DELETED_TOTAL.labels(reason="unreferenced").inc(deleted)
+        if deleted:
+            logger.info("Storage GC removed %s objects", deleted)
+        return len(claimed)
+
+    async def _referenced_keys(self) -> List[Set[str]]:
+        """
+        Mark phase: streams every referenced URL and maps it to a key per provider.
+        Raises UnmappedReferences if a URL looks like ours but no provider can map it: its object
+        would be missed by the mark and deleted as garbage.
+        """
+        providers = self._providers()
+        referenced: List[Set[str]] = [set() for _ in providers]
+        unmapped: List[str] = []
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                async for row in conn.cursor(REFERENCED_URLS_QUERY, prefetch=STORAGE_SWEEP_PAGE_SIZE):
+                    mapped = False
+                    for keys, provider in zip(referenced, providers):
+                        key = provider.object_key(row['url'])
+                        if key:
+                            keys.add(key)
+                            mapped = True
+                    if not mapped and any(provider.might_own(row['url']) for provider in providers):
+                        unmapped.append(row['url'])
+        if unmapped:
+            raise UnmappedReferences(unmapped)
+        return referenced
+
+    async def _unreferenced_objects(self, storage, referenced: Set[str], cutoff: datetime) -> List[str]:
+        """Streams the provider's listing page by page and returns keys past the grace period with no reference."""
+        pages = storage.list_objects(STORAGE_SWEEP_PAGE_SIZE)
+        candidates = []
+        while True:
+            page = await asyncio.to_thread(next, pages, None)
+            if page is None:
+                break
+            candidates.extend(
+                obj.key for obj in page
+                if obj.key not in referenced and obj.modified_at is not None and obj.modified_at < cutoff
+            )
+        return candidates
+
+    async def sweep_orphans(self) -> int:
+        """Deletes objects that no post or brand references. Returns the number removed."""
+        try:
+            referenced = await self._referenced_keys()
+        except UnmappedReferences as e:
+            logger.error("Storage sweep aborted: %s referenced URLs look like stored objects but can't be mapped to a key (e.g. %s)",
+                         len(e.urls), ", ".join(e.urls[:5]))
+            return 0
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=STORAGE_GC_GRACE_HOURS)
+        deleted = 0
+        for storage, keys in zip(self._providers(), referenced):
+            # Collect the whole diff before deleting so paginated listings don't shift under us
+            orphans = await self._unreferenced_objects(storage, keys, cutoff)
+            deleted += await self._delete_keys(storage, orphans, "orphaned")
+        if deleted:
+            logger.info("Storage sweep removed %s orphaned objects", deleted)
+        return deleted
+
+    async def _tier_post(self, post_id: int, raw_image_urls) -> int:
+        image_urls = _parse_urls(raw_image_urls)
+        moved = {}
+        for url in image_urls:
+            key = self.storage.object_key(url)
+            if not key:
+                continue
+            try:
+                data = await asyncio.to_thread(self.storage.read, key)
+                filename = key.rsplit("/", 1)[-1]
+                content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+                moved[url] = await asyncio.to_thread(self.cold_storage.upload, data, filename, content_type)
+            except Exception as e:
+                logger.warning("Cold tiering failed for post %s (%s): %s", post_id, url, e)
+        if not moved:
+            return 0
+
+        new_urls = [moved.get(url, url) for url in image_urls]
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                # Only swap if nobody rewrote the post meanwhile (regeneration, edits)
+                result = await conn.execute("""
+                    UPDATE posts SET image_urls = $1::jsonb
+                    WHERE id = $2 AND image_urls = $3::jsonb
+                """, json.dumps(new_urls), post_id, json.dumps(image_urls))
+                swapped = result.endswith(" 1")
+                # A hot copy may still be shared, e.g. an upload used as input_image_url
+                hot_orphans = await filter_unreferenced(conn, list(moved.keys())) if swapped else []
+
+        if swapped:
+            await self._delete_keys(self.storage, [self.storage.object_key(u) for u in hot_orphans], "tiered")
+            return len(moved)
+        await self._delete_keys(self.cold_storage, [self.cold_storage.object_key(u) for u in moved.values()], "tiered")
+        return 0
+
+    async def tier_cold(self) -> int:
+        """Moves images of posts published more than STORAGE_COLD_TIER_DAYS ago to the cold tier."""
+        if self.cold_storage is None or STORAGE_COLD_TIER_DAYS <= 0:
+            return 0
+        moved = 0
+        last_id = 0
+        while True:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch("""
+                    SELECT id, image_urls FROM posts
+                    WHERE status = 'PUBLISHED'
+                      AND updated_at < CURRENT_TIMESTAMP - make_interval(days => $1)
+                      AND id > $2
+                    ORDER BY id
+                    LIMIT $3
+                """, STORAGE_COLD_TIER_DAYS, last_id, self.batch_size)
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+            for row in rows:
+                moved += await self._tier_post(row['id'], row['image_urls'])
+        if moved:
+            logger.info("Moved %s images to cold storage", moved)
+        return moved
+
+    async def sweep(self):
+        """Full sweep (orphans + cold tiering). Concurrent calls in the same process are skipped."""
+        if self._sweep_lock.locked():
+            logger.info("Storage sweep already running")
+            return
+        async with self._sweep_lock:
+            await self.sweep_orphans()
+            await self.tier_cold()
+
+    async def run_forever(self):
+        loop = asyncio.get_running_loop()
+        # First full sweep one interval after startup, not on every deploy
+        next_sweep = loop.time() + self.sweep_interval
+        while True:
+            try:
+                # Drain full batches back to back, then sleep
+                while await self.collect_once() >= self.batch_size:
+                    pass
+                if self.sweep_interval > 0 and loop.time() >= next_sweep:
+                    next_sweep = loop.time() + self.sweep_interval
+                    await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Storage GC run failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if STORAGE_GC_ENABLED and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
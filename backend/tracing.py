@@ -0,0 +1,77 @@
+import os
+import logging
+from contextlib import nullcontext
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Tracing is opt-in: set OTEL_EXPORTER_OTLP_ENDPOINT (e.g. http://localhost:4318) or TRACING_ENABLED=true
+TRACING_ENABLED = bool(os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")) or os.getenv("TRACING_ENABLED", "false").lower() == "true"
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "content-automation-engine")
+
+_tracer = None
+
+
+def setup_tracing(app) -> bool:
+    """
+    Configures OTLP export and auto-instruments FastAPI, asyncpg and httpx (which also covers
+    the Gemini SDK and Supabase client). Returns False if tracing is disabled or the
+    OpenTelemetry packages are not installed.
+    """
+    global _tracer
+    if not TRACING_ENABLED:
+        return False
+
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+        from opentelemetry.instrumentation.asyncpg import AsyncPGInstrumentor
+        from opentelemetry.instrumentation.httpx import HTTPXClientInstrumentor
+    except ImportError as e:
+        logger.warning("Tracing requested but OpenTelemetry is not installed: %s", e)
+        return False
+
+    provider = TracerProvider(resource=Resource.create({"service.name": SERVICE_NAME}))
+    # Endpoint and headers come from the standard OTEL_EXPORTER_OTLP_* environment variables
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+
+    # Event streams are long-lived (useless as spans) and carry an auth token in the query string
+    FastAPIInstrumentor.instrument_app(app, excluded_urls="metrics,health/.*,events/.*")
+    AsyncPGInstrumentor().instrument()
+    HTTPXClientInstrumentor().instrument()
+
+    _tracer = trace.get_tracer(__name__)
+    logger.info("Tracing enabled, exporting spans as '%s'", SERVICE_NAME)
+    return True
+
+
+def current_context() -> Optional[Any]:
+    """Captures the active trace context so a background job can continue the request's trace."""
+    if _tracer is None:
+        return None
+    from opentelemetry import context
+    return context.get_current()
+
+
+def current_trace_id() -> Optional[str]:
+    """Hex trace ID of the active span, for log correlation."""
+    if _tracer is None:
+        return None
+    from opentelemetry import trace
+    ctx = trace.get_current_span().get_span_context()
+    return format(ctx.trace_id, "032x") if ctx.is_valid else None
+
+
+def span(name: str, context: Optional[Any] = None, **attributes):
+    """
+    Starts a span (as a child of `context` if given, else of the current span).
+    Exceptions are recorded on the span. No-op when tracing is disabled, so call sites don't need to check.
+    """
+    if _tracer is None:
+        return nullcontext()
+    return _tracer.start_as_current_span(name, context=context, attributes={k: v for k, v in attributes.items() if v is not None})
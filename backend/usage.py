@@ -0,0 +1,268 @@
+import os
+import json
+import asyncio
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional
+from backend.logging_config import post_id_var, campaign_id_var
+from backend.metrics import MODEL_TOKENS_TOTAL, MODEL_COST_USD_TOTAL, USAGE_RECORDS_DROPPED_TOTAL
+
+logger = logging.getLogger(__name__)
+
+USAGE_BATCH_SIZE = int(os.getenv("USAGE_BATCH_SIZE", "200"))
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "5"))
+# Records kept in memory while the database is unreachable; the oldest are dropped beyond this
+USAGE_BUFFER_MAX = int(os.getenv("USAGE_BUFFER_MAX", "10000"))
+# How often the model_usage_daily rollup is rebuilt; 0 disables the periodic refresh
+USAGE_SUMMARY_REFRESH_INTERVAL = float(os.getenv("USAGE_SUMMARY_REFRESH_INTERVAL", "300"))
+
+# USD per 1M tokens (input / cached input / output) plus per generated image where billed that way.
+# Image models bill their output as tokens, so 'image' stays 0 for them. MODEL_PRICING (same JSON shape) overrides.
+DEFAULT_PRICING = {
+    "gemini-2.0-flash": {"input": 0.10, "cached": 0.025, "output": 0.40},
+    "gemini-3-pro-image-preview": {"input": 2.00, "cached": 0.20, "output": 120.00},
+}
+MODEL_PRICING: Dict[str, Dict[str, float]] = {**DEFAULT_PRICING, **json.loads(os.getenv("MODEL_PRICING") or "{}")}
+
+# Pipeline step the current model call belongs to (caption, image, brand_analysis), set by the generator
+usage_operation_var: ContextVar[Optional[str]] = ContextVar("usage_operation", default=None)
+
+# Advisory lock key so only one process rebuilds the rollup at a time
+_REFRESH_LOCK_KEY = 0x75736167
+
+GROUP_COLUMNS = {
+    "day": "day",
+    "campaign": "NULLIF(campaign_id, 0)",
+    "brand": "NULLIF(brand_id, 0)",
+}
+
+
+@contextmanager
+def usage_operation(name: str):
+    token = usage_operation_var.set(name)
+    try:
+        yield
+    finally:
+        usage_operation_var.reset(token)
+
+
+@dataclass
+class UsageRecord:
+    created_at: datetime
+    operation: str
+    model: str
+    post_id: Optional[int]
+    campaign_id: Optional[int]
+    input_tokens: int
+    cached_tokens: int
+    output_tokens: int
+    images: int
+    cache_hit: bool
+    cost_usd: float
+
+
+def estimate_cost(model: str, input_tokens: int, cached_tokens: int, output_tokens: int, images: int = 0) -> float:
+    """Cost in USD at MODEL_PRICING rates. input_tokens includes the cached ones (as Gemini reports them)."""
+    price = MODEL_PRICING.get(model)
+    if not price:
+        return 0.0
+    billed_input = max(input_tokens - cached_tokens, 0)
+    return (
+        billed_input * price.get("input", 0.0)
+        + cached_tokens * price.get("cached", price.get("input", 0.0))
+        + output_tokens * price.get("output", 0.0)
+    ) / 1_000_000 + images * price.get("image", 0.0)
+
+
+class UsageRecorder:
+    """
+    Buffers per-call token/image usage in memory and appends it to model_usage in batches: one
+    INSERT per flush, never one per model call. Post and campaign come from the log context the
+    generation job already binds; the brand is resolved from the campaign when the batch is written.
+    Optionally rebuilds the model_usage_daily rollup that /usage reads.
+    """
+    def __init__(self, batch_size: int = USAGE_BATCH_SIZE, interval: float = USAGE_FLUSH_INTERVAL, max_buffer: int = USAGE_BUFFER_MAX):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_buffer = max_buffer
+        self.pool = None
+        self.refresh_interval = 0.0
+        self._buffer: List[UsageRecord] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_refresh = 0.0
+
+    def record(self, model: str, input_tokens: int = 0, cached_tokens: int = 0, output_tokens: int = 0, images: int = 0, cache_hit: bool = False, operation: Optional[str] = None):
+        operation = operation or usage_operation_var.get() or ("image" if images else "text")
+        cost = 0.0 if cache_hit else estimate_cost(model, input_tokens, cached_tokens, output_tokens, images)
+        self._buffer.append(UsageRecord(
+            created_at=datetime.now(timezone.utc),
+            operation=operation,
+            model=model,
+            post_id=post_id_var.get(),
+            campaign_id=campaign_id_var.get(),
+            input_tokens=input_tokens,
+            cached_tokens=cached_tokens,
+            output_tokens=output_tokens,
+            images=images,
+            cache_hit=cache_hit,
+            cost_usd=cost,
+        ))
+        MODEL_TOKENS_TOTAL.labels(operation=operation, kind="input").inc(max(input_tokens - cached_tokens, 0))
+        MODEL_TOKENS_TOTAL.labels(operation=operation, kind="cached").inc(cached_tokens)
+        MODEL_TOKENS_TOTAL.labels(operation=operation, kind="output").inc(output_tokens)
+        MODEL_COST_USD_TOTAL.labels(operation=operation).inc(cost)
+
+        overflow = len(self._buffer) - self.max_buffer
+        if overflow > 0:
+            del self._buffer[:overflow]
+            USAGE_RECORDS_DROPPED_TOTAL.inc(overflow)
+        if len(self._buffer) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def record_response(self, model: str, usage_metadata: Any, images: int = 0):
+        """Records a Gemini response's usage_metadata (prompt/cached/candidates/thoughts token counts)."""
+        if usage_metadata is None:
+            self.record(model, images=images)
+            return
+        # Thinking tokens are billed as output
+        output = (getattr(usage_metadata, "candidates_token_count", None) or 0) + (getattr(usage_metadata, "thoughts_token_count", None) or 0)
+        self.record(
+            model,
+            input_tokens=getattr(usage_metadata, "prompt_token_count", None) or 0,
+            cached_tokens=getattr(usage_metadata, "cached_content_token_count", None) or 0,
+            output_tokens=output,
+            images=images,
+        )
+
+    async def flush(self) -> int:
+        if not self._buffer or self.pool is None:
+            return 0
+        batch, self._buffer = self._buffer[:self.batch_size], self._buffer[self.batch_size:]
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute("""
+                    INSERT INTO model_usage (created_at, operation, model, post_id, campaign_id, brand_id,
+                                             input_tokens, cached_tokens, output_tokens, images, cache_hit, cost_usd)
+                    SELECT t.created_at, t.operation, t.model, t.post_id, t.campaign_id, c.brand_id,
+                           t.input_tokens, t.cached_tokens, t.output_tokens, t.images, t.cache_hit, t.cost_usd
+                    FROM unnest($1::timestamptz[], $2::text[], $3::text[], $4::int[], $5::int[],
+                                $6::int[], $7::int[], $8::int[], $9::int[], $10::bool[], $11::float8[])
+                         AS t(created_at, operation, model, post_id, campaign_id,
+                              input_tokens, cached_tokens, output_tokens, images, cache_hit, cost_usd)
+                    LEFT JOIN campaigns c ON c.id = t.campaign_id
+                """,
+                    [r.created_at for r in batch], [r.operation for r in batch], [r.model for r in batch],
+                    [r.post_id for r in batch], [r.campaign_id for r in batch],
+                    [r.input_tokens for r in batch], [r.cached_tokens for r in batch], [r.output_tokens for r in batch],
+                    [r.images for r in batch], [r.cache_hit for r in batch], [r.cost_usd for r in batch])
+        except Exception:
+            # Put the batch back in front; record() trims the oldest if the outage outlasts the buffer
+            self._buffer[:0] = batch
+            raise
+        return len(batch)
+
+    async def refresh_summary(self, pool=None) -> bool:
+        """Rebuilds model_usage_daily without blocking readers. Returns False if another process is already at it."""
+        pool = pool or self.pool
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                if not await conn.fetchval("SELECT pg_try_advisory_xact_lock($1)", _REFRESH_LOCK_KEY):
+                    return False
+                await conn.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY model_usage_daily")
+        return True
+
+    async def run_forever(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                while await self.flush() >= self.batch_size:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Usage flush failed (%s records buffered): %s", len(self._buffer), e)
+
+            if self.refresh_interval > 0 and loop.time() - self._last_refresh >= self.refresh_interval:
+                self._last_refresh = loop.time()
+                try:
+                    await self.refresh_summary()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error("Usage summary refresh failed: %s", e)
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, pool, refresh_interval: float = 0.0):
+        """refresh_interval > 0 also rebuilds the daily rollup on that period (run it where maintenance runs)."""
+        self.pool = pool
+        self.refresh_interval = refresh_interval
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Write out what's left while the pool is still open
+        try:
+            while await self.flush():
+                pass
+        except Exception as e:
+            logger.warning("Dropping %s usage records on shutdown: %s", len(self._buffer), e)
+
+
+async def usage_summary(connection, group_by: str, campaign_id: Optional[int] = None, brand_id: Optional[int] = None, since: Optional[date] = None, until: Optional[date] = None) -> List[Dict[str, Any]]:
+    """Rollup of model_usage_daily by day, campaign or brand. until is inclusive."""
+    key = GROUP_COLUMNS[group_by]
+    rows = await connection.fetch(f"""
+        SELECT {key} AS key,
+               SUM(calls)::bigint AS calls,
+               SUM(cache_hits)::bigint AS cache_hits,
+               SUM(input_tokens)::bigint AS input_tokens,
+               SUM(cached_tokens)::bigint AS cached_tokens,
+               SUM(output_tokens)::bigint AS output_tokens,
+               SUM(images)::bigint AS images,
+               SUM(cost_usd)::float8 AS cost_usd,
+               MAX(last_call_at) AS last_call_at
+        FROM model_usage_daily
+        WHERE ($1::int IS NULL OR campaign_id = $1)
+          AND ($2::int IS NULL OR brand_id = $2)
+          AND ($3::date IS NULL OR day >= $3)
+          AND ($4::date IS NULL OR day <= $4)
+        GROUP BY 1
+        ORDER BY 1
+    """, campaign_id, brand_id, since, until)
+    return [dict(row) for row in rows]
+
+
+async def post_usage(connection, post_id: int) -> Dict[str, Any]:
+    """Totals for one post, straight from model_usage (includes calls not yet in the daily rollup)."""
+    row = await connection.fetchrow("""
+        SELECT COUNT(*) AS calls,
+               COUNT(*) FILTER (WHERE cache_hit) AS cache_hits,
+               COALESCE(SUM(input_tokens), 0)::bigint AS input_tokens,
+               COALESCE(SUM(cached_tokens), 0)::bigint AS cached_tokens,
+               COALESCE(SUM(output_tokens), 0)::bigint AS output_tokens,
+               COALESCE(SUM(images), 0)::bigint AS images,
+               COALESCE(SUM(cost_usd), 0)::float8 AS cost_usd,
+               MAX(created_at) AS last_call_at
+        FROM model_usage WHERE post_id = $1
+    """, post_id)
+    return dict(row)
+
+
+usage_recorder = UsageRecorder()
@@ -0,0 +1,337 @@
+import os
+import hmac
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Set
+import asyncpg
+from backend.metrics import WEBHOOK_EVENTS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+# Shared secret for provider callbacks; WEBHOOK_SECRET_<PROVIDER> overrides it per provider
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Signed timestamps older (or newer) than this are rejected, so a captured request can't be replayed later
+WEBHOOK_TOLERANCE_SECONDS = int(os.getenv("WEBHOOK_TOLERANCE_SECONDS", "300"))
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "200"))
+WEBHOOK_POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", "2.0"))
+# A callback can beat the publish it reports on (its job id isn't stored yet): it is retried this often...
+WEBHOOK_RETRY_INTERVAL = int(os.getenv("WEBHOOK_RETRY_INTERVAL", "60"))
+# ...until it is this old, then dead-lettered (kept with dead_lettered_at set, no longer applied)
+WEBHOOK_UNMATCHED_MAX_AGE = int(os.getenv("WEBHOOK_UNMATCHED_MAX_AGE", "86400"))
+# Lifetime of the tokens dashboards open /events/ streams with (EventSource can't send the API key header)
+STREAM_TOKEN_TTL = int(os.getenv("STREAM_TOKEN_TTL", "300"))
+
+SIGNATURE_HEADER = "X-Webhook-Signature"
+POST_STATUS_CHANNEL = "post_status"
+
+# Provider status vocabulary -> ours; anything else (queued, processing...) is stored but changes nothing
+_STATUS_MAP = {
+    "published": "published", "success": "published", "completed": "published", "posted": "published",
+    "failed": "failed", "error": "failed", "rejected": "failed", "cancelled": "failed",
+}
+
+
+class InvalidSignature(Exception):
+    pass
+
+
+@dataclass
+class StatusCallback:
+    event_id: str
+    external_id: str
+    status: str  # published | failed | other provider value
+    error: Optional[str] = None
+
+
+def webhook_secret(provider: str) -> Optional[str]:
+    return os.getenv(f"WEBHOOK_SECRET_{provider.upper()}") or WEBHOOK_SECRET
+
+
+def sign_payload(secret: str, body: bytes, timestamp: Optional[int] = None) -> str:
+    """Signature header value: t=<unix seconds>,v1=<hex HMAC-SHA256 of '<t>.<body>'>."""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+def verify_signature(secret: str, body: bytes, header: Optional[str], tolerance: int = WEBHOOK_TOLERANCE_SECONDS):
+    if not header:
+        raise InvalidSignature("Missing signature")
+    parts = dict(part.strip().split("=", 1) for part in header.split(",") if "=" in part)
+    try:
+        timestamp = int(parts["t"])
+    except (KeyError, ValueError):
+        raise InvalidSignature("Malformed signature")
+    if abs(time.time() - timestamp) > tolerance:
+        raise InvalidSignature("Signature timestamp outside tolerance")
+    expected = sign_payload(secret, body, timestamp).split("v1=", 1)[1]
+    if not hmac.compare_digest(expected, parts.get("v1", "")):
+        raise InvalidSignature("Signature mismatch")
+
+
+def issue_stream_token(secret: str, ttl: int = STREAM_TOKEN_TTL) -> str:
+    """'<expiry>.<hex HMAC>': valid for opening an event stream until expiry, and for nothing else."""
+    expires = int(time.time()) + ttl
+    digest = hmac.new(secret.encode(), f"events:{expires}".encode(), hashlib.sha256).hexdigest()
+    return f"{expires}.{digest}"
+
+
+def verify_stream_token(secret: str, token: Optional[str]) -> bool:
+    expires, _, digest = (token or "").partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    expected = hmac.new(secret.encode(), f"events:{expires}".encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, digest)
+
+
+def parse_callback(body: bytes) -> StatusCallback:
+    """Normalizes a provider callback. Raises ValueError if it doesn't identify a job."""
+    payload = json.loads(body)
+    if not isinstance(payload, dict):
+        raise ValueError("Callback body must be a JSON object")
+    data = payload.get("data") if isinstance(payload.get("data"), dict) else payload
+    external_id = data.get("job_id") or data.get("request_id") or data.get("external_id")
+    if not external_id:
+        raise ValueError("Callback has no job_id")
+    raw_status = str(data.get("status") or payload.get("event") or "").lower()
+    # Providers retry with the same event ID; without one, the body itself identifies the delivery
+    event_id = payload.get("event_id") or payload.get("id") or hashlib.sha256(body).hexdigest()
+    return StatusCallback(
+        event_id=str(event_id),
+        external_id=str(external_id),
+        status=_STATUS_MAP.get(raw_status, raw_status or "unknown"),
+        error=data.get("error") or data.get("message")
+    )
+
+
+async def store_event(connection, provider: str, callback: StatusCallback, body: bytes) -> bool:
+    """Enqueues a verified callback. Returns False for a redelivery of an event already received."""
+    event_pk = await connection.fetchval("""
+        INSERT INTO provider_webhook_events (provider, event_id, external_id, status, error, payload)
+        VALUES ($1, $2, $3, $4, $5, $6::jsonb)
+        ON CONFLICT (provider, event_id) DO NOTHING
+        RETURNING id
+    """, provider, callback.event_id, callback.external_id, callback.status, callback.error, body.decode())
+    return event_pk is not None
+
+
+class WebhookProcessor:
+    """
+    Applies queued provider callbacks to publish_attempts and posts in batches: one claim, one
+    UPDATE per table and one NOTIFY statement per batch, regardless of how many callbacks arrived.
+    The receiver only verifies and inserts, so providers get a fast 200 and bursts are absorbed here.
+    """
+    def __init__(self, pool, batch_size: int = WEBHOOK_BATCH_SIZE, interval: float = WEBHOOK_POLL_INTERVAL):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.interval = interval
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def process_batch(self) -> int:
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                # Row locks are the claim: the whole batch commits (or rolls back) as one unit
+                events = await conn.fetch("""
+                    SELECT id, provider, external_id, status, error,
+                           received_at < CURRENT_TIMESTAMP - make_interval(secs => $2) AS expired
+                    FROM provider_webhook_events
+                    WHERE processed_at IS NULL
+                      AND (retry_after IS NULL OR retry_after <= CURRENT_TIMESTAMP)
+                    ORDER BY id
+                    LIMIT $1
+                    FOR UPDATE SKIP LOCKED
+                """, self.batch_size, WEBHOOK_UNMATCHED_MAX_AGE)
+                if not events:
+                    return 0
+
+                # Last callback per job wins within a batch (ids are in arrival order)
+                latest: Dict[str, Any] = {}
+                for event in events:
+                    if event['status'] in ("published", "failed"):
+                        latest[event['external_id']] = event
+
+                # Jobs no attempt knows yet: their callbacks wait for the publish to store the job id
+                matched: Set[str] = set()
+                if latest:
+                    matched = {row['external_id'] for row in await conn.fetch("""
+                        SELECT DISTINCT external_id FROM publish_attempts WHERE external_id = ANY($1::text[])
+                    """, list(latest))}
+                unmatched = [e for e in events if e['external_id'] in latest and e['external_id'] not in matched]
+                retry = [e for e in unmatched if not e['expired']]
+                dead = [e for e in unmatched if e['expired']]
+
+                changed = []
+                if latest:
+                    # A late 'failed' never overrides a job the provider already reported live.
+                    # Callbacks only match attempts that stored the provider's job id; one whose submit
+                    # response was lost (UNKNOWN, no external_id) is settled by PublishReconciler instead.
+                    changed = await conn.fetch("""
+                        UPDATE publish_attempts a SET
+                            provider_status = t.status,
+                            provider_status_at = CURRENT_TIMESTAMP,
+                            state = CASE WHEN t.status = 'failed' THEN 'FAILED' ELSE 'SUCCEEDED' END,
+                            error = CASE WHEN t.status = 'failed' THEN COALESCE(t.error, 'Failed at provider') END,
+                            updated_at = CURRENT_TIMESTAMP
+                        FROM unnest($1::text[], $2::text[], $3::text[]) AS t(external_id, status, error)
+                        WHERE a.external_id = t.external_id
+                          AND a.provider_status IS DISTINCT FROM 'published'
+                        RETURNING a.post_id, a.platform, t.status
+                    """,
+                        list(latest),
+                        [e['status'] for e in latest.values()],
+                        [e['error'] for e in latest.values()])
+
+                if changed:
+                    # A post is judged on all of its platforms: published if any went live, PUBLISH_FAILED
+                    # only once every one failed; otherwise (still in flight elsewhere) it stays as it is
+                    updated = await conn.fetch("""
+                        UPDATE posts p SET status = t.status::post_status, updated_at = CURRENT_TIMESTAMP
+                        FROM (
+                            SELECT post_id,
+                                   CASE WHEN bool_or(state = 'SUCCEEDED') THEN 'PUBLISHED'
+                                        WHEN bool_and(state = 'FAILED') THEN 'PUBLISH_FAILED' END AS status
+                            FROM publish_attempts
+                            WHERE post_id = ANY($1::int[])
+                            GROUP BY post_id
+                        ) t
+                        WHERE p.id = t.post_id AND t.status IS NOT NULL AND p.status::text <> t.status
+                        RETURNING p.id, p.campaign_id, p.status::text AS status
+                    """, list({row['post_id'] for row in changed}))
+                    platforms = {row['post_id']: row['platform'] for row in changed}
+                    # Delivered to listeners on commit, so dashboards never see a status that rolled back
+                    await conn.execute("""
+                        SELECT pg_notify($1, payload) FROM unnest($2::text[]) AS payload
+                    """, POST_STATUS_CHANNEL, [
+                        json.dumps({"post_id": row['id'], "campaign_id": row['campaign_id'], "status": row['status'], "platform": platforms.get(row['id'])})
+                        for row in updated
+                    ])
+
+                unmatched_ids = {event['id'] for event in unmatched}
+                await conn.execute("""
+                    UPDATE provider_webhook_events SET processed_at = CURRENT_TIMESTAMP WHERE id = ANY($1::bigint[])
+                """, [event['id'] for event in events if event['id'] not in unmatched_ids])
+                if retry:
+                    await conn.execute("""
+                        UPDATE provider_webhook_events SET retry_after = CURRENT_TIMESTAMP + make_interval(secs => $2)
+                        WHERE id = ANY($1::bigint[])
+                    """, [event['id'] for event in retry], WEBHOOK_RETRY_INTERVAL)
+                if dead:
+                    await conn.execute("""
+                        UPDATE provider_webhook_events SET processed_at = CURRENT_TIMESTAMP, dead_lettered_at = CURRENT_TIMESTAMP
+                        WHERE id = ANY($1::bigint[])
+                    """, [event['id'] for event in dead])
+
+        for event in dead:
+            WEBHOOK_EVENTS_TOTAL.labels(provider=event['provider'], outcome="dead_lettered").inc()
+        if dead:
+            logger.warning("Dead-lettered %s provider callbacks that matched no publish attempt within %ss (jobs: %s)",
+                           len(dead), WEBHOOK_UNMATCHED_MAX_AGE, ", ".join(sorted({e['external_id'] for e in dead})[:20]))
+        logger.info("Applied %s provider callbacks (%s publish attempts changed, %s waiting for their attempt)",
+                    len(events) - len(unmatched), len(changed), len(retry))
+        return len(events)
+
+    async def run_forever(self):
+        while True:
+            try:
+                # Keep going while full batches come back
+                while await self.process_batch() >= self.batch_size:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Webhook processing failed: %s", e)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class PostStatusBroadcaster:
+    """
+    Relays post_status NOTIFYs to connected dashboards (server-sent events). One LISTEN connection
+    per process, fanned out to an in-memory queue per subscriber.
+    """
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._conn = None
+        self._dsn: Optional[str] = None
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def _on_notify(self, conn, pid, channel, payload: str):
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(payload)
+            except asyncio.QueueFull:
+                # A stalled client loses updates rather than holding memory; it refetches on reconnect
+                pass
+
+    def _on_lost(self, conn):
+        logger.warning("Post status listener disconnected")
+        self._conn = None
+        if self._dsn:
+            asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _connect(self) -> bool:
+        try:
+            conn = await asyncpg.connect(self._dsn)
+            await conn.add_listener(POST_STATUS_CHANNEL, self._on_notify)
+            conn.add_termination_listener(self._on_lost)
+            self._conn = conn
+            return True
+        except Exception as e:
+            logger.warning("Post status listener unavailable: %s", e)
+            return False
+
+    async def _reconnect(self, delay: float = 5.0):
+        while self._dsn and self._conn is None:
+            await asyncio.sleep(delay)
+            if self._dsn and await self._connect():
+                return
+
+    async def start(self, dsn: str):
+        self._dsn = dsn
+        if not await self._connect():
+            asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def stop(self):
+        self._dsn = None
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            conn.remove_termination_listener(self._on_lost)
+            try:
+                await conn.close()
+            except Exception as e:
+                logger.warning("Error closing post status listener: %s", e)
+
+
+post_status_broadcaster = PostStatusBroadcaster()
@@ -8,8 +8,11 @@ cd apps/dashboard
 npm install
 npm run build
 cd ../..
+python3 scripts/precompress_dist.py apps/dashboard/dist
 
 echo "2. Packaging with PyInstaller..."
+# Embedded PostgreSQL for the local database mode
+python3 -m pip install pgserver
 # We use --windowed so it doesn't open a terminal window on launch.
 # We include the compiled React dist folder.
 # We include the backend and execution modules.
@@ -17,6 +20,8 @@ python3 -m PyInstaller --name "ContentEngine" \
             --add-data "apps/dashboard/dist:apps/dashboard/dist" \
             --add-data "backend:backend" \
             --add-data "execution:execution" \
+            --add-data "database:database" \
+            --collect-all "pgserver" \
             --hidden-import "uvicorn.logging" \
             --hidden-import "uvicorn.loops" \
             --hidden-import "uvicorn.loops.auto" \
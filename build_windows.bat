@@ -6,13 +6,18 @@ cd apps\dashboard
 call npm install
 call npm run build
 cd ..\..
+python scripts\precompress_dist.py apps\dashboard\dist
 
 echo 2. Packaging with PyInstaller...
+:: Embedded PostgreSQL for the local database mode
+python -m pip install pgserver
 :: Notice the semi-colons (;) instead of colons (:) for Windows paths
 python -m PyInstaller --name "ContentEngine" ^
             --add-data "apps\dashboard\dist;apps\dashboard\dist" ^
             --add-data "backend;backend" ^
             --add-data "execution;execution" ^
+            --add-data "database;database" ^
+            --collect-all "pgserver" ^
             --hidden-import "uvicorn.logging" ^
             --hidden-import "uvicorn.loops" ^
             --hidden-import "uvicorn.loops.auto" ^
@@ -60,3 +60,125 @@ CREATE INDEX IF NOT EXISTS idx_posts_status ON posts(status);
 CREATE INDEX IF NOT EXISTS idx_posts_campaign_id ON posts(campaign_id);
 CREATE INDEX IF NOT EXISTS idx_campaigns_brand_id ON campaigns(brand_id);
 CREATE INDEX IF NOT EXISTS idx_integrations_platform ON integrations(platform);
+
+-- 7. Notify workers when brand/campaign context changes (drops in-process context caches)
+CREATE OR REPLACE FUNCTION notify_context_invalidation() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('context_invalidation', TG_TABLE_NAME || ':' || COALESCE(NEW.id, OLD.id));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS brands_context_invalidation ON brands;
+CREATE TRIGGER brands_context_invalidation AFTER INSERT OR UPDATE OR DELETE ON brands
+    FOR EACH ROW EXECUTE FUNCTION notify_context_invalidation();
+
+DROP TRIGGER IF EXISTS campaigns_context_invalidation ON campaigns;
+CREATE TRIGGER campaigns_context_invalidation AFTER UPDATE OR DELETE ON campaigns
+    FOR EACH ROW EXECUTE FUNCTION notify_context_invalidation();
+
+-- 8. Storage objects that may have become unreferenced (drained by the storage garbage collector)
+CREATE TABLE IF NOT EXISTS storage_gc_queue (
+    id BIGSERIAL PRIMARY KEY,
+    url TEXT NOT NULL,
+    enqueued_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    claimed_at TIMESTAMP WITH TIME ZONE
+);
+CREATE INDEX IF NOT EXISTS idx_posts_image_urls ON posts USING GIN (image_urls);
+CREATE INDEX IF NOT EXISTS idx_posts_input_image_url ON posts(input_image_url);
+
+-- 9. Generation queue: requested = work pending, claimed = lease held by the process running it
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS generation_requested_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS generation_claimed_at TIMESTAMP WITH TIME ZONE;
+CREATE INDEX IF NOT EXISTS idx_posts_generation_queue ON posts(generation_requested_at) WHERE generation_requested_at IS NOT NULL;
+
+-- 10. Publish ledger: one row per post and platform, so retries never publish twice
+CREATE TABLE IF NOT EXISTS publish_attempts (
+    id BIGSERIAL PRIMARY KEY,
+    post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+    platform TEXT NOT NULL,
+    dedup_key TEXT NOT NULL UNIQUE,
+    state TEXT NOT NULL DEFAULT 'PENDING', -- PENDING, IN_FLIGHT, SUCCEEDED, FAILED, UNKNOWN
+    attempt INTEGER NOT NULL DEFAULT 0,
+    external_id TEXT,
+    error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_publish_attempts_post_id ON publish_attempts(post_id);
+CREATE INDEX IF NOT EXISTS idx_publish_attempts_unresolved ON publish_attempts(updated_at) WHERE state IN ('IN_FLIGHT', 'UNKNOWN');
+
+-- 11. Provider status callbacks: deduplicated on arrival, applied to publish_attempts/posts in batches
+ALTER TABLE publish_attempts ADD COLUMN IF NOT EXISTS provider_status TEXT;
+ALTER TABLE publish_attempts ADD COLUMN IF NOT EXISTS provider_status_at TIMESTAMP WITH TIME ZONE;
+CREATE INDEX IF NOT EXISTS idx_publish_attempts_external_id ON publish_attempts(external_id);
+CREATE TABLE IF NOT EXISTS provider_webhook_events (
+    id BIGSERIAL PRIMARY KEY,
+    provider TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    external_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    payload JSONB,
+    received_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    processed_at TIMESTAMP WITH TIME ZONE,
+    UNIQUE (provider, event_id)
+);
+CREATE INDEX IF NOT EXISTS idx_provider_webhook_events_pending ON provider_webhook_events(id) WHERE processed_at IS NULL;
+
+-- 12. Per-request opt-out of the image result cache
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS generation_bypass_cache BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- 13. Generation lanes: interactive (regenerate clicks) is claimed ahead of bulk campaign runs
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS generation_lane TEXT NOT NULL DEFAULT 'bulk';
+CREATE INDEX IF NOT EXISTS idx_posts_generation_lane ON posts(generation_lane, generation_requested_at) WHERE generation_requested_at IS NOT NULL;
+
+-- 14. Generation version: bumped per request, so a superseded run can't overwrite newer results
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS generation_version INTEGER NOT NULL DEFAULT 0;
+
+-- 15. Model token/image usage (append-only, written in batches) and its daily rollup per brand/campaign.
+-- 0 stands for "no brand/campaign" in the rollup: REFRESH ... CONCURRENTLY needs a NULL-free unique key.
+CREATE TABLE IF NOT EXISTS model_usage (
+    id BIGSERIAL PRIMARY KEY,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    operation TEXT NOT NULL, -- brand_analysis, caption, image
+    model TEXT NOT NULL,
+    post_id INTEGER,
+    campaign_id INTEGER,
+    brand_id INTEGER,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    images INTEGER NOT NULL DEFAULT 0,
+    cache_hit BOOLEAN NOT NULL DEFAULT FALSE,
+    cost_usd NUMERIC(12, 6) NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_model_usage_post_id ON model_usage(post_id) WHERE post_id IS NOT NULL;
+CREATE MATERIALIZED VIEW IF NOT EXISTS model_usage_daily AS
+SELECT (created_at AT TIME ZONE 'UTC')::date AS day,
+       COALESCE(brand_id, 0) AS brand_id,
+       COALESCE(campaign_id, 0) AS campaign_id,
+       operation,
+       model,
+       COUNT(*) AS calls,
+       COUNT(*) FILTER (WHERE cache_hit) AS cache_hits,
+       SUM(input_tokens)::bigint AS input_tokens,
+       SUM(cached_tokens)::bigint AS cached_tokens,
+       SUM(output_tokens)::bigint AS output_tokens,
+       SUM(images)::bigint AS images,
+       SUM(cost_usd) AS cost_usd,
+       MAX(created_at) AS last_call_at
+FROM model_usage
+GROUP BY 1, 2, 3, 4, 5;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_model_usage_daily_key ON model_usage_daily(day, brand_id, campaign_id, operation, model);
+
+-- 16. Reconciler backoff: unresolvable publish attempts are rechecked less and less often
+ALTER TABLE publish_attempts ADD COLUMN IF NOT EXISTS reconcile_checks INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE publish_attempts ADD COLUMN IF NOT EXISTS reconcile_after TIMESTAMP WITH TIME ZONE;
+
+-- 17. Publish failures (every platform failed) are told apart from generation failures
+ALTER TYPE post_status ADD VALUE IF NOT EXISTS 'PUBLISH_FAILED';
+
+-- 18. Callbacks that arrive before their publish attempt stored the job id: retried, then dead-lettered
+ALTER TABLE provider_webhook_events ADD COLUMN IF NOT EXISTS retry_after TIMESTAMP WITH TIME ZONE;
+ALTER TABLE provider_webhook_events ADD COLUMN IF NOT EXISTS dead_lettered_at TIMESTAMP WITH TIME ZONE;
@@ -3,6 +3,7 @@ import sys
 import threading
 import time
 import json
+import asyncio
 import uvicorn
 import webbrowser
 
@@ -14,6 +15,9 @@ else:
 
 config_path = os.path.join(application_path, 'config.json')
 
+# How long to wait for the API's startup hook (migrations, pool) before giving up
+STARTUP_TIMEOUT = float(os.getenv("DESKTOP_STARTUP_TIMEOUT", "60"))
+
 def load_config():
     if os.path.exists(config_path):
         try:
@@ -32,14 +36,13 @@ def prompt_for_config(config):
     print("        INITIAL CONFIGURATION            ")
     print("=========================================\n")
     
-    if not config.get('DATABASE_URL'):
-        db_url = input("Enter Supabase DATABASE_URL (Required): ").strip()
+    if not config.get('DATABASE_URL') and config.get('DATABASE_MODE') != 'embedded':
+        db_url = input("Enter Supabase DATABASE_URL (leave empty to use a local embedded database): ").strip()
         if db_url:
             config['DATABASE_URL'] = db_url
+            config['DATABASE_MODE'] = 'remote'
         else:
-            print("ERROR: DATABASE_URL is required to start the engine.")
-            input("Press Enter to exit...")
-            sys.exit(1)
+            config['DATABASE_MODE'] = 'embedded'
             
     if not config.get('GEMINI_API_KEY'):
         gemini = input("Enter Gemini API Key (Optional but recommended): ").strip()
@@ -55,18 +58,78 @@ def prompt_for_config(config):
     print("\n✅ Configuration saved!\n")
     return config
 
-def run_server():
+def start_embedded_database():
+    """
+    Runs a private PostgreSQL instance (pgserver bundles the binaries) with its data directory
+    next to the executable and connects over a local socket, so queries never leave the machine.
+    The schema script is idempotent and applied on every launch.
+    """
+    try:
+        import pgserver
+    except ImportError:
+        print("ERROR: Embedded database mode needs the 'pgserver' package (pip install pgserver).")
+        input("Press Enter to exit...")
+        sys.exit(1)
+
+    data_dir = os.path.join(application_path, "data", "postgres")
+    os.makedirs(data_dir, exist_ok=True)
+    print("Starting embedded database...")
+    server = pgserver.get_server(data_dir, cleanup_mode="stop")
+    database_url = server.get_uri()
+
+    async def init_schema():
+        import asyncpg
+        conn = await asyncpg.connect(database_url)
+        try:
+            with open(os.path.join("database", "cloud_init.sql"), "r") as f:
+                await conn.execute(f.read())
+        finally:
+            await conn.close()
+
+    asyncio.run(init_schema())
+    return server, database_url
+
+def start_server():
     from backend.main import app
-    # Run uvicorn server in this thread
-    uvicorn.run(app, host="127.0.0.1", port=8000, log_level="error")
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=8000, log_level="error"))
+    # Run uvicorn server in a background thread
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    return server, thread
+
+def wait_until_ready(server: uvicorn.Server, thread: threading.Thread, timeout: float) -> bool:
+    """`started` flips once the startup hook has finished and the socket is listening."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.started:
+            return True
+        # A failing startup hook ends server.run() without ever setting `started`
+        if not thread.is_alive():
+            return False
+        time.sleep(0.05)
+    return False
 
 def main():
     config = load_config()
-    if not config.get('DATABASE_URL') or not config.get('GEMINI_API_KEY') or not config.get('UPLOAD_POST_API_KEY'):
+    has_database = config.get('DATABASE_URL') or config.get('DATABASE_MODE') == 'embedded'
+    if not has_database or not config.get('GEMINI_API_KEY') or not config.get('UPLOAD_POST_API_KEY'):
         config = prompt_for_config(config)
+
+    # Ensure current working directory is the app bundle so static assets can be found
+    # PyInstaller unpacks the app to a temp location (_MEIPASS)
+    if getattr(sys, 'frozen', False):
+        os.chdir(sys._MEIPASS)
+
+    db_server = None
+    database_url = config.get('DATABASE_URL', '')
+    if config.get('DATABASE_MODE') == 'embedded':
+        db_server, database_url = start_embedded_database()
+        # Single user on a local socket: a small pool is plenty
+        os.environ.setdefault('DB_POOL_MIN_SIZE', '1')
+        os.environ.setdefault('DB_POOL_MAX_SIZE', '5')
         
     # Inject into environment for FastAPI to pick up
-    os.environ['DATABASE_URL'] = config.get('DATABASE_URL', '')
+    os.environ['DATABASE_URL'] = database_url
     os.environ['GEMINI_API_KEY'] = config.get('GEMINI_API_KEY', '')
     os.environ['UPLOAD_POST_API_KEY'] = config.get('UPLOAD_POST_API_KEY', '')
     
@@ -79,29 +142,34 @@ def main():
     
     os.environ['LOCAL_STORAGE_DIR'] = images_dir
     os.environ['LOCAL_UPLOADS_DIR'] = uploads_dir
-    
-    # Ensure current working directory is the app bundle so static assets can be found
-    # PyInstaller unpacks the app to a temp location (_MEIPASS)
-    if getattr(sys, 'frozen', False):
-        os.chdir(sys._MEIPASS)
 
     print("Starting Content Engine...")
-    t = threading.Thread(target=run_server, daemon=True)
-    t.start()
+    server, thread = start_server()
     
     # Wait for the server to be ready
-    time.sleep(2)
+    if not wait_until_ready(server, thread, STARTUP_TIMEOUT):
+        print("ERROR: Content Engine failed to start. Check the database settings in config.json.")
+        if db_server is not None:
+            db_server.cleanup()
+        input("Press Enter to exit...")
+        sys.exit(1)
 
     print("Launching Desktop Window...")
     webbrowser.open('http://127.0.0.1:8000')
     
     # Keep the main thread alive since uvicorn is running in a daemon thread
     try:
-        while True:
+        while thread.is_alive():
             time.sleep(1)
     except KeyboardInterrupt:
-        print("Shutting down Content Engine...")
-        sys.exit(0)
+        pass
+    print("Shutting down Content Engine...")
+    # Let the shutdown hook close the pool before the database goes away
+    server.should_exit = True
+    thread.join(timeout=10)
+    if db_server is not None:
+        db_server.cleanup()
+    sys.exit(0)
 
 if __name__ == '__main__':
     main()
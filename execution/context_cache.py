@@ -0,0 +1,92 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# TTL (seconds) for cached campaign prefixes on the provider side. 0 disables caching.
+CONTEXT_CACHE_TTL = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "3600"))
+
+
+@dataclass
+class CachedPrefix:
+    name: Optional[str]  # Provider cache handle, None if the provider refused (e.g. prefix too small)
+    fingerprint: str
+    expires_at: float
+
+
+class CampaignContextCache:
+    """
+    Tracks provider-side cached content handles per campaign.
+    A campaign's brand + master strategy prefix is uploaded once and reused by all of its posts
+    until the TTL expires or the brand/campaign content changes (detected via fingerprint).
+    """
+    def __init__(self, ttl: int = CONTEXT_CACHE_TTL):
+        self.ttl = ttl
+        self._entries: Dict[int, CachedPrefix] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    @staticmethod
+    def fingerprint(model: str, prefix: str) -> str:
+        return hashlib.sha256(f"{model}\n{prefix}".encode("utf-8")).hexdigest()
+
+    async def get_or_create(self, provider, campaign_id: int, prefix: str) -> Optional[str]:
+        """Returns a cache handle for the campaign prefix, creating it on first use. None means send the prefix inline."""
+        if not self.enabled or provider is None:
+            return None
+
+        fingerprint = self.fingerprint(provider.text_model, prefix)
+        lock = self._locks.setdefault(campaign_id, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(campaign_id)
+            # Refresh a little before expiry so in-flight requests never reference a dead handle
+            if entry and entry.fingerprint == fingerprint and entry.expires_at - 30 > time.time():
+                return entry.name
+
+            if entry and entry.name:
+                await self._delete_remote(provider, entry.name)
+
+            name = await self._create_remote(provider, prefix)
+            self._entries[campaign_id] = CachedPrefix(name=name, fingerprint=fingerprint, expires_at=time.time() + self.ttl)
+            return name
+
+    async def invalidate(self, provider, campaign_id: int):
+        """Drops the campaign's cached prefix (call on brand/campaign writes)."""
+        # Same lock as get_or_create (kept, never popped) so a create in flight can't race a second one
+        lock = self._locks.setdefault(campaign_id, asyncio.Lock())
+        async with lock:
+            entry = self._entries.pop(campaign_id, None)
+            if entry and entry.name and provider is not None:
+                await self._delete_remote(provider, entry.name)
+
+    async def invalidate_all(self, provider):
+        for campaign_id in list(self._entries.keys()):
+            await self.invalidate(provider, campaign_id)
+
+    async def _create_remote(self, provider, prefix: str) -> Optional[str]:
+        try:
+            name = await provider.create_context_cache(prefix, self.ttl)
+            if name:
+                logger.info("Created context cache %s (ttl=%ss)", name, self.ttl)
+            return name
+        except Exception as e:
+            # Providers reject prefixes below their minimum cacheable size; remember that and send it inline
+            logger.info("Context caching unavailable for this prefix, sending inline: %s", e)
+            return None
+
+    async def _delete_remote(self, provider, name: str):
+        try:
+            await provider.delete_context_cache(name)
+        except Exception as e:
+            logger.warning("Failed to delete context cache %s: %s", name, e)
+
+
+context_cache = CampaignContextCache()
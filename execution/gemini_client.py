@@ -0,0 +1,60 @@
+import os
+import asyncio
+import logging
+from typing import Any, Optional
+from google import genai
+
+logger = logging.getLogger(__name__)
+
+# Per-call timeouts (seconds). Image generation is considerably slower than text.
+GEMINI_TEXT_TIMEOUT = float(os.getenv("GEMINI_TEXT_TIMEOUT", "60"))
+GEMINI_IMAGE_TIMEOUT = float(os.getenv("GEMINI_IMAGE_TIMEOUT", "180"))
+
+
+class GeminiTimeoutError(TimeoutError):
+    pass
+
+
+class AsyncGeminiClient:
+    """
+    Single async entry point for every Gemini call.
+    All requests go through `client.aio` so the event loop is never blocked, each call is bounded
+    by a timeout, and cancelling the awaiting task cancels the in-flight HTTP request.
+    """
+    def __init__(self, api_key: str, text_timeout: float = GEMINI_TEXT_TIMEOUT, image_timeout: float = GEMINI_IMAGE_TIMEOUT, client: Any = None):
+        # `client` replaces the google-genai client (same `aio` layout), e.g. a fake in tests
+        self._client = client or genai.Client(api_key=api_key)
+        self.text_timeout = text_timeout
+        self.image_timeout = image_timeout
+
+    async def _bounded(self, coro, timeout: float, what: str):
+        try:
+            return await asyncio.wait_for(coro, timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.error("Gemini %s timed out after %ss", what, timeout)
+            raise GeminiTimeoutError(f"Gemini {what} timed out after {timeout}s")
+
+    async def generate_content(self, model: str, contents: Any, config: Any = None, timeout: Optional[float] = None):
+        return await self._bounded(
+            self._client.aio.models.generate_content(model=model, contents=contents, config=config),
+            timeout or self.text_timeout,
+            f"generate_content({model})"
+        )
+
+    async def generate_image_content(self, model: str, contents: Any, config: Any = None, timeout: Optional[float] = None):
+        return await self.generate_content(model, contents, config, timeout=timeout or self.image_timeout)
+
+    async def create_cache(self, model: str, config: Any):
+        return await self._bounded(
+            self._client.aio.caches.create(model=model, config=config),
+            self.text_timeout,
+            "caches.create"
+        )
+
+    async def delete_cache(self, name: str):
+        return await self._bounded(
+            self._client.aio.caches.delete(name=name),
+            self.text_timeout,
+            "caches.delete"
+        )
+
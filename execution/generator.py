@@ -1,33 +1,40 @@
 import os
 import json
+import asyncio
 import logging
 import urllib.parse
 from typing import List, Dict, Optional, Any, Callable
-from google import genai
-from google.genai import types
 import urllib.parse
 import uuid
 from pathlib import Path
-import httpx
 from io import BytesIO
-from PIL import Image as PILImage
+from execution.context_cache import context_cache
+from execution.image_cache import image_cache, image_cache_key
+from execution.media import MediaHandle, open_media
+from execution.model_provider import ModelProvider, get_model_provider
+from execution.instrumentation import instrumentation
 
 logger = logging.getLogger(__name__)
 
-# Configure Gemini API
-GENAI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GENAI_API_KEY:
-    logger.warning("GEMINI_API_KEY not set in environment variables")
-    client = None
-else:
-    client = genai.Client(api_key=GENAI_API_KEY)
+# Model backend (Gemini by default, MODEL_PROVIDER=stub for offline load testing).
+# Built on first use (or by the app's startup hook) so importing this module stays cheap.
+_provider: Optional[ModelProvider] = None
+_provider_loaded = False
 
-async def analyze_brand(text_content: str, visual_content_url: Optional[str] = None) -> Dict[str, Any]:
+def get_provider() -> Optional[ModelProvider]:
+    global _provider, _provider_loaded
+    if not _provider_loaded:
+        _provider = get_model_provider()
+        _provider_loaded = True
+    return _provider
+
+async def analyze_brand(text_content: str, visual_content_url: Optional[str] = None, visual_media: Optional[MediaHandle] = None) -> Dict[str, Any]:
     """
     Analyzes the brand identity from the provided text description and optional visual content (logo/image) using Gemini.
     Returns a JSON object with brand details.
     """
-    if not client:
+    provider = get_provider()
+    if not provider:
         raise ValueError("GEMINI_API_KEY is not set")
 
     prompt = f"""
@@ -63,126 +70,142 @@ async def analyze_brand(text_content: str, visual_content_url: Optional[str] = N
     {text_content[:30000]} 
     """
 
-    contents = [prompt]
+    images = []
     
-    if visual_content_url:
+    if visual_media is not None:
+        images.append(visual_media.as_model_input())
+    elif visual_content_url:
         try:
-            logger.info(f"Fetching visual content from {visual_content_url}")
-            async with httpx.AsyncClient() as http_client:
-                 resp = await http_client.get(visual_content_url)
-                 resp.raise_for_status()
-                 image_data = resp.content
-                 # Pass image to Gemini
-                 contents.append(types.Part.from_bytes(data=image_data, mime_type="image/jpeg")) 
+            logger.info("Fetching visual content from %s", visual_content_url)
+            # Pass image to the model (real mime type, downscaled)
+            media = await open_media(visual_content_url)
+            images.append(media.as_model_input())
         except Exception as e:
-            logger.warning(f"Failed to fetch/process visual content for analysis: {e}")
+            logger.warning("Failed to fetch/process visual content for analysis: %s", e)
 
     try:
-        response = client.models.generate_content(
-            model='gemini-2.0-flash',
-            contents=contents,
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json"
-            )
-        )
-        text_response = response.text
+        with instrumentation.span("model.brand_analysis", **{"model": provider.text_model, "input.images": len(images)}), \
+                instrumentation.model_call_seconds.labels(operation="brand_analysis").time(), instrumentation.usage_operation("brand_analysis"):
+            text_response = await provider.generate_json(prompt, images=images)
         return json.loads(text_response.strip())
     except Exception as e:
-        logger.error(f"Error analyzing brand with Gemini: {e}")
+        logger.error("Error analyzing brand with Gemini: %s", e)
         raise
 
-async def generate_image(prompt: str, input_image: Optional[PILImage.Image] = None, image_saver: Optional[Callable[[bytes, str, str], str]] = None, aspect_ratio: str = "1:1") -> str:
+def _encode_png(image) -> bytes:
+    with instrumentation.image_encode_seconds.time():
+        buffer = BytesIO()
+        image.save(buffer, format='PNG')
+        return buffer.getvalue()
+
+def _save_image(data: bytes, content_type: str, image_saver: Optional[Callable[[bytes, str, str], str]]) -> str:
+    """Blocking (storage SDKs do network I/O): run it through asyncio.to_thread."""
+    filename = f"{uuid.uuid4()}.png"
+    # Use callback if provided, else fallback to local (for backward compatibility during migration)
+    # But ideally we always use the callback now.
+    if image_saver:
+        return image_saver(data, filename, content_type)
+
+    # Fallback Local Save (Legacy)
+    save_path = Path("generated_images") / filename
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    save_path.write_bytes(data)
+    return f"http://localhost:8000/images/{filename}"
+
+async def generate_image(prompt: str, input_image: Optional[MediaHandle] = None, image_saver: Optional[Callable[[bytes, str, str], str]] = None, aspect_ratio: str = "1:1", seed: Optional[int] = None, use_cache: bool = True) -> str:
     """
-    Generates an image based on the prompt using Gemini's Imagen 3 model via google-genai SDK.
-    If input_image is provided, it attempts to use it for image-to-image generation (if supported) 
-    or just uses the prompt derived from it.
+    Generates an image based on the prompt using the configured model provider (Gemini image model by default).
+    If input_image is provided, it is sent along as the visual reference (image-to-image).
+    Results are cached by (model, normalized prompt, aspect ratio, input image, seed); a hit is stored
+    again without calling the model. use_cache=False forces a fresh image (which then replaces the cached one).
     """
-    if not client:
+    provider = get_provider()
+    if not provider:
         raise ValueError("GEMINI_API_KEY is not set")
 
+    cache_key = None
+    if image_cache.enabled:
+        cache_key = image_cache_key(provider.image_model, prompt, aspect_ratio, input_image.sha256 if input_image else None, seed)
+        if use_cache:
+            cached = image_cache.get(cache_key)
+            if cached is not None:
+                logger.info("Image cache hit for prompt '%s'", prompt[:60], extra={"sampled": True})
+                # Zero-cost row, so the usage rollups show what the cache saved
+                instrumentation.usage_recorder.record(provider.image_model, images=1, cache_hit=True, operation="image")
+                return await asyncio.to_thread(_save_image, cached.data, cached.content_type, image_saver)
+        else:
+            instrumentation.image_cache_requests_total.labels(result="bypass").inc()
+
     try:
-        # Configuration for image generation
-        response = await client.aio.models.generate_content(
-            model='gemini-3-pro-image-preview', # or 'imagen-3.0-generate-001'
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                response_modalities=['Image'],
-                image_config=types.ImageConfig(
-                    aspect_ratio=aspect_ratio,
-                )
-            )
-        )
-
-        image = None
-        if response.parts:
-            for part in response.parts:
-                 if hasattr(part, 'inline_data') and part.inline_data:
-                     try:
-                         image_bytes = part.inline_data.data
-                         image = PILImage.open(BytesIO(image_bytes))
-                         break
-                     except Exception as img_e:
-                         logger.warning(f"Failed to process inline_data as image: {img_e}")
-                
-                 if hasattr(part, 'image') and part.image:
-                     image = part.image
-                     break
-
-        if not image:
-             if response.parts:
-                 logger.error(f"First part attributes: {dir(response.parts[0])}")
-             raise ValueError("No image found in response parts")
-
-        # Use callback if provided, else fallback to local (for backward compatibility during migration)
-        # But ideally we always use the callback now.
-        if image_saver:
-            img_byte_arr = BytesIO()
-            image.save(img_byte_arr, format='PNG')
-            img_byte_arr = img_byte_arr.getvalue()
-            
-            filename = f"{uuid.uuid4()}.png"
-            return image_saver(img_byte_arr, filename, "image/png")
-        
-        # Fallback Local Save (Legacy)
-        filename = f"{uuid.uuid4()}.png"
-        save_path = Path("generated_images") / filename
-        save_path.parent.mkdir(parents=True, exist_ok=True)
-        image.save(save_path)
-        return f"http://localhost:8000/images/{filename}"
+        with instrumentation.span("model.image", **{"model": provider.image_model, "image.aspect_ratio": aspect_ratio}), \
+                instrumentation.model_call_seconds.labels(operation="image").time(), instrumentation.usage_operation("image"):
+            image = await provider.generate_image(prompt, aspect_ratio=aspect_ratio, images=[input_image.as_model_input()] if input_image else None)
+
+        # Encode and upload off the event loop, so other requests and SSE streams keep flowing
+        img_byte_arr = await asyncio.to_thread(_encode_png, image)
+
+        if cache_key is not None:
+            image_cache.put(cache_key, img_byte_arr, "image/png")
+        return await asyncio.to_thread(_save_image, img_byte_arr, "image/png", image_saver)
 
     except Exception as e:
-        logger.error(f"Image Generation failed: {e}")
+        logger.error("Image Generation failed: %s", e)
+        instrumentation.placeholder_images_total.inc()
         encoded_prompt = urllib.parse.quote(prompt[:50])
         return f"https://placehold.co/1024x1024/png?text={encoded_prompt}&font=roboto"
 
-async def generate_post(brand_info: Dict[str, Any], prompt_details: str = "Create a generic promotional post", image_count: int = 1, input_image_url: Optional[str] = None, image_saver: Optional[Callable[[bytes, str, str], str]] = None, post_type: str = "POST", scheduled_at: Optional[Any] = None) -> Dict[str, Any]:
+def build_context_prefix(brand_info: Dict[str, Any], master_prompt: Optional[str] = None) -> str:
+    """
+    Builds the campaign-level prompt prefix (brand guidelines + master strategy).
+    It is identical for every post in a campaign, which makes it cacheable on the provider side.
+    """
+    prefix = f"""
+    CONTEXT:
+    {json.dumps(brand_info, indent=2) if brand_info else "No specific brand guidelines provided. Focus entirely on the POST DETAILS."}
+    """
+    if master_prompt:
+        prefix += f"""
+    MASTER STRATEGY:
+    {master_prompt}
+    """
+    return prefix
+
+async def invalidate_campaign_context(campaign_id: int):
+    """Drops the cached brand/strategy prefix of a campaign. Call whenever the brand or campaign changes."""
+    await context_cache.invalidate(get_provider(), campaign_id)
+
+async def generate_post(brand_info: Dict[str, Any], prompt_details: str = "Create a generic promotional post", image_count: int = 1, input_image_url: Optional[str] = None, image_saver: Optional[Callable[[bytes, str, str], str]] = None, post_type: str = "POST", scheduled_at: Optional[Any] = None, master_prompt: Optional[str] = None, campaign_id: Optional[int] = None, use_image_cache: bool = True, input_media: Optional[MediaHandle] = None) -> Dict[str, Any]:
     """
     Generates an Instagram caption and multiple image prompts/images.
-    If input_image_url is provided, it uses the image to guide the caption and image prompts.
+    If input_image_url is provided, it uses the image to guide the caption and image prompts; callers that
+    already resolved it (e.g. from their own storage, see execution.media.open_media) pass input_media instead.
+    If campaign_id is provided, the brand + master strategy prefix is uploaded once to the provider's
+    context cache and reused across all posts of the campaign.
+    use_image_cache=False regenerates every image even if an identical prompt was generated before.
     """
-    if not client:
+    provider = get_provider()
+    if not provider:
         raise ValueError("GEMINI_API_KEY is not set")
 
-    input_image_data = None
-    input_image_pil = None
-    if input_image_url:
+    # Loaded once; the caption call, every image call and the cache keys share this buffer
+    if input_media is None and input_image_url:
         try:
-            # Download the image
-            # Since we are local, if it's localhost, we can try to read file or just download
-            async with httpx.AsyncClient() as http_client:
-                resp = await http_client.get(input_image_url)
-                resp.raise_for_status()
-                input_image_data = resp.content
-                input_image_pil = PILImage.open(BytesIO(input_image_data))
+            input_media = await open_media(input_image_url)
         except Exception as e:
-            logger.error(f"Failed to download input image: {e}")
+            logger.error("Failed to download input image: %s", e)
 
-    prompt_text = f"""
-    Based on the following context and post details, generate an Instagram caption and {image_count} distinct image generation prompts.
+    context_prefix = build_context_prefix(brand_info, master_prompt)
+    cached_content = None
+    if campaign_id is not None:
+        cached_content = await context_cache.get_or_create(provider, campaign_id, context_prefix)
 
-    CONTEXT:
-    {json.dumps(brand_info, indent=2) if brand_info else "No specific brand guidelines provided. Focus entirely on the POST DETAILS."}
+    prompt_text = f"""
+    Based on the {"cached campaign context" if cached_content else "following context"} and post details, generate an Instagram caption and {image_count} distinct image generation prompts.
+    """
+    if not cached_content:
+        prompt_text += context_prefix
 
+    prompt_text += f"""
     POST DETAILS:
     - Content: {prompt_details}
     - Format: {post_type} (Tailor caption and visuals for this specific format)
@@ -190,7 +213,7 @@ async def generate_post(brand_info: Dict[str, Any], prompt_details: str = "Creat
 
     """
     
-    if input_image_data:
+    if input_media:
         prompt_text += "\n\nAn input image has been provided. \n1. Analyze this image and use it as the primary visual reference for the caption.\n2. For the 'image_prompts', describe how to EDIT or RECREATE this image to match the desired style better, or generate variations of it."
     
     prompt_text += f"""
@@ -214,21 +237,15 @@ async def generate_post(brand_info: Dict[str, Any], prompt_details: str = "Creat
         }}
         """
 
-    contents = [prompt_text]
-    if input_image_data:
-        # Pass the image to Gemini for analysis (Multimodal)
-        contents.append(types.Part.from_bytes(data=input_image_data, mime_type="image/jpeg")) # Assuming jpeg/png, API handles detection usually or strictly mime
+    images = []
+    if input_media:
+        # Pass the image to the model for analysis (Multimodal)
+        images.append(input_media.as_model_input())
 
     try:
-        response = await client.aio.models.generate_content(
-            model='gemini-2.0-flash', # Multimodal model for text/caption generation
-            contents=contents,
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json"
-            )
-        )
-        
-        text_response = response.text
+        with instrumentation.span("model.caption", **{"model": provider.text_model, "cache.hit": bool(cached_content), "input.images": len(images)}), \
+                instrumentation.model_call_seconds.labels(operation="caption").time(), instrumentation.usage_operation("caption"):
+            text_response = await provider.generate_json(prompt_text, images=images, cached_content=cached_content)
         try:
              result = json.loads(text_response.strip())
         except json.JSONDecodeError:
@@ -256,7 +273,7 @@ async def generate_post(brand_info: Dict[str, Any], prompt_details: str = "Creat
             final_prompts.append(variant_prompt)
             
         import asyncio
-        logger.info(f"Generating {len(final_prompts)} images in parallel...")
+        logger.info("Generating %s images in parallel...", len(final_prompts), extra={"sampled": True})
         
         # Determine aspect ratio based on post type
         # POST/FEED -> 1:1, STORY/REEL -> 9:16
@@ -264,7 +281,12 @@ async def generate_post(brand_info: Dict[str, Any], prompt_details: str = "Creat
         if post_type.upper() in ["STORY", "REEL"]:
             aspect_ratio = "9:16"
 
-        tasks = [generate_image(prompt, input_image=input_image_pil if input_image_data else None, image_saver=image_saver, aspect_ratio=aspect_ratio) for prompt in final_prompts]
+        # The slot index is the seed: identical prompts within a post still get distinct images
+        tasks = [
+            generate_image(prompt, input_image=input_media, image_saver=image_saver, aspect_ratio=aspect_ratio,
+                           seed=index, use_cache=use_image_cache)
+            for index, prompt in enumerate(final_prompts)
+        ]
         generated_urls = await asyncio.gather(*tasks)
 
         result["image_urls"] = generated_urls 
@@ -273,5 +295,5 @@ async def generate_post(brand_info: Dict[str, Any], prompt_details: str = "Creat
             
         return result
     except Exception as e:
-        logger.error(f"Error generating post content with Gemini: {e}")
+        logger.error("Error generating post content with Gemini: %s", e)
         raise
@@ -0,0 +1,78 @@
+import os
+import json
+import hashlib
+import logging
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+from execution.instrumentation import instrumentation
+
+logger = logging.getLogger(__name__)
+
+# Memory budget for cached image results (encoded bytes). 0 disables the cache.
+IMAGE_CACHE_MAX_MB = float(os.getenv("IMAGE_CACHE_MAX_MB", "128"))
+
+
+@dataclass
+class CachedImage:
+    data: bytes
+    content_type: str
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Whitespace/Unicode-insensitive form of a prompt; wording and case are left alone since they change the image."""
+    return " ".join(unicodedata.normalize("NFC", prompt).split())
+
+
+def image_cache_key(model: str, prompt: str, aspect_ratio: str, input_hash: Optional[str] = None, seed: Optional[int] = None) -> str:
+    """input_hash: sha256 of the (downscaled) input image bytes, see MediaHandle.sha256."""
+    material = json.dumps([model, normalize_prompt(prompt), aspect_ratio, input_hash, seed])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ImageResultCache:
+    """
+    LRU cache of generated images, bounded by total encoded size. Holds the bytes rather than the
+    stored URL: a hit is saved again under a new name, so it never points at an object the storage
+    GC removed with the post that first used it.
+    """
+    def __init__(self, max_bytes: int = int(IMAGE_CACHE_MAX_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, CachedImage]" = OrderedDict()
+        self._size = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, key: str) -> Optional[CachedImage]:
+        entry = self._entries.get(key)
+        if entry is None:
+            instrumentation.image_cache_requests_total.labels(result="miss").inc()
+            return None
+        self._entries.move_to_end(key)
+        instrumentation.image_cache_requests_total.labels(result="hit").inc()
+        return entry
+
+    def put(self, key: str, data: bytes, content_type: str):
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous.data)
+        self._entries[key] = CachedImage(data, content_type)
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted.data)
+            instrumentation.image_cache_evictions_total.inc()
+        instrumentation.image_cache_bytes.set(self._size)
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+        instrumentation.image_cache_bytes.set(0)
+
+
+image_cache = ImageResultCache()
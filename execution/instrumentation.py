@@ -0,0 +1,77 @@
+from contextlib import nullcontext
+from typing import Any, Callable, Optional
+
+
+class _NoopMetric:
+    """Takes the prometheus_client Counter/Gauge/Histogram calls the pipeline makes and drops them."""
+    def labels(self, *args, **kwargs) -> "_NoopMetric":
+        return self
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def set(self, value: float):
+        pass
+
+    def observe(self, value: float):
+        pass
+
+    def time(self):
+        return nullcontext()
+
+
+class _NoopUsageRecorder:
+    def record(self, model: str, **kwargs):
+        pass
+
+    def record_response(self, model: str, usage_metadata: Any, images: int = 0):
+        pass
+
+
+def _noop_span(name: str, context: Optional[Any] = None, **attributes):
+    return nullcontext()
+
+
+def _noop_operation(name: str):
+    return nullcontext()
+
+
+class Instrumentation:
+    """
+    Metrics, spans and model usage reporting for the execution package. Everything is a no-op until
+    the host installs its own (backend.main wires in its Prometheus metrics, tracer and usage recorder),
+    so execution never imports the backend and runs standalone in scripts.
+    """
+    METRICS = (
+        "model_call_seconds",
+        "image_encode_seconds",
+        "placeholder_images_total",
+        "scraper_fetch_seconds",
+        "image_cache_requests_total",
+        "image_cache_evictions_total",
+        "image_cache_bytes",
+    )
+
+    def __init__(self):
+        for name in self.METRICS:
+            setattr(self, name, _NoopMetric())
+        self.usage_recorder = _NoopUsageRecorder()
+        self.span: Callable = _noop_span
+        self.usage_operation: Callable = _noop_operation
+
+    def install(self, usage_recorder=None, span: Optional[Callable] = None, usage_operation: Optional[Callable] = None, **metrics):
+        """Metrics are passed by their lowercase METRICS name; anything not given keeps its current hook."""
+        unknown = set(metrics) - set(self.METRICS)
+        if unknown:
+            raise ValueError(f"Unknown metrics: {', '.join(sorted(unknown))}")
+        for name, metric in metrics.items():
+            setattr(self, name, metric)
+        if usage_recorder is not None:
+            self.usage_recorder = usage_recorder
+        if span is not None:
+            self.span = span
+        if usage_operation is not None:
+            self.usage_operation = usage_operation
+
+
+instrumentation = Instrumentation()
@@ -0,0 +1,119 @@
+import os
+import asyncio
+import hashlib
+import logging
+import mimetypes
+from dataclasses import dataclass, field
+from functools import cached_property
+from io import BytesIO
+from typing import Any, Optional
+import httpx
+from execution.model_provider import ImageInput
+
+logger = logging.getLogger(__name__)
+
+# Longest side sent to the models; larger inputs cost upload time and tokens without improving results
+MODEL_INPUT_MAX_DIMENSION = int(os.getenv("MODEL_INPUT_MAX_DIMENSION", "1536"))
+MEDIA_FETCH_TIMEOUT = float(os.getenv("MEDIA_FETCH_TIMEOUT", "30"))
+
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def sniff_mime_type(data: bytes, fallback: Optional[str] = None) -> str:
+    """Mime type from the file's magic bytes; the URL's extension or a server header can be wrong."""
+    for signature, mime_type in _SIGNATURES:
+        if data.startswith(signature):
+            return mime_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1"):
+        return "image/heic"
+    return fallback or "application/octet-stream"
+
+
+@dataclass
+class MediaHandle:
+    """
+    An input image loaded once and shared by every stage that needs it (caption prompt, image
+    generation, cache keys). `data` is already downscaled to the models' useful resolution.
+    """
+    url: str
+    data: bytes
+    mime_type: str
+    original_size: int = field(default=0)
+
+    @property
+    def filename(self) -> str:
+        """Name to upload the bytes under: the URL's last segment, with an extension matching mime_type."""
+        name = self.url.split("?", 1)[0].rstrip("/").rsplit("/", 1)[-1] or "image"
+        if mimetypes.guess_type(name)[0] != self.mime_type:
+            name = f"{name.rsplit('.', 1)[0]}{mimetypes.guess_extension(self.mime_type) or ''}"
+        return name
+
+    @cached_property
+    def sha256(self) -> str:
+        return hashlib.sha256(self.data).hexdigest()
+
+    def as_model_input(self) -> ImageInput:
+        return (self.data, self.mime_type)
+
+
+def _downscale(data: bytes, mime_type: str, max_dimension: int):
+    """Re-encodes an image whose longest side exceeds max_dimension. Returns (data, mime_type) unchanged otherwise."""
+    from PIL import Image as PILImage, ImageOps
+    try:
+        image = PILImage.open(BytesIO(data))
+        # Only the header has been read so far: small images are never decoded
+        if max(image.size) <= max_dimension:
+            return data, mime_type
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_dimension, max_dimension), PILImage.LANCZOS)
+    except Exception as e:
+        logger.warning("Could not downscale input image (%s), sending it as is: %s", mime_type, e)
+        return data, mime_type
+
+    buffer = BytesIO()
+    if image.mode in ("RGBA", "LA", "P"):
+        image.save(buffer, format="PNG", optimize=True)
+        return buffer.getvalue(), "image/png"
+    image.convert("RGB").save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue(), "image/jpeg"
+
+
+async def _fetch(url: str, storage: Optional[Any], client: Optional[httpx.AsyncClient] = None) -> tuple:
+    """Returns (bytes, declared mime type). Our own storage objects are read directly instead of over HTTP."""
+    key = storage.object_key(url) if storage is not None else None
+    if key is not None:
+        try:
+            return await asyncio.to_thread(storage.read, key), mimetypes.guess_type(key)[0]
+        except Exception as e:
+            logger.warning("Reading %s from storage failed, falling back to HTTP: %s", key, e)
+
+    if client is None:
+        async with httpx.AsyncClient(timeout=MEDIA_FETCH_TIMEOUT, follow_redirects=True) as own_client:
+            return await _fetch(url, None, own_client)
+    resp = await client.get(url)
+    resp.raise_for_status()
+    declared = resp.headers.get("content-type", "").split(";", 1)[0].strip() or None
+    return resp.content, declared
+
+
+async def open_media(url: str, storage: Optional[Any] = None, max_dimension: int = MODEL_INPUT_MAX_DIMENSION, client: Optional[httpx.AsyncClient] = None) -> MediaHandle:
+    """
+    Loads an image once for every stage that needs it: from `storage` when the URL is one of ours,
+    else via HTTP (on `client` when given); with its real mime type, and downscaled once if larger
+    than max_dimension. Publishing passes max_dimension=0 to send the original bytes.
+    """
+    data, declared = await _fetch(url, storage, client)
+    mime_type = sniff_mime_type(data, declared or mimetypes.guess_type(url.split("?", 1)[0])[0])
+    original_size = len(data)
+    if max_dimension > 0 and mime_type.startswith("image/"):
+        data, mime_type = await asyncio.to_thread(_downscale, data, mime_type, max_dimension)
+    if len(data) != original_size:
+        logger.info("Downscaled input image %s from %s to %s bytes", url, original_size, len(data), extra={"sampled": True})
+    return MediaHandle(url=url, data=data, mime_type=mime_type, original_size=original_size)
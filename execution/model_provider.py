@@ -0,0 +1,249 @@
+import os
+import re
+import json
+import random
+import asyncio
+import hashlib
+import logging
+from abc import ABC, abstractmethod
+from io import BytesIO
+from typing import TYPE_CHECKING, List, Optional, Tuple
+from execution.instrumentation import instrumentation
+
+if TYPE_CHECKING:
+    from PIL import Image as PILImage
+
+logger = logging.getLogger(__name__)
+
+# (bytes, mime_type) pairs passed alongside a prompt
+ImageInput = Tuple[bytes, str]
+
+
+class ModelProvider(ABC):
+    """
+    Interface between the generation pipeline and the model backend.
+    Implementations return raw JSON text for text/multimodal calls and a PIL image for image calls,
+    and report each call's token usage to instrumentation.usage_recorder.
+    """
+    text_model: str = ""
+    image_model: str = ""
+
+    @abstractmethod
+    async def generate_json(self, prompt: str, images: Optional[List[ImageInput]] = None, cached_content: Optional[str] = None) -> str:
+        """Runs a text/multimodal prompt and returns the JSON text response"""
+        pass
+
+    @abstractmethod
+    async def generate_image(self, prompt: str, aspect_ratio: str = "1:1", images: Optional[List[ImageInput]] = None) -> "PILImage.Image":
+        """Generates a single image for the prompt, using `images` as visual references when given"""
+        pass
+
+    async def create_context_cache(self, prefix: str, ttl: int) -> Optional[str]:
+        """Uploads a reusable prompt prefix and returns its handle. None means caching is unsupported."""
+        return None
+
+    async def delete_context_cache(self, name: str):
+        pass
+
+
+class GeminiModelProvider(ModelProvider):
+    def __init__(self, api_key: str, client=None):
+        from execution.gemini_client import AsyncGeminiClient
+        self.client = AsyncGeminiClient(api_key, client=client)
+        self.text_model = os.getenv("GEMINI_CAPTION_MODEL", "gemini-2.0-flash")
+        self.image_model = os.getenv("GEMINI_IMAGE_MODEL", "gemini-3-pro-image-preview")
+
+    async def generate_json(self, prompt: str, images: Optional[List[ImageInput]] = None, cached_content: Optional[str] = None) -> str:
+        from google.genai import types
+        contents = [prompt]
+        for data, mime_type in images or []:
+            contents.append(types.Part.from_bytes(data=data, mime_type=mime_type))
+
+        response = await self.client.generate_content(
+            model=self.text_model,
+            contents=contents,
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                cached_content=cached_content
+            )
+        )
+        instrumentation.usage_recorder.record_response(self.text_model, response.usage_metadata)
+        return response.text
+
+    async def generate_image(self, prompt: str, aspect_ratio: str = "1:1", images: Optional[List[ImageInput]] = None) -> "PILImage.Image":
+        from google.genai import types
+        from PIL import Image as PILImage
+        contents = [prompt]
+        for data, mime_type in images or []:
+            contents.append(types.Part.from_bytes(data=data, mime_type=mime_type))
+        response = await self.client.generate_image_content(
+            model=self.image_model,
+            contents=contents if images else prompt,
+            config=types.GenerateContentConfig(
+                response_modalities=['Image'],
+                image_config=types.ImageConfig(
+                    aspect_ratio=aspect_ratio,
+                )
+            )
+        )
+        instrumentation.usage_recorder.record_response(self.image_model, response.usage_metadata, images=1)
+
+        if response.parts:
+            for part in response.parts:
+                if hasattr(part, 'inline_data') and part.inline_data:
+                    try:
+                        return PILImage.open(BytesIO(part.inline_data.data))
+                    except Exception as img_e:
+                        logger.warning("Failed to process inline_data as image: %s", img_e)
+
+                if hasattr(part, 'image') and part.image:
+                    return part.image
+
+            logger.error("First part attributes: %s", dir(response.parts[0]))
+        raise ValueError("No image found in response parts")
+
+    async def create_context_cache(self, prefix: str, ttl: int) -> Optional[str]:
+        from google.genai import types
+        cached = await self.client.create_cache(
+            model=self.text_model,
+            config=types.CreateCachedContentConfig(
+                contents=[types.Content(role="user", parts=[types.Part.from_text(text=prefix)])],
+                ttl=f"{ttl}s",
+            )
+        )
+        return cached.name
+
+    async def delete_context_cache(self, name: str):
+        await self.client.delete_cache(name)
+
+
+class StubModelError(RuntimeError):
+    pass
+
+
+class LatencyModel:
+    """Samples synthetic call latencies. Distributions: fixed, uniform (mean ± jitter), lognormal (median=mean, sigma=jitter)."""
+    def __init__(self, mean_ms: float, distribution: str = "lognormal", jitter: float = 0.3):
+        self.mean_ms = mean_ms
+        self.distribution = distribution
+        self.jitter = jitter
+
+    def sample(self, rng: random.Random) -> float:
+        if self.mean_ms <= 0:
+            return 0.0
+        if self.distribution == "fixed":
+            ms = self.mean_ms
+        elif self.distribution == "uniform":
+            ms = rng.uniform(self.mean_ms * (1 - self.jitter), self.mean_ms * (1 + self.jitter))
+        else:
+            ms = rng.lognormvariate(0, self.jitter) * self.mean_ms
+        return max(ms, 0.0) / 1000.0
+
+
+class LocalStubModelProvider(ModelProvider):
+    """
+    Deterministic offline backend for load testing the pipeline without spending quota.
+    Returns synthetic captions and procedurally generated images after a sampled latency,
+    failing with the configured probability.
+    """
+    text_model = "stub-text"
+    image_model = "stub-image"
+
+    def __init__(self, text_latency: LatencyModel, image_latency: LatencyModel, text_error_rate: float = 0.0, image_error_rate: float = 0.0, seed: int = 0):
+        self.text_latency = text_latency
+        self.image_latency = image_latency
+        self.text_error_rate = text_error_rate
+        self.image_error_rate = image_error_rate
+        self.rng = random.Random(seed)
+
+    async def _simulate(self, latency: LatencyModel, error_rate: float, what: str):
+        await asyncio.sleep(latency.sample(self.rng))
+        if error_rate and self.rng.random() < error_rate:
+            raise StubModelError(f"Synthetic {what} failure")
+
+    @staticmethod
+    def _tokens(text: str) -> int:
+        return len(text) // 4 + 1
+
+    async def generate_json(self, prompt: str, images: Optional[List[ImageInput]] = None, cached_content: Optional[str] = None) -> str:
+        await self._simulate(self.text_latency, self.text_error_rate, "text")
+        response = self._respond(prompt)
+        # Rough Gemini-like accounting: ~4 chars per token, 258 tokens per input image
+        instrumentation.usage_recorder.record(self.text_model, input_tokens=self._tokens(prompt) + 258 * len(images or []), output_tokens=self._tokens(response))
+        return response
+
+    def _respond(self, prompt: str) -> str:
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+        # Brand analysis prompts are the only ones that don't ask for image prompts
+        if "image_prompts" not in prompt:
+            return json.dumps({
+                "brand_name": f"Stub Brand {digest}",
+                "brand_voice": "Friendly and concise.",
+                "target_audience": "Load test audience.",
+                "color_palette": [f"#{digest[:6]}", "#FFFFFF", "#111111"],
+                "visual_style_description": "Flat geometric shapes over a gradient.",
+                "nano_banana_prompt_suffix": "Style: Flat. Colors: Gradient.",
+                "keywords": ["stub", "offline", digest]
+            })
+
+        match = re.search(r"and (\d+) distinct image generation prompts", prompt)
+        count = int(match.group(1)) if match else 1
+        return json.dumps({
+            "caption": f"Synthetic caption {digest} ✨ #stub #loadtest",
+            "image_prompts": [f"Synthetic scene {digest}-{i + 1}" for i in range(count)]
+        })
+
+    async def generate_image(self, prompt: str, aspect_ratio: str = "1:1", images: Optional[List[ImageInput]] = None) -> "PILImage.Image":
+        await self._simulate(self.image_latency, self.image_error_rate, "image")
+        instrumentation.usage_recorder.record(self.image_model, input_tokens=self._tokens(prompt) + 258 * len(images or []), output_tokens=1290, images=1)
+        return await asyncio.to_thread(self._render, prompt, aspect_ratio)
+
+    async def create_context_cache(self, prefix: str, ttl: int) -> Optional[str]:
+        return f"stub-cache/{hashlib.sha256(prefix.encode('utf-8')).hexdigest()[:16]}"
+
+    @staticmethod
+    def _render(prompt: str, aspect_ratio: str) -> "PILImage.Image":
+        """Procedural image seeded by the prompt: two-colour gradient plus a few shapes."""
+        from PIL import Image as PILImage, ImageDraw
+        width, height = (576, 1024) if aspect_ratio == "9:16" else (1024, 1024)
+        seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+        rng = random.Random(seed)
+
+        start = tuple(rng.randrange(256) for _ in range(3))
+        end = tuple(rng.randrange(256) for _ in range(3))
+        mask = PILImage.linear_gradient("L").resize((width, height))
+        image = PILImage.composite(PILImage.new("RGB", (width, height), end), PILImage.new("RGB", (width, height), start), mask)
+
+        draw = ImageDraw.Draw(image)
+        for _ in range(6):
+            x0, y0 = rng.randrange(width), rng.randrange(height)
+            size = rng.randrange(40, width // 2)
+            color = tuple(rng.randrange(256) for _ in range(3))
+            if rng.random() < 0.5:
+                draw.ellipse([x0, y0, x0 + size, y0 + size], fill=color)
+            else:
+                draw.rectangle([x0, y0, x0 + size, y0 + size], fill=color)
+        draw.text((24, height - 48), prompt[:60], fill=(255, 255, 255))
+        return image
+
+
+def get_model_provider() -> Optional[ModelProvider]:
+    provider_type = os.getenv("MODEL_PROVIDER", "gemini").lower()
+
+    if provider_type == "stub":
+        distribution = os.getenv("STUB_LATENCY_DISTRIBUTION", "lognormal")
+        jitter = float(os.getenv("STUB_LATENCY_JITTER", "0.3"))
+        logger.info("Using local stub model provider (no Gemini calls will be made)")
+        return LocalStubModelProvider(
+            text_latency=LatencyModel(float(os.getenv("STUB_TEXT_LATENCY_MS", "800")), distribution, jitter),
+            image_latency=LatencyModel(float(os.getenv("STUB_IMAGE_LATENCY_MS", "4000")), distribution, jitter),
+            text_error_rate=float(os.getenv("STUB_TEXT_ERROR_RATE", "0")),
+            image_error_rate=float(os.getenv("STUB_IMAGE_ERROR_RATE", "0")),
+            seed=int(os.getenv("STUB_SEED", "0"))
+        )
+
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        logger.warning("GEMINI_API_KEY not set in environment variables")
+        return None
+    return GeminiModelProvider(api_key)
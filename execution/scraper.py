@@ -1,5 +1,6 @@
 import httpx
 import logging
+from execution.instrumentation import instrumentation
 
 logger = logging.getLogger(__name__)
 
@@ -13,14 +14,15 @@ async def fetch_website_content(url: str) -> str:
     }
     
     try:
-        async with httpx.AsyncClient(follow_redirects=True, timeout=30.0, headers=headers, verify=False) as client:
-            response = await client.get(url)
-            response.raise_for_status()
-            return response.text
+        with instrumentation.scraper_fetch_seconds.time():
+            async with httpx.AsyncClient(follow_redirects=True, timeout=30.0, headers=headers, verify=False) as client:
+                response = await client.get(url)
+                response.raise_for_status()
+                return response.text
 
     except httpx.HTTPStatusError as e:
-        logger.error(f"HTTP error occurred while fetching {url}: {e}")
+        logger.error("HTTP error occurred while fetching %s: %s", url, e)
         return f"Error fetching details from {url}: {e}"
     except Exception as e:
-        logger.error(f"An error occurred while fetching {url}: {e}")
+        logger.error("An error occurred while fetching %s: %s", url, e)
         return f"Error fetching details from {url}: {e}"
@@ -0,0 +1,52 @@
+"""
+Writes precompressed .gz (and .br, if the `brotli` package is installed) siblings for the
+dashboard build so the backend can serve them without compressing per request.
+
+Usage:
+    python scripts/precompress_dist.py [apps/dashboard/dist]
+"""
+import os
+import sys
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = {".html", ".js", ".mjs", ".css", ".svg", ".json", ".map", ".txt", ".xml", ".wasm", ".ico"}
+# Below this the headers cost more than the savings
+MIN_SIZE = 1024
+
+
+def precompress(root: str):
+    written = 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE:
+                continue
+            path = os.path.join(dirpath, name)
+            with open(path, "rb") as f:
+                data = f.read()
+            if len(data) < MIN_SIZE:
+                continue
+
+            # mtime=0 keeps the output byte-identical between builds
+            gz = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(gz) < len(data):
+                with open(path + ".gz", "wb") as f:
+                    f.write(gz)
+                written += 1
+
+            if brotli is not None:
+                br = brotli.compress(data, quality=11)
+                if len(br) < len(data):
+                    with open(path + ".br", "wb") as f:
+                        f.write(br)
+                    written += 1
+
+    print(f"Wrote {written} precompressed files in {root}" + ("" if brotli else " (brotli not installed, gzip only)"))
+
+
+if __name__ == "__main__":
+    precompress(sys.argv[1] if len(sys.argv) > 1 else "apps/dashboard/dist")
@@ -0,0 +1,107 @@
+"""
+The event loop stays responsive while a brand analysis is in flight.
+
+Runs `generator.analyze_brand` through the real GeminiModelProvider / AsyncGeminiClient stack with
+the google-genai client replaced by a slow fake exposing both SDK surfaces:
+
+  - client.aio.models.generate_content: awaits (what AsyncGeminiClient must use)
+  - client.models.generate_content:     blocks the thread (what analyze_brand used to call)
+
+A ticker task runs alongside the analysis; if any Gemini call takes a blocking path again, the
+ticker stalls for the whole fake call and the test fails. No network or keys needed.
+"""
+import json
+import time
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("google.genai")
+pytest.importorskip("httpx")
+
+from execution import generator
+from execution.model_provider import GeminiModelProvider
+
+CALL_SECONDS = 1.0
+TICK_SECONDS = 0.01
+MAX_STALL_SECONDS = 0.2
+
+BRAND_RESPONSE = json.dumps({
+    "brand_name": "Check Brand",
+    "brand_voice": "Calm.",
+    "target_audience": "Operators.",
+    "color_palette": ["#000000", "#FFFFFF", "#FF0000"],
+    "visual_style_description": "Minimal.",
+    "nano_banana_prompt_suffix": "Style: Minimal. Colors: Mono.",
+    "keywords": ["check"]
+})
+
+
+class _SlowModels:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.calls = 0
+
+    def _response(self):
+        self.calls += 1
+        return SimpleNamespace(text=BRAND_RESPONSE, usage_metadata=None, parts=[])
+
+
+class _BlockingModels(_SlowModels):
+    def generate_content(self, **kwargs):
+        time.sleep(self.delay)
+        return self._response()
+
+
+class _AsyncModels(_SlowModels):
+    async def generate_content(self, **kwargs):
+        await asyncio.sleep(self.delay)
+        return self._response()
+
+
+class FakeGenaiClient:
+    """Stands in for google.genai.Client: same `models` / `aio.models` layout, no network."""
+    def __init__(self, delay: float):
+        self.models = _BlockingModels(delay)
+        self.aio = SimpleNamespace(models=_AsyncModels(delay))
+
+
+async def _analyze_with_ticker():
+    gaps = []
+    done = asyncio.Event()
+
+    async def ticker():
+        last = time.perf_counter()
+        while not done.is_set():
+            await asyncio.sleep(TICK_SECONDS)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+
+    ticks = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    try:
+        result = await generator.analyze_brand("Check brand. We sell calm software to operators.")
+    finally:
+        done.set()
+        await ticks
+    return result, time.perf_counter() - started, gaps
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    fake = FakeGenaiClient(CALL_SECONDS)
+    monkeypatch.setattr(generator, "_provider", GeminiModelProvider("test-key", client=fake))
+    monkeypatch.setattr(generator, "_provider_loaded", True)
+    return fake
+
+
+def test_analyze_brand_does_not_block_event_loop(fake_client):
+    result, elapsed, gaps = asyncio.run(_analyze_with_ticker())
+
+    assert result.get("brand_name") == "Check Brand"
+    assert fake_client.models.calls == 0, "a Gemini call went through the blocking client.models surface"
+    assert fake_client.aio.models.calls >= 1
+    assert max(gaps, default=0.0) <= MAX_STALL_SECONDS, f"event loop stalled for {max(gaps) * 1000:.0f} ms"
+    assert len(gaps) >= int(elapsed / TICK_SECONDS) // 2, "ticker stopped advancing during the call"
@@ -0,0 +1,31 @@
+"""
+Cold-import budget for the API entry point (see scripts/import_time.py for the detailed report).
+IMPORT_TIME_BUDGET_MS overrides the budget on slow CI machines.
+"""
+import os
+
+import pytest
+
+for module in ("fastapi", "asyncpg", "prometheus_client", "httpx"):
+    pytest.importorskip(module)
+
+from scripts.import_time import DEFERRED_MODULES, measure
+
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "1500"))
+RUNS = 3
+
+
+@pytest.fixture(scope="module")
+def best_run():
+    return min((measure("backend.main") for _ in range(RUNS)), key=lambda run: run[0])
+
+
+def test_deferred_modules_not_imported(best_run):
+    _, modules = best_run
+    leaked = [m for m in DEFERRED_MODULES if m in modules]
+    assert not leaked, f"deferred modules imported eagerly by backend.main: {', '.join(leaked)}"
+
+
+def test_import_within_budget(best_run):
+    total_us, _ = best_run
+    assert total_us / 1000 <= IMPORT_TIME_BUDGET_MS, f"backend.main imports in {total_us / 1000:.1f} ms (budget {IMPORT_TIME_BUDGET_MS} ms)"